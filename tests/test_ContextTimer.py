@@ -34,8 +34,11 @@ import faulthandler
 faulthandler.enable()
 
 import time
+import statistics
 import torchbraid.utils as utils
 
+from mpi4py import MPI
+
 class TestContextTimer(unittest.TestCase):
 
   def test_ContextTiming_exception(self):
@@ -63,7 +66,7 @@ class TestContextTimer(unittest.TestCase):
 
      self.assertTrue(not clock.isTiming())
      self.assertTrue(clock.getName()=="hello")
-     self.assertTrue(len(clock.getTimes())==0)
+     self.assertTrue(clock.getCount()==0)
 
      for i in range(5):
        clock_timing_in_context = None
@@ -74,7 +77,7 @@ class TestContextTimer(unittest.TestCase):
 
      self.assertTrue(not clock.isTiming())
      self.assertTrue(clock.getName()=="hello")
-     self.assertTrue(len(clock.getTimes())==5)
+     self.assertTrue(clock.getCount()==5)
 
      self.assertTrue(len(mgr.getTimers())==1)
 
@@ -88,12 +91,103 @@ class TestContextTimer(unittest.TestCase):
 
      self.assertTrue(not clock_save.isTiming())
      self.assertTrue(clock_save.getName()=="cat")
-     self.assertTrue(len(clock_save.getTimes())==5)
+     self.assertTrue(clock_save.getCount()==5)
 
      self.assertTrue(len(mgr.getTimers())==2)
 
+     self.assertTrue(clock.getMin()<=clock.getMean())
+     self.assertTrue(clock.getMean()<=clock.getMax())
+     self.assertAlmostEqual(clock.getTotal(),5*clock.getMean())
+
      print(mgr.getResultString())
   # end test_ContextTiming(self):
+
+  def test_ContextTiming_statistics(self):
+     times = [0.5,1.0,2.0,4.0]
+     stats = utils.TimerStatistics()
+     for t in times:
+       stats.add(t)
+
+     self.assertEqual(stats.count,4)
+     self.assertEqual(stats.total,7.5)
+     self.assertEqual(stats.min,0.5)
+     self.assertEqual(stats.max,4.0)
+     self.assertAlmostEqual(stats.mean,statistics.mean(times))
+     self.assertAlmostEqual(stats.getStdev(),statistics.stdev(times))
+  # end test_ContextTiming_statistics
+
+  def test_ContextTiming_tree(self):
+     mgr = utils.ContextTimerManager()
+
+     for i in range(3):
+       with mgr.timer("outer"):
+         with mgr.timer("inner"):
+           pass
+         with mgr.timer("other"):
+           with mgr.timer("inner"):
+             pass
+
+     result = mgr.getResultDict()
+     self.assertEqual(result['timers']['inner']['count'],6)
+
+     tree = result['tree']
+     self.assertEqual(list(tree.keys()),['outer'])
+     self.assertEqual(tree['outer']['count'],3)
+     self.assertEqual(tree['outer']['children']['inner']['count'],3)
+     self.assertEqual(tree['outer']['children']['other']['children']['inner']['count'],3)
+
+     self.assertTrue(len(mgr.getResultJSON())>0)
+     self.assertTrue(len(mgr.getTreeString())>0)
+  # end test_ContextTiming_tree
+
+  def test_ContextTiming_disabled(self):
+     mgr = utils.ContextTimerManager()
+     mgr.setEnabled(False)
+
+     with mgr.timer("hello") as clock:
+       self.assertTrue(not clock.isTiming())
+
+     self.assertEqual(len(mgr.getTimers()),0)
+
+     mgr.setEnabled(True)
+     with mgr.timer("hello"):
+       pass
+     self.assertEqual(len(mgr.getTimers()),1)
+  # end test_ContextTiming_disabled
+
+  def test_ContextTiming_reduce(self):
+     comm = MPI.COMM_WORLD
+     my_rank = comm.Get_rank()
+     num_ranks = comm.Get_size()
+
+     # the last rank is the straggler, and only rank 0 has the 'root' timer
+     mgr = utils.ContextTimerManager()
+     for i in range(2):
+       with mgr.timer("work"):
+         time.sleep(0.01 if my_rank<num_ranks-1 else 0.05)
+     if my_rank==0:
+       with mgr.timer("root"):
+         pass
+
+     reduced = mgr.reduceTimers(comm)
+
+     self.assertEqual(sorted(reduced.keys()),['root','work'])
+     self.assertEqual(reduced['work']['count'],2*num_ranks)
+     self.assertEqual(reduced['root']['count'],1)
+     self.assertEqual(reduced['work']['slowest_rank'],num_ranks-1)
+     self.assertEqual(reduced['root']['slowest_rank'],0)
+     self.assertTrue(reduced['work']['imbalance']>=1.0)
+     self.assertTrue(reduced['work']['min_total']<=reduced['work']['avg_total'])
+     self.assertTrue(reduced['work']['avg_total']<=reduced['work']['max_total'])
+
+     # the table has a row for each timer, with its count and slowest rank
+     lines = mgr.getReducedResultString(comm).splitlines()
+     self.assertEqual(len(lines),4)
+     self.assertTrue('slowest rank' in lines[0])
+     work = [l for l in lines if l.split()[0]=='work'][0]
+     self.assertEqual(int(work.split('||')[1].split('|')[0]),2*num_ranks)
+     self.assertEqual(int(work.split('|')[-2]),num_ranks-1)
+  # end test_ContextTiming_reduce
 # end TestTimerContext
 
 if __name__ == '__main__':
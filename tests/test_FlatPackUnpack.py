@@ -73,5 +73,21 @@ class TestFlatPackUnpack(unittest.TestCase):
      self.assertEqual(torch.norm(t1_u-t1).item(),0.0)
      self.assertEqual(torch.norm(t2_u-t2).item(),0.0)
 
+  def test_packPreallocated(self):
+     t0 = torch.randn(9,2,3)
+     t1 = torch.randn(2,5)
+
+     buf = np.empty(utils.buffer_size([t0,t1]))
+     out = utils.pack_buffer([t0,t1],buf)
+     self.assertTrue(out is buf)
+
+     t0_u = torch.zeros(9,2,3)
+     t1_u = torch.zeros(2,5)
+
+     utils.unpack_buffer([t0_u,t1_u],buf)
+
+     self.assertEqual(torch.norm(t0_u-t0).item(),0.0)
+     self.assertEqual(torch.norm(t1_u-t1).item(),0.0)
+
 if __name__ == '__main__':
   unittest.main()
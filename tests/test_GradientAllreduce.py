@@ -0,0 +1,109 @@
+#@HEADER
+# ************************************************************************
+# 
+#                        Torchbraid v. 0.1
+# 
+# Copyright 2020 National Technology & Engineering Solutions of Sandia, LLC 
+# (NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S. 
+# Government retains certain rights in this software.
+# 
+# Torchbraid is licensed under 3-clause BSD terms of use:
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+# 
+# 3. Neither the name National Technology & Engineering Solutions of Sandia, 
+# LLC nor the names of the contributors may be used to endorse or promote 
+# products derived from this software without specific prior written permission.
+# 
+# Questions? Contact Eric C. Cyr (eccyr@sandia.gov)
+# 
+# ************************************************************************
+#@HEADER
+
+import unittest
+import faulthandler
+faulthandler.enable()
+
+import torch
+import torchbraid.utils as utils
+
+from mpi4py import MPI
+
+class TestGradientAllreduce(unittest.TestCase):
+
+  def test_splitCommunicator(self):
+    comm = MPI.COMM_WORLD
+    rank = comm.Get_rank()
+    size = comm.Get_size()
+
+    time_comm,data_comm = utils.split_communicator(comm,1)
+    self.assertEqual(time_comm.Get_size(),1)
+    self.assertEqual(data_comm.Get_size(),size)
+    self.assertEqual(data_comm.Get_rank(),rank)
+
+    time_comm,data_comm = utils.split_communicator(comm,size)
+    self.assertEqual(time_comm.Get_size(),size)
+    self.assertEqual(time_comm.Get_rank(),rank)
+    self.assertEqual(data_comm.Get_size(),1)
+
+    if size % 2!=0:
+      with self.assertRaises(ValueError):
+        utils.split_communicator(comm,2)
+  # end test_splitCommunicator
+
+  def test_average(self):
+    comm = MPI.COMM_WORLD
+    rank = comm.Get_rank()
+    size = comm.Get_size()
+
+    # a small bucket size forces several buckets
+    reducer = utils.GradientAllreduce(comm,bucket_bytes=16)
+
+    tensors = [float(rank)*torch.ones(3,2),
+               None,
+               float(rank)*torch.ones(5,dtype=torch.float64),
+               float(rank)*torch.ones(2,dtype=torch.bfloat16),
+               float(rank)*torch.ones(4)]
+    result = reducer.start(tensors).wait()
+
+    mean = sum(range(size))/size
+    self.assertTrue(result[1] is None)
+    for t,r in zip(tensors,result):
+      if t is None:
+        continue
+      self.assertEqual(r.size(),t.size())
+      self.assertEqual(r.dtype,t.dtype)
+      self.assertTrue(torch.allclose(r.double(),mean*torch.ones(t.size(),dtype=torch.float64)))
+
+    # the input is not modified
+    self.assertTrue(torch.equal(tensors[0],float(rank)*torch.ones(3,2)))
+  # end test_average
+
+  def test_averageGradients(self):
+    comm = MPI.COMM_WORLD
+    rank = comm.Get_rank()
+    size = comm.Get_size()
+
+    layer = torch.nn.Linear(3,2)
+    for p in layer.parameters():
+      p.grad = float(rank)*torch.ones(p.size())
+
+    utils.GradientAllreduce(comm).averageGradients(layer.parameters())
+
+    mean = sum(range(size))/size
+    for p in layer.parameters():
+      self.assertTrue(torch.allclose(p.grad,mean*torch.ones(p.size())))
+  # end test_averageGradients
+# end TestGradientAllreduce
+
+if __name__ == '__main__':
+  unittest.main()
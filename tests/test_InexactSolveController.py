@@ -0,0 +1,174 @@
+#@HEADER
+# ************************************************************************
+# 
+#                        Torchbraid v. 0.1
+# 
+# Copyright 2020 National Technology & Engineering Solutions of Sandia, LLC 
+# (NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S. 
+# Government retains certain rights in this software.
+# 
+# Torchbraid is licensed under 3-clause BSD terms of use:
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+# 
+# 3. Neither the name National Technology & Engineering Solutions of Sandia, 
+# LLC nor the names of the contributors may be used to endorse or promote 
+# products derived from this software without specific prior written permission.
+# 
+# Questions? Contact Eric C. Cyr (eccyr@sandia.gov)
+# 
+# ************************************************************************
+#@HEADER
+
+import unittest
+import faulthandler
+faulthandler.enable()
+
+import torch
+import torch.nn as nn
+import torchbraid
+
+from torchbraid.parallel_settings import ParallelSettings
+from mpi4py import MPI
+
+class RecordingApp:
+  """
+  Stands in for a braid app: records the settings and reports a fixed
+  residual history.
+  """
+  def __init__(self):
+    self.max_iters = None
+    self.abs_tol = None
+    self.rnorms = None
+
+  def setMaxIters(self,max_iters):
+    self.max_iters = max_iters
+
+  def setAbsTol(self,abs_tol):
+    self.abs_tol = abs_tol
+
+  def getIterationCap(self):
+    return self.max_iters
+
+  def getLastResidualNorms(self):
+    return self.rnorms
+
+  def getOutputPlacement(self):
+    return 'all'
+
+class RecordingModel(nn.Module,ParallelSettings):
+  def __init__(self):
+    super(RecordingModel, self).__init__()
+    self.lin = nn.Linear(2,2)
+    self.fwd_app = RecordingApp()
+    self.bwd_app = RecordingApp()
+
+  def getMPIComm(self):
+    return MPI.COMM_WORLD
+
+  def setGradient(self,value):
+    for p in self.parameters():
+      p.grad = value*torch.ones(p.size())
+
+class TestInexactSolveController(unittest.TestCase):
+
+  def test_attach(self):
+    model = RecordingModel()
+    ctrl = torchbraid.InexactSolveController(fwd_tol=1e-2,bwd_tol=1e-3,min_iters=2)
+    ctrl.attach(model)
+
+    self.assertEqual((model.fwd_app.max_iters,model.bwd_app.max_iters),(2,2))
+    self.assertEqual((model.fwd_app.abs_tol,model.bwd_app.abs_tol),(1e-2,1e-3))
+  # end test_attach
+
+  def test_residuals(self):
+    model = RecordingModel()
+    ctrl = torchbraid.InexactSolveController(fwd_tol=1e-2,bwd_tol=1e-2,min_iters=1,max_fwd_iters=3,max_bwd_iters=3)
+    ctrl.attach(model)
+    model.setGradient(1.0)
+
+    # the forward solve misses the tolerance, the backward meets it
+    model.fwd_app.rnorms = [1.0]
+    model.bwd_app.rnorms = [1e-3]
+    for i in range(4):
+      ctrl.step(1.0)
+
+    self.assertEqual(ctrl.getIterations(),(3,1))
+    self.assertEqual(model.fwd_app.max_iters,3)
+
+    # now the forward solve converges early
+    model.fwd_app.rnorms = [1.0,1e-3]
+    ctrl.step(1.0)
+    self.assertEqual(ctrl.getIterations(),(2,1))
+    self.assertEqual(len(ctrl.getHistory()),5)
+  # end test_residuals
+
+  def test_lossAndGradient(self):
+    model = RecordingModel()
+    ctrl = torchbraid.InexactSolveController(min_iters=1,grad_agreement_tol=0.0)
+    ctrl.attach(model)
+    model.fwd_app.rnorms = [1e-6]
+    model.bwd_app.rnorms = [1e-6]
+
+    model.setGradient(1.0)
+    ctrl.step(1.0)
+    self.assertEqual(ctrl.getIterations(),(1,1))
+
+    # the loss grows, both solves get another iteration
+    ctrl.step(2.0)
+    self.assertEqual(ctrl.getIterations(),(2,2))
+    self.assertAlmostEqual(ctrl.getHistory()[-1]['agreement'],1.0)
+
+    # the gradient flips, only the backward solve gets another iteration
+    model.setGradient(-1.0)
+    ctrl.step(2.0)
+    self.assertEqual(ctrl.getIterations(),(1,3))
+    self.assertAlmostEqual(ctrl.getHistory()[-1]['agreement'],-1.0)
+  # end test_lossAndGradient
+
+  def test_agreementCollective(self):
+    comm = MPI.COMM_WORLD
+
+    model = RecordingModel()
+    ctrl = torchbraid.InexactSolveController()
+    ctrl.attach(model)
+    model.fwd_app.rnorms = [1e-6]
+    model.bwd_app.rnorms = [1e-6]
+
+    model.setGradient(1.0)
+    ctrl.step(1.0)
+
+    # a single rank without a matching average restarts the average on all ranks
+    if comm.Get_rank()==0:
+      ctrl.grad_avg = torch.ones(1)
+    ctrl.step(1.0)
+    self.assertTrue(ctrl.getHistory()[-1]['agreement'] is None)
+
+    ctrl.step(1.0)
+    self.assertAlmostEqual(ctrl.getHistory()[-1]['agreement'],1.0)
+  # end test_agreementCollective
+
+  def test_epoch(self):
+    model = RecordingModel()
+    ctrl = torchbraid.InexactSolveController(fwd_tol=1e-2,bwd_tol=1e-2,tol_decay=0.1,min_tol=1e-4)
+    ctrl.attach(model)
+
+    for i in range(3):
+      ctrl.epoch()
+
+    self.assertEqual(ctrl.getTolerances(),(1e-4,1e-4))
+    self.assertEqual(model.fwd_app.abs_tol,1e-4)
+  # end test_epoch
+# end TestInexactSolveController
+
+if __name__ == '__main__':
+  unittest.main()
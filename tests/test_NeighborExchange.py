@@ -0,0 +1,106 @@
+#@HEADER
+# ************************************************************************
+# 
+#                        Torchbraid v. 0.1
+# 
+# Copyright 2020 National Technology & Engineering Solutions of Sandia, LLC 
+# (NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S. 
+# Government retains certain rights in this software.
+# 
+# Torchbraid is licensed under 3-clause BSD terms of use:
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+# 
+# 3. Neither the name National Technology & Engineering Solutions of Sandia, 
+# LLC nor the names of the contributors may be used to endorse or promote 
+# products derived from this software without specific prior written permission.
+# 
+# Questions? Contact Eric C. Cyr (eccyr@sandia.gov)
+# 
+# ************************************************************************
+#@HEADER
+
+import unittest
+import faulthandler
+faulthandler.enable()
+
+import torch
+import torchbraid.utils as utils
+
+from mpi4py import MPI
+
+class TestNeighborExchange(unittest.TestCase):
+
+  def test_exchange_left(self):
+    comm      = MPI.COMM_WORLD
+    my_rank   = comm.Get_rank()
+    num_ranks = comm.Get_size()
+
+    shapes = [torch.Size((3,4)),torch.Size((5,))]
+
+    dest   = my_rank-1 if my_rank>0 else None
+    source = my_rank+1 if my_rank<num_ranks-1 else None
+    exchange = utils.NeighborExchange(comm,shapes,dest,shapes,source,tag=31)
+
+    # the persistent requests are reused for each exchange
+    for i in range(3):
+      send = [float(my_rank+i)*torch.ones(s) for s in shapes]
+      recv = [torch.zeros(s) for s in shapes]
+
+      exchange.start(send)
+      self.assertTrue(exchange.isActive())
+      exchange.wait(recv)
+      self.assertFalse(exchange.isActive())
+
+      if source is not None:
+        for r in recv:
+          self.assertEqual(torch.norm(r-float(source+i)).item(),0.0)
+
+    exchange.free()
+  # end test_exchange_left
+
+  def test_exchange_dtype(self):
+    comm      = MPI.COMM_WORLD
+    my_rank   = comm.Get_rank()
+    num_ranks = comm.Get_size()
+
+    shapes = [torch.Size((3,4)),torch.Size((5,))]
+
+    dest   = my_rank-1 if my_rank>0 else None
+    source = my_rank+1 if my_rank<num_ranks-1 else None
+
+    for dtype in [torch.float32,torch.float16,torch.bfloat16]:
+      send = [float(my_rank)*torch.ones(s,dtype=dtype) for s in shapes]
+      recv = [torch.zeros(s,dtype=dtype) for s in shapes]
+
+      self.assertEqual(utils.exchange_dtype(send+[torch.ones(2,dtype=torch.int64)]),dtype)
+
+      exchange = utils.NeighborExchange(comm,shapes,dest,shapes,source,tag=32,dtype=dtype)
+      if source is not None:
+        self.assertEqual(exchange.getRecvBuffer().itemsize,2 if dtype==torch.float16 else 4)
+
+      exchange.start(send)
+      exchange.wait(recv)
+      exchange.free()
+
+      if source is not None:
+        for r in recv:
+          self.assertEqual(r.dtype,dtype)
+          self.assertEqual(torch.norm((r-float(source)).float()).item(),0.0)
+
+    # mixed floating point dtypes fall back to float64
+    self.assertEqual(utils.exchange_dtype([torch.ones(2),torch.ones(2,dtype=torch.float64)]),torch.float64)
+  # end test_exchange_dtype
+# end TestNeighborExchange
+
+if __name__ == '__main__':
+  unittest.main()
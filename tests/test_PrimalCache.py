@@ -0,0 +1,129 @@
+#@HEADER
+# ************************************************************************
+# 
+#                        Torchbraid v. 0.1
+# 
+# Copyright 2020 National Technology & Engineering Solutions of Sandia, LLC 
+# (NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S. 
+# Government retains certain rights in this software.
+# 
+# Torchbraid is licensed under 3-clause BSD terms of use:
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+# 
+# 3. Neither the name National Technology & Engineering Solutions of Sandia, 
+# LLC nor the names of the contributors may be used to endorse or promote 
+# products derived from this software without specific prior written permission.
+# 
+# Questions? Contact Eric C. Cyr (eccyr@sandia.gov)
+# 
+# ************************************************************************
+#@HEADER
+
+import unittest
+import faulthandler
+faulthandler.enable()
+
+import torch
+import torchbraid.utils as utils
+
+class TestPrimalCache(unittest.TestCase):
+
+  def test_policy(self):
+    cache = utils.PrimalCache()
+    self.assertFalse(cache.enabled())
+    self.assertFalse(cache.shouldStore(0))
+
+    cache.setPolicy('all')
+    self.assertTrue(all([cache.shouldStore(i) for i in range(5)]))
+
+    cache.setPolicy(3)
+    self.assertEqual([i for i in range(7) if cache.shouldStore(i)],[0,3,6])
+
+    with self.assertRaises(ValueError):
+      cache.setPolicy('some')
+    with self.assertRaises(ValueError):
+      cache.setPolicy(0)
+  # end test_policy
+
+  def test_budget(self):
+    cache = utils.PrimalCache('all',budget=100)
+
+    x = torch.ones(5,requires_grad=True)
+    with utils.SavedTensorCounter() as counter:
+      y = torch.sin(x)
+
+    self.assertTrue(cache.shouldStore(0))
+    cache.store((0.0,1.0),y,x,80)
+    self.assertTrue(cache.shouldStore(1))
+    cache.store((1.0,2.0),y,x,80)
+    self.assertFalse(cache.shouldStore(2))
+
+    self.assertTrue(cache.get((0.0,1.0))[0] is y)
+    self.assertEqual(cache.get((2.0,3.0)),None)
+
+    stats = cache.getStatistics()
+    self.assertEqual(stats['entries'],2)
+    self.assertEqual(stats['bytes'],160)
+    self.assertEqual(stats['hits'],1)
+    self.assertEqual(stats['misses'],1)
+
+    # the lookup counts are kept until they are reset
+    cache.clear()
+    self.assertTrue(cache.shouldStore(0))
+    self.assertEqual(cache.getStatistics()['entries'],0)
+    self.assertEqual(cache.getStatistics()['hits'],1)
+
+    cache.resetStatistics()
+    self.assertEqual(cache.getStatistics()['hits'],0)
+    self.assertEqual(cache.getStatistics()['misses'],0)
+  # end test_budget
+
+  def test_checkpoints(self):
+    cache = utils.PrimalCache(2)
+    self.assertTrue(cache.usesCheckpoints())
+    self.assertFalse(utils.PrimalCache('all').usesCheckpoints())
+
+    for i in [0,2,4]:
+      cache.storeCheckpoint(i,torch.full((3,),float(i)))
+
+    self.assertEqual(cache.getCheckpoint(3)[0],2)
+    self.assertEqual(cache.getCheckpoint(4)[0],4)
+    self.assertTrue(torch.equal(cache.getCheckpoint(1)[1],torch.zeros(3)))
+    self.assertEqual(cache.getCheckpoint(-1),None)
+
+    # a recomputed segment replaces the previous one
+    x = torch.ones(3)
+    cache.storeSegment({(0,2):(x,x),(0,3):(x,x)})
+    cache.storeSegment({(0,0):(x,x)})
+    self.assertEqual(cache.get((0,2)),None)
+    self.assertTrue(cache.get((0,0)) is not None)
+
+    stats = cache.getStatistics()
+    self.assertEqual(stats['entries'],1)
+    self.assertEqual(stats['checkpoints'],3)
+    self.assertEqual(stats['hits'],1)
+    self.assertEqual(stats['misses'],1)
+  # end test_checkpoints
+
+  def test_saved_tensor_counter(self):
+    x = torch.ones(10,requires_grad=True)
+    with utils.SavedTensorCounter() as counter:
+      y = torch.sin(x)
+
+    # sin saves its input for the backward pass (if hooks are supported)
+    self.assertTrue(counter.nbytes in [0,10*4])
+  # end test_saved_tensor_counter
+# end TestPrimalCache
+
+if __name__ == '__main__':
+  unittest.main()
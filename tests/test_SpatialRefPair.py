@@ -0,0 +1,90 @@
+#@HEADER
+# ************************************************************************
+# 
+#                        Torchbraid v. 0.1
+# 
+# Copyright 2020 National Technology & Engineering Solutions of Sandia, LLC 
+# (NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S. 
+# Government retains certain rights in this software.
+# 
+# Torchbraid is licensed under 3-clause BSD terms of use:
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+# 
+# 3. Neither the name National Technology & Engineering Solutions of Sandia, 
+# LLC nor the names of the contributors may be used to endorse or promote 
+# products derived from this software without specific prior written permission.
+# 
+# Questions? Contact Eric C. Cyr (eccyr@sandia.gov)
+# 
+# ************************************************************************
+#@HEADER
+
+import unittest
+import faulthandler
+faulthandler.enable()
+
+import torch
+import torchbraid.utils as utils
+
+class TestSpatialRefPair(unittest.TestCase):
+
+  def test_unpack(self):
+    pair = utils.SpatialRefPair()
+    coarsen,refine = pair
+
+    x = torch.randn(2,3,8,8)
+    self.assertEqual(coarsen(x,0).size(),torch.Size([2,3,4,4]))
+    self.assertEqual(refine(coarsen(x,0),0).size(),x.size())
+  # end test_unpack
+
+  def test_averagePool(self):
+    pair = utils.SpatialRefPair(factor=2)
+
+    x = torch.arange(16.0).view(1,1,4,4)
+    xc = pair.coarsen(x,0)
+    self.assertTrue(torch.allclose(xc,torch.tensor([[[[2.5,4.5],[10.5,12.5]]]])))
+  # end test_averagePool
+
+  def test_constantsPreserved(self):
+    for mode in ['bilinear','nearest']:
+      pair = utils.SpatialRefPair(mode=mode)
+
+      # odd sizes are refined back to the original shape
+      x = 3.0*torch.ones(2,4,7,5)
+      xc = pair.coarsen(x,0)
+      self.assertEqual(xc.size(),torch.Size([2,4,4,3]))
+
+      xf = pair.refine(xc,1)
+      self.assertEqual(xf.size(),x.size())
+      self.assertTrue(torch.allclose(xf,x))
+  # end test_constantsPreserved
+
+  def test_nonSpatial(self):
+    pair = utils.SpatialRefPair()
+
+    # tensors that are not NCHW are copied
+    x = torch.randn(5,3)
+    xc = pair.coarsen(x,0)
+    self.assertTrue(torch.equal(xc,x))
+    xc.zero_()
+    self.assertTrue(torch.norm(x)>0.0)
+  # end test_nonSpatial
+
+  def test_badMode(self):
+    with self.assertRaises(ValueError):
+      utils.SpatialRefPair(mode='bicubic')
+  # end test_badMode
+# end TestSpatialRefPair
+
+if __name__ == '__main__':
+  unittest.main()
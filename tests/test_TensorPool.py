@@ -0,0 +1,96 @@
+#@HEADER
+# ************************************************************************
+# 
+#                        Torchbraid v. 0.1
+# 
+# Copyright 2020 National Technology & Engineering Solutions of Sandia, LLC 
+# (NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S. 
+# Government retains certain rights in this software.
+# 
+# Torchbraid is licensed under 3-clause BSD terms of use:
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+# 
+# 3. Neither the name National Technology & Engineering Solutions of Sandia, 
+# LLC nor the names of the contributors may be used to endorse or promote 
+# products derived from this software without specific prior written permission.
+# 
+# Questions? Contact Eric C. Cyr (eccyr@sandia.gov)
+# 
+# ************************************************************************
+#@HEADER
+
+import unittest
+import faulthandler
+faulthandler.enable()
+
+import torch
+import torchbraid.utils as utils
+
+class TestTensorPool(unittest.TestCase):
+
+  def test_acquire_release(self):
+    pool = utils.TensorPool()
+
+    a = pool.acquire((3,4))
+    b = pool.acquire((3,4),torch.float64)
+    self.assertEqual(a.shape,torch.Size((3,4)))
+    self.assertEqual(a.dtype,torch.float32)
+    self.assertEqual(b.dtype,torch.float64)
+    self.assertEqual(pool.getStatistics()['misses'],2)
+
+    a_ptr = a.data_ptr()
+    pool.release(a)
+    pool.release(b)
+    self.assertEqual(pool.getStatistics()['held_bytes'],3*4*4+3*4*8)
+
+    # keyed by shape and dtype
+    c = pool.acquire((4,3))
+    d = pool.acquire((3,4))
+    self.assertNotEqual(c.data_ptr(),a_ptr)
+    self.assertEqual(d.data_ptr(),a_ptr)
+
+    stats = pool.getStatistics()
+    self.assertEqual(stats['hits'],1)
+    self.assertEqual(stats['misses'],3)
+    self.assertEqual(stats['releases'],2)
+    self.assertEqual(stats['held_bytes'],3*4*8)
+    self.assertEqual(stats['peak_bytes'],3*4*4+3*4*8)
+
+    result = pool.getResultString()
+    self.assertTrue('hits = 1, misses = 3 (hit rate 0.25)' in result)
+    self.assertTrue('releases = 2, drops = 0' in result)
+  # end test_acquire_release
+
+  def test_high_water(self):
+    pool = utils.TensorPool(high_water=2*10*4)
+
+    tensors = [pool.acquire((10,)) for i in range(3)]
+    for t in tensors:
+      pool.release(t)
+
+    stats = pool.getStatistics()
+    self.assertEqual(stats['releases'],2)
+    self.assertEqual(stats['drops'],1)
+    self.assertEqual(stats['held_bytes'],2*10*4)
+
+    # lowering the mark drops held tensors
+    pool.setHighWaterMark(10*4)
+    self.assertEqual(pool.getStatistics()['held_bytes'],10*4)
+
+    pool.clear()
+    self.assertEqual(pool.getStatistics()['held_bytes'],0)
+  # end test_high_water
+# end TestTensorPool
+
+if __name__ == '__main__':
+  unittest.main()
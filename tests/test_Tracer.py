@@ -0,0 +1,133 @@
+#@HEADER
+# ************************************************************************
+# 
+#                        Torchbraid v. 0.1
+# 
+# Copyright 2020 National Technology & Engineering Solutions of Sandia, LLC 
+# (NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S. 
+# Government retains certain rights in this software.
+# 
+# Torchbraid is licensed under 3-clause BSD terms of use:
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+# 
+# 3. Neither the name National Technology & Engineering Solutions of Sandia, 
+# LLC nor the names of the contributors may be used to endorse or promote 
+# products derived from this software without specific prior written permission.
+# 
+# Questions? Contact Eric C. Cyr (eccyr@sandia.gov)
+# 
+# ************************************************************************
+#@HEADER
+
+import unittest
+import faulthandler
+faulthandler.enable()
+
+import os
+import json
+import tempfile
+import torchbraid.utils as utils
+
+from torchbraid.parallel_settings import ParallelSettings
+
+from mpi4py import MPI
+
+class TestTracer(unittest.TestCase):
+
+  def test_ringBuffer(self):
+    tracer = utils.Tracer(capacity=4)
+
+    for i in range(6):
+      tracer.record('event_{}'.format(i),float(i),float(i)+0.5)
+
+    events = tracer.getEvents()
+    self.assertEqual(len(events),4)
+    self.assertEqual(tracer.dropped,2)
+    self.assertEqual([e['name'] for e in events],['event_2','event_3','event_4','event_5'])
+    self.assertEqual(events[0]['start'],2.0)
+    self.assertEqual(events[0]['stop'],2.5)
+  # end test_ringBuffer
+
+  def test_context(self):
+    tracer = utils.Tracer()
+
+    tracer.setContext(1,0.5,1.0,3)
+    tracer.record('step',0.0,1.0)
+    tracer.clearContext()
+    tracer.record('bufpack',1.0,2.0)
+
+    step,bufpack = tracer.getEvents()
+    self.assertEqual((step['level'],step['tstart'],step['tstop'],step['iteration']),(1,0.5,1.0,3))
+    self.assertEqual((bufpack['level'],bufpack['iteration']),(-1,-1))
+  # end test_context
+
+  def test_timerManager(self):
+    mgr = utils.ContextTimerManager()
+    mgr.enableTracing(capacity=16)
+
+    with mgr.timer('outer'):
+      with mgr.timer('inner'):
+        pass
+
+    events = mgr.getTracer().getEvents()
+    self.assertEqual([e['name'] for e in events],['inner','outer'])
+    self.assertTrue(events[1]['start']<=events[0]['start'])
+    self.assertTrue(events[0]['stop']<=events[1]['stop'])
+
+    mgr.disableTracing()
+    self.assertTrue(mgr.getTracer() is None)
+  # end test_timerManager
+
+  def test_writeTraceDisabled(self):
+    settings = ParallelSettings()
+    settings.timer_manager = utils.ContextTimerManager()
+
+    with self.assertRaises(RuntimeError):
+      settings.writeTrace('unused.json')
+    self.assertFalse(os.path.exists('unused.json'))
+  # end test_writeTraceDisabled
+
+  def test_chromeTrace(self):
+    comm = MPI.COMM_WORLD
+    my_rank = comm.Get_rank()
+    num_ranks = comm.Get_size()
+
+    mgr = utils.ContextTimerManager()
+    mgr.enableTracing()
+    for i in range(my_rank+1):
+      with mgr.timer('work'):
+        pass
+
+    filename = None
+    if my_rank==0:
+      fd,filename = tempfile.mkstemp(suffix='.json')
+      os.close(fd)
+    filename = comm.bcast(filename,root=0)
+
+    mgr.getTracer().writeChromeTrace(comm,filename)
+
+    if my_rank==0:
+      with open(filename) as f:
+        trace = json.load(f)
+      os.remove(filename)
+
+      events = [e for e in trace['traceEvents'] if e['ph']=='X']
+      self.assertEqual(len(events),num_ranks*(num_ranks+1)//2)
+      for rank in range(num_ranks):
+        self.assertEqual(len([e for e in events if e['pid']==rank]),rank+1)
+      self.assertTrue(all([e['ts']>=0.0 and e['dur']>=0.0 for e in events]))
+  # end test_chromeTrace
+# end TestTracer
+
+if __name__ == '__main__':
+  unittest.main()
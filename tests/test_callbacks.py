@@ -37,13 +37,18 @@ import numpy as np
 import torchbraid
 import torchbraid.utils as tbutils
 
+from torchbraid.torchbraid_app import BraidApp
+
 import test_cbs as cbs
 
 class DummyApp:
-  def __init__(self,dtype,layer_data_size):
+  def __init__(self,dtype,layer_data_size,tensor_dtype=torch.float32,buffer_dtype=None):
     self.dtype = dtype
     self.layer_data_size = layer_data_size
+    self.tensor_dtype = tensor_dtype
+    self.buffer_dtype = buffer_dtype
     self.timer_manager = tbutils.ContextTimerManager()
+    self.tensor_pool = tbutils.TensorPool()
 
 
   def buildInit(self,t):
@@ -53,6 +58,15 @@ class DummyApp:
   def getTensorShapes(self):
     return [torch.Size(s) for s in [(4,5),(3,2,2,4),(1,3),(9,7,4)]]
 
+  def getTensorDTypes(self):
+    return len(self.getTensorShapes())*[self.tensor_dtype]
+
+  def getBufferDType(self):
+    return self.buffer_dtype
+
+  def getTensorPool(self):
+    return self.tensor_pool
+
   def getBufSize(self):
      return sizeof(int)+ (2+4+2+3)*sizeof(int)
 
@@ -99,6 +113,68 @@ class TestTorchBraid(unittest.TestCase):
     self.assertEqual(torch.norm(clone).item(),np.sqrt(4.0*4.0*5.0))
   # end test_clone
 
+  def test_clone_pool(self):
+    app = DummyApp(float,0)
+    pool = app.getTensorPool()
+
+    vec = app.buildInit(0.0)
+    vec.tensor().mul_(2.0)
+
+    clone_vec = cbs.cloneVector(app,vec)
+    self.assertEqual(pool.getStatistics()['misses'],1)
+    self.assertEqual(torch.norm(clone_vec.tensor()).item(),np.sqrt(4.0*4.0*5.0))
+
+    # free the clone, its tensor should be recycled
+    ptr = clone_vec.tensor().data_ptr()
+    cbs.freeVector(app,clone_vec)
+    self.assertEqual(pool.getStatistics()['releases'],1)
+
+    clone_vec = cbs.cloneVector(app,vec)
+    self.assertEqual(pool.getStatistics()['hits'],1)
+    self.assertEqual(clone_vec.tensor().data_ptr(),ptr)
+    self.assertEqual(torch.norm(clone_vec.tensor()).item(),np.sqrt(4.0*4.0*5.0))
+
+    # replaced tensors are not owned by the vector, and not recycled
+    clone_vec.replaceTensor(torch.ones(4,5,dtype=float))
+    cbs.freeVector(app,clone_vec)
+    self.assertEqual(pool.getStatistics()['releases'],1)
+  # end test_clone_pool
+
+  def test_sum_norm(self):
+    app = DummyApp(torch.float,0)
+    shapes = app.getTensorShapes()
+
+    x_tensors = [torch.randn(s) for s in shapes]
+    y_tensors = [torch.randn(s) for s in shapes]
+
+    # the clones have a flat storage, the originals do not
+    x = torchbraid.BraidVector(tuple(x_tensors),0)
+    y = torchbraid.BraidVector(tuple(y_tensors),0)
+    x_flat = cbs.cloneVector(app,x)
+    y_flat = cbs.cloneVector(app,y)
+    self.assertEqual(x.getStorage(),None)
+    self.assertEqual(x_flat.getStorage().numel(),sum([s.numel() for s in shapes]))
+
+    norm = math.sqrt(sum([torch.norm(t).item()**2 for t in x_tensors]))
+    self.assertAlmostEqual(cbs.braidVectorNorm(app,x),norm,places=4)
+    self.assertAlmostEqual(cbs.braidVectorNorm(app,x_flat),norm,places=4)
+
+    for alpha,beta in [(2.0,0.0),(-1.0,1.0),(0.5,-3.0)]:
+      exact = [alpha*a+beta*b for a,b in zip(x.tensors(),y.tensors())]
+
+      cbs.addBraidVector(app,alpha,x,beta,y)
+      cbs.addBraidVector(app,alpha,x_flat,beta,y_flat)
+
+      for e,a,b in zip(exact,y.tensors(),y_flat.tensors()):
+        self.assertTrue(torch.norm(e-a).item()<1.0e-5)
+        self.assertTrue(torch.norm(e-b).item()<1.0e-5)
+
+    # with beta zero, values in y are overwritten
+    y_flat.getStorage().fill_(float('nan'))
+    cbs.addBraidVector(app,1.0,x_flat,0.0,y_flat)
+    self.assertEqual(torch.norm(x_flat.getStorage()-y_flat.getStorage()).item(),0.0)
+  # end test_sum_norm
+
   def test_buff_size(self):
     sizeof_float = cbs.sizeof_float()
     sizeof_int   = cbs.sizeof_int()
@@ -127,13 +203,20 @@ class TestTorchBraid(unittest.TestCase):
 
     sz = cbs.bufSize(app)
 
-    total_size = ( sizeof_int                # level
-                 + sizeof_int                # num tensors
-                 + sizeof_int                # num_weighttensors
-                 + num_tensors*sizeof_int    # number of tensors dimensions and shapes
-                 + data_shapes               # the shapes of each tensor
-                 + data_size                 # the shapes of each tensor
-                 + sizeof_int                # how much layer data (bytes)
+    header_size = ( sizeof_int                # version
+                  + sizeof_int                # level
+                  + sizeof_int                # num tensors
+                  + sizeof_int                # num_weighttensors
+                  + sizeof_int                # how much layer data (bytes)
+                  + 3*sizeof_int              # weight version
+                  + sizeof_int                # weights included flag
+                  + 3*num_tensors*sizeof_int  # tensor ranks, dtypes and wire dtypes
+                  + data_shapes               # the shapes of each tensor
+                  )
+    header_size = 8*((header_size+7)//8)      # data is aligned to 8 bytes
+
+    total_size = ( header_size
+                 + data_size                 # the data of each tensor
                  + layer_data_size           # checkout of layer data
                  )
 
@@ -185,6 +268,202 @@ class TestTorchBraid(unittest.TestCase):
 
     self.assertEqual(out_layer_data.s,in_layer_data.s)
     self.assertEqual(out_layer_data.linear,in_layer_data.linear)
+
+  def test_buff_unpack_views(self):
+    app = DummyApp(torch.float,0)
+    shapes = app.getTensorShapes()
+
+    a = torch.randn(shapes[0])
+    b = torch.randn(shapes[1])
+    c = torch.randn(shapes[2])
+    d = torch.randn(shapes[3])
+
+    bv_in = torchbraid.BraidVector((a,b),0)
+    bv_in.addWeightTensors((c,d))
+
+    block = cbs.MemoryBlock(cbs.bufSize(app))
+    cbs.pack(app,bv_in,block,0)
+    bv_out = cbs.unpack(app,block)
+
+    # the unpacked state tensors should be views into a single allocation,
+    # taken from the pool
+    ptrs = set([o.storage().data_ptr() for o in bv_out.tensors()])
+    self.assertEqual(len(ptrs),1)
+    self.assertEqual(bv_out.getStorage().numel(),shapes[0].numel()+shapes[1].numel())
+    self.assertEqual(app.getTensorPool().getStatistics()['misses'],1)
+
+    # the storage is recycled by the next unpack
+    bv_out.releaseTensors(app.getTensorPool())
+    bv_out = cbs.unpack(app,block)
+    self.assertEqual(app.getTensorPool().getStatistics()['hits'],1)
+
+    for i,o in zip(bv_in.allTensors(),bv_out.allTensors()):
+      self.assertEqual(i.shape,o.shape)
+      self.assertEqual(torch.norm(i-o).item(),0.0)
+  # end test_buff_unpack_views
+
+  def test_buff_pack_unpack_double(self):
+    app = DummyApp(float,0,tensor_dtype=torch.float64)
+    shapes = app.getTensorShapes()
+
+    tensors = [torch.randn(s,dtype=torch.float64) for s in shapes]
+
+    bv_in = torchbraid.BraidVector(tuple(tensors[0:2]),0)
+    bv_in.addWeightTensors(tensors[2:])
+
+    block = cbs.MemoryBlock(cbs.bufSize(app))
+    cbs.pack(app,bv_in,block,0)
+    bv_out = cbs.unpack(app,block)
+
+    for i,o in zip(bv_in.allTensors(),bv_out.allTensors()):
+      self.assertEqual(o.dtype,torch.float64)
+      self.assertEqual(i.shape,o.shape)
+      self.assertEqual(torch.norm(i-o).item(),0.0)
+  # end test_buff_pack_unpack_double
+
+  def test_buff_pack_unpack_reduced(self):
+    full_app = DummyApp(torch.float,0)
+    shapes = full_app.getTensorShapes()
+
+    tensors = [torch.randn(s) for s in shapes]
+
+    for buffer_dtype in [torch.float16,torch.bfloat16]:
+      app = DummyApp(torch.float,0,buffer_dtype=buffer_dtype)
+
+      # the data section should be half the size
+      data_size = sum([s.numel() for s in shapes])*cbs.sizeof_float()
+      self.assertEqual(cbs.bufSize(full_app)-cbs.bufSize(app),data_size//2)
+
+      bv_in = torchbraid.BraidVector(tuple(tensors[0:2]),0)
+      bv_in.addWeightTensors(tensors[2:])
+
+      block = cbs.MemoryBlock(cbs.bufSize(app))
+      cbs.pack(app,bv_in,block,0)
+      bv_out = cbs.unpack(app,block)
+
+      # tensors are upcast on unpack, and exact up to the wire precision
+      for i,o in zip(bv_in.allTensors(),bv_out.allTensors()):
+        self.assertEqual(o.dtype,torch.float32)
+        self.assertEqual(i.shape,o.shape)
+        self.assertEqual(torch.norm(i.to(buffer_dtype).float()-o).item(),0.0)
+  # end test_buff_pack_unpack_reduced
+
+  def test_buff_pack_unpack_mixed(self):
+    app = DummyApp(torch.float,0,buffer_dtype=torch.float16)
+    shapes = app.getTensorShapes()
+
+    # mixed dtypes, integer tensors are not reduced
+    dtypes = [torch.float64,torch.float32,torch.int64,torch.float16]
+    tensors = [torch.randn(s).to(d) for s,d in zip(shapes,dtypes)]
+
+    bv_in = torchbraid.BraidVector(tuple(tensors[0:2]),0)
+    bv_in.addWeightTensors(tensors[2:])
+
+    # size the buffer for the largest possible case
+    block = cbs.MemoryBlock(2*cbs.bufSize(DummyApp(torch.float,0,tensor_dtype=torch.float64)))
+    cbs.pack(app,bv_in,block,0)
+    bv_out = cbs.unpack(app,block)
+
+    for i,o in zip(bv_in.allTensors(),bv_out.allTensors()):
+      self.assertEqual(i.dtype,o.dtype)
+      self.assertEqual(i.shape,o.shape)
+      if i.dtype.is_floating_point:
+        self.assertEqual(torch.norm((i.to(torch.float16).to(i.dtype)-o).double()).item(),0.0)
+      else:
+        self.assertTrue(torch.equal(i,o))
+  # end test_buff_pack_unpack_mixed
+
+  def test_buff_weight_size(self):
+    # the app only sizes the state tensors, the weights are
+    # accounted for in the layer data size (see ForwardResNetApp)
+    class WeightApp(DummyApp):
+      def getTensorShapes(self):
+        return DummyApp.getTensorShapes(self)[0:2]
+
+    shapes = DummyApp(torch.float,0).getTensorShapes()
+    tensors = [torch.randn(s) for s in shapes]
+
+    app = WeightApp(torch.float,cbs.weightBufferSize(tensors[2:]))
+
+    # the bound should be larger than the packed size with the weights
+    self.assertTrue(cbs.bufSize(app)>=cbs.bufSize(DummyApp(torch.float,0)))
+
+    bv_in = torchbraid.BraidVector(tuple(tensors[0:2]),0)
+    bv_in.addWeightTensors(tensors[2:])
+
+    block = cbs.MemoryBlock(cbs.bufSize(app))
+    cbs.pack(app,bv_in,block,0)
+    bv_out = cbs.unpack(app,block)
+
+    self.assertEqual(bv_out.getLayerData(),None)
+    self.assertEqual(len(bv_out.weightTensors()),2)
+    for i,o in zip(bv_in.allTensors(),bv_out.allTensors()):
+      self.assertEqual(torch.norm(i-o).item(),0.0)
+  # end test_buff_weight_size
+
+  def test_buff_weight_version(self):
+    # the weight version bookkeeping of BraidApp, the destination rank is
+    # set here as there is no braid core to ask
+    class VersionApp(DummyApp):
+      shouldSendWeights    = BraidApp.shouldSendWeights
+      storeReceivedWeights = BraidApp.storeReceivedWeights
+      getReceivedWeights   = BraidApp.getReceivedWeights
+
+      def __init__(self):
+        DummyApp.__init__(self,torch.float,0)
+        self.sent_weight_versions = dict()
+        self.recv_weights         = dict()
+        self.missed_weights       = 0
+        self.dest                 = 1
+
+      def getMessageDestination(self,level):
+        return self.dest
+
+    app = VersionApp()
+    shapes = app.getTensorShapes()
+    tensors = [torch.randn(s) for s in shapes]
+
+    bv_in = torchbraid.BraidVector(tuple(tensors[0:2]),0)
+    bv_in.addWeightTensors(tensors[2:],version=(0,3,1))
+
+    for k in range(2):
+      block = cbs.MemoryBlock(cbs.bufSize(app))
+      cbs.pack(app,bv_in,block,0)
+      bv_out = cbs.unpack(app,block)
+
+      # the second message only carries the version
+      self.assertEqual(len(bv_out.weightTensors()),2)
+      for i,o in zip(bv_in.allTensors(),bv_out.allTensors()):
+        self.assertEqual(torch.norm(i-o).item(),0.0)
+    self.assertEqual(list(app.recv_weights.keys()),[(0,3)])
+    self.assertEqual(app.missed_weights,0)
+
+    # a new version is sent again
+    bv_in.addWeightTensors([2.0*t for t in tensors[2:]],version=(0,3,2))
+    block = cbs.MemoryBlock(cbs.bufSize(app))
+    cbs.pack(app,bv_in,block,0)
+    bv_out = cbs.unpack(app,block)
+    self.assertEqual(torch.norm(bv_out.weightTensors()[0]-2.0*tensors[2]).item(),0.0)
+    self.assertEqual(app.recv_weights[(0,3)][0],2)
+
+    # the weights are sent again to a different rank
+    app.dest = 2
+    block = cbs.MemoryBlock(cbs.bufSize(app))
+    cbs.pack(app,bv_in,block,0)
+    self.assertFalse(app.shouldSendWeights(1,0,(0,3,2)))
+    self.assertFalse(app.shouldSendWeights(2,0,(0,3,2)))
+    self.assertTrue(app.shouldSendWeights(2,1,(0,3,2)))
+
+    # a receiver without the weights records the miss instead of failing
+    app.recv_weights = dict()
+    app.dest = 1
+    block = cbs.MemoryBlock(cbs.bufSize(app))
+    cbs.pack(app,bv_in,block,0)
+    bv_out = cbs.unpack(app,block)
+    self.assertEqual(len(bv_out.weightTensors()),0)
+    self.assertEqual(app.missed_weights,1)
+    self.assertEqual(len(app.recv_weights),0)
+  # end test_buff_weight_version
     
 if __name__ == '__main__':
   unittest.main()
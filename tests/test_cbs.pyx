@@ -90,6 +90,24 @@ def vectorNorm(app,ten_x):
 
   return norm[0]
 
+def addBraidVector(app,alpha,x,beta,y):
+  cdef braid_App c_app = <PyObject*>app
+  cdef double dalpha = alpha
+  cdef braid_Vector c_x = <braid_Vector>x
+  cdef double dbeta  = beta
+  cdef braid_Vector c_y = <braid_Vector>y
+
+  my_sum(c_app,dalpha,c_x,dbeta,c_y)
+
+def braidVectorNorm(app,x):
+  cdef braid_App c_app = <PyObject*>app
+  cdef braid_Vector c_x = <braid_Vector>x
+  cdef double [1] norm = [ 0.0 ]
+  
+  my_norm(c_app,c_x,norm)
+
+  return norm[0]
+
 def bufSize(app):
   cdef braid_App c_app = <PyObject*>app
   cdef int [1] sz = [0]
@@ -69,6 +69,17 @@ class ReLUBlock(nn.Module):
     return F.relu(self.lin(x))
 # end layer
 
+class DropoutBlock(nn.Module):
+  def __init__(self,dim=10):
+    super(DropoutBlock, self).__init__()
+    self.lin = nn.Linear(dim, dim,bias=True)
+    self.bn = nn.BatchNorm1d(dim)
+    self.drop = nn.Dropout(0.5)
+
+  def forward(self, x):
+    return self.drop(F.relu(self.bn(self.lin(x))))
+# end layer
+
 class ConvBlock(nn.Module):
   def __init__(self,dim,num_ch):
     super(ConvBlock, self).__init__()
@@ -84,6 +95,15 @@ class ConvBlock(nn.Module):
     return self.lin(x)
 # end layer
 
+class Conv2dBlock(nn.Module):
+  def __init__(self,num_ch):
+    super(Conv2dBlock, self).__init__()
+    self.lin = nn.Conv2d(num_ch,num_ch,kernel_size=3,padding=1)
+
+  def forward(self, x):
+    return F.relu(self.lin(x))
+# end layer
+
 class TestTorchBraid(unittest.TestCase):
   def test_linearNet_Exact(self):
     dim = 2
@@ -176,6 +196,31 @@ class TestTorchBraid(unittest.TestCase):
     MPI.COMM_WORLD.barrier()
   # end test_reLUNet_Exact
 
+  def test_convNet_Approx_spatial_ref_pair(self):
+    dim = 8
+    num_ch = 2
+    basic_block = lambda: Conv2dBlock(num_ch)
+
+    u = torch.linspace(0.0,1.0,dim)
+    x0 = torch.zeros(3,num_ch,dim,dim) # forward initial cond
+    w0 = torch.zeros(3,num_ch,dim,dim) # adjoint initial cond
+    for ch in range(num_ch):
+      x0[:,ch,:,:] = torch.sin(2.0*np.pi*(ch+1.0)*(u[:,None]+u[None,:]))
+      w0[:,ch,:,:] = torch.cos(2.0*np.pi*(ch+1.0)*(u[:,None]-u[None,:]))
+
+    # the spatially coarse level only accelerates, iterate to the fine solution
+    max_levels = 2
+    max_iters = 20
+
+    rank = MPI.COMM_WORLD.Get_rank()
+    try:
+      self.backForwardProp(dim,basic_block,x0,w0,max_levels,max_iters,test_tol=1e-6,prefix='convNet_Approx_spatial_ref_pair',ref_pair=torchbraid.utils.SpatialRefPair())
+    except RuntimeError as err:
+      raise RuntimeError("proc=%d) convNet_Approx_spatial_ref_pair..failure" % rank) from err
+
+    MPI.COMM_WORLD.barrier()
+  # end test_convNet_Approx_spatial_ref_pair
+
   def test_reLUNet_Approx(self):
     dim = 2
     basic_block = lambda: ReLUBlock(dim)
@@ -194,6 +239,428 @@ class TestTorchBraid(unittest.TestCase):
     MPI.COMM_WORLD.barrier()
   # end test_reLUNet_Approx
 
+  def test_reLUNet_Approx_coarse_propagator(self):
+    dim = 2
+    basic_block = lambda: ReLUBlock(dim)
+
+    x0 = 12.0*torch.ones(5,dim) # forward initial cond
+    w0 = 3.0*torch.ones(5,dim) # adjoint initial cond
+    max_levels = 3
+    max_iters = 16
+
+    # the coarse propagator changes the convergence, not the converged solution
+    rank = MPI.COMM_WORLD.Get_rank()
+    for propagator in ['average',lambda layers,level: layers[-1]]:
+      try:
+        self.backForwardProp(dim,basic_block,x0,w0,max_levels,max_iters,test_tol=1e-6,
+                             prefix='reLUNet_Approx_coarse_propagator',coarse_propagator=propagator)
+      except RuntimeError as err:
+        raise RuntimeError("proc=%d) reLUNet_Approx_coarse_propagator..failure" % rank) from err
+
+    MPI.COMM_WORLD.barrier()
+  # end test_reLUNet_Approx_coarse_propagator
+
+  def test_reLUNet_Approx_step_kernels(self):
+    dim = 2
+    basic_block = lambda: ReLUBlock(dim)
+
+    x0 = 12.0*torch.ones(5,dim) # forward initial cond
+    w0 = 3.0*torch.ones(5,dim) # adjoint initial cond
+    max_levels = 3
+    max_iters = 8
+
+    rank = MPI.COMM_WORLD.Get_rank()
+    try:
+      self.backForwardProp(dim,basic_block,x0,w0,max_levels,max_iters,test_tol=1e-6,
+                           prefix='reLUNet_Approx_step_kernels',step_kernels='trace')
+    except RuntimeError as err:
+      raise RuntimeError("proc=%d) reLUNet_Approx_step_kernels..failure" % rank) from err
+
+    MPI.COMM_WORLD.barrier()
+  # end test_reLUNet_Approx_step_kernels
+
+  def test_step_kernels_train_eval(self):
+    dim = 2
+    basic_block = lambda: DropoutBlock(dim)
+
+    x0 = 12.0*torch.ones(5,dim)
+
+    m = torchbraid.LayerParallel(MPI.COMM_WORLD,basic_block,4,2.0,max_levels=1,max_iters=2)
+    m.setPrintLevel(0)
+    m.setStepKernels('trace')
+
+    # the kernels traced in training mode apply dropout and batch statistics
+    m.train()
+    with torch.no_grad():
+      m(m.copyVectorFromRoot(x0))
+
+    # eval mode gets its own kernels, matching the eager evaluation
+    m.eval()
+    with torch.no_grad():
+      y_traced = m(m.copyVectorFromRoot(x0))
+      m.setStepKernels(None)
+      y_eager = m(m.copyVectorFromRoot(x0))
+
+    self.assertTrue(torch.norm(y_traced-y_eager).item()<=1e-6*torch.norm(y_eager).item())
+
+    MPI.COMM_WORLD.barrier()
+  # end test_step_kernels_train_eval
+
+  def test_reLUNet_Approx_primal_cache(self):
+    dim = 2
+    basic_block = lambda: ReLUBlock(dim)
+
+    x0 = 12.0*torch.ones(5,dim) # forward initial cond
+    w0 = 3.0*torch.ones(5,dim) # adjoint initial cond
+    max_levels = 3
+    max_iters = 8
+
+    rank = MPI.COMM_WORLD.Get_rank()
+    for policy in ['all',2]:
+      try:
+        m = self.backForwardProp(dim,basic_block,x0,w0,max_levels,max_iters,test_tol=1e-6,
+                                 prefix='reLUNet_Approx_primal_cache_{}'.format(policy),primal_cache=policy)
+      except RuntimeError as err:
+        raise RuntimeError("proc=%d) reLUNet_Approx_primal_cache..failure" % rank) from err
+
+      # every local step is stored, with checkpoints the graphs are recomputed 
+      stats = m.fwd_app.getPrimalCache().getStatistics()
+      if policy=='all':
+        self.assertTrue(stats['hits']>=4)
+      else:
+        self.assertTrue(stats['misses']>0)
+      self.assertEqual(stats['entries'],0)
+
+    MPI.COMM_WORLD.barrier()
+  # end test_reLUNet_Approx_primal_cache
+
+  def test_reLUNet_Approx_output_placement(self):
+    dim = 2
+    basic_block = lambda: ReLUBlock(dim)
+
+    x0 = 12.0*torch.ones(5,dim) # forward initial cond
+    w0 = 3.0*torch.ones(5,dim) # adjoint initial cond
+    max_levels = 3
+    max_iters = 8
+
+    rank = MPI.COMM_WORLD.Get_rank()
+    for placement in ['root','last']:
+      try:
+        self.backForwardProp(dim,basic_block,x0,w0,max_levels,max_iters,test_tol=1e-6,
+                             prefix='reLUNet_Approx_output_placement_{}'.format(placement),output_placement=placement)
+      except RuntimeError as err:
+        raise RuntimeError("proc=%d) reLUNet_Approx_output_placement..failure" % rank) from err
+
+    MPI.COMM_WORLD.barrier()
+  # end test_reLUNet_Approx_output_placement
+
+  def test_output_placement_checks(self):
+    dim = 2
+    basic_block = lambda: ReLUBlock(dim)
+
+    x0 = 12.0*torch.ones(5,dim)
+
+    m = torchbraid.LayerParallel(MPI.COMM_WORLD,basic_block,4,2.0,max_levels=3,max_iters=8)
+    m.setPrintLevel(0)
+
+    # the compose operator evaluates on rank 0, which needs the output
+    m.setOutputPlacement('last')
+    with self.assertRaises(ValueError):
+      m.comp_op()
+    m.setOutputPlacement('root')
+    m.comp_op()
+    with self.assertRaises(ValueError):
+      m.setOutputPlacement('last')
+
+    # ranks that don't receive the output hold unallocated zeros
+    rank = m.getMPIComm().Get_rank()
+    wm = m(m.copyVectorFromRoot(x0))
+    self.assertEqual(wm.size(),x0.size())
+    if 0<rank<m.getMPIComm().Get_size()-1:
+      self.assertEqual(sum(wm.stride()),0)
+      self.assertEqual(torch.norm(wm).item(),0.0)
+
+    MPI.COMM_WORLD.barrier()
+  # end test_output_placement_checks
+
+  def test_reLUNet_residual_history(self):
+    dim = 2
+    basic_block = lambda: ReLUBlock(dim)
+
+    x0 = 12.0*torch.ones(5,dim) 
+    w0 = 3.0*torch.ones(5,dim) 
+    max_iters = 8
+
+    m = torchbraid.LayerParallel(MPI.COMM_WORLD,basic_block,4,2.0,max_levels=3,max_iters=max_iters)
+    m.setPrintLevel(0)
+    m.setStagnationTol(0.5)
+
+    for i in range(3):
+      xm = x0.clone()
+      xm.requires_grad = True
+      wm = m(xm)
+      wm.backward(w0)
+
+    for app in [m.fwd_app,m.bwd_app]:
+      iters = app.getIterationHistory()
+      rnorms = app.getResidualHistory()
+
+      self.assertEqual(len(iters),3)
+      self.assertEqual(len(rnorms),3)
+      self.assertEqual(app.getLastIterationCount(),iters[-1])
+      self.assertTrue(all([0<it<=max_iters for it in iters]))
+      self.assertTrue(len(rnorms[0])>0)
+      self.assertTrue(1<=app.getIterationCap()<=max_iters)
+
+    # disabling stagnation detection restores the iterations
+    m.setStagnationTol(None)
+    self.assertEqual(m.fwd_app.getIterationCap(),max_iters)
+
+    MPI.COMM_WORLD.barrier()
+  # end test_reLUNet_residual_history
+
+  def test_stagnation_with_controller(self):
+    # the controller sets the maximum iterations, stagnation detection caps
+    # the iterations below that maximum
+    dim = 2
+    basic_block = lambda: ReLUBlock(dim)
+
+    x0 = 12.0*torch.ones(5,dim)
+    w0 = 3.0*torch.ones(5,dim)
+
+    # enough steps that braid does not converge exactly within the iterations used
+    m = torchbraid.LayerParallel(MPI.COMM_WORLD,basic_block,32,2.0,max_levels=2,max_iters=8)
+    m.setPrintLevel(0)
+    m.setStagnationTol(0.5)
+
+    # the tolerances can't be met, so the controller adds iterations
+    ctrl = torchbraid.InexactSolveController(fwd_tol=1e-30,bwd_tol=1e-30,min_iters=2,max_fwd_iters=8,max_bwd_iters=8)
+    m.setInexactSolveController(ctrl)
+
+    app = m.fwd_app
+    self.assertEqual((app.max_iters,app.getIterationCap()),(2,2))
+
+    # a stagnation cap survives the controller applying the same maximum
+    app.setIterationCap(1)
+    ctrl.applySettings()
+    self.assertEqual((app.max_iters,app.getIterationCap()),(2,1))
+
+    # an increase by the controller takes effect, and is used by the next solve
+    for i in range(2):
+      xm = m.copyVectorFromRoot(x0)
+      xm.requires_grad = True
+      wm = m(xm)
+      wm.backward(m.copyVectorFromRoot(w0))
+      ctrl.step(torch.norm(wm).item())
+
+      fwd_iters,bwd_iters = ctrl.getIterations()
+      self.assertEqual((fwd_iters,bwd_iters),(3+i,3+i))
+      self.assertEqual((app.max_iters,app.getIterationCap()),(3+i,3+i))
+      self.assertEqual(m.bwd_app.getIterationCap(),3+i)
+
+    self.assertEqual(app.getLastIterationCount(),3)
+
+    # a lower maximum lowers the cap
+    m.setFwdMaxIters(1)
+    self.assertEqual(app.getIterationCap(),1)
+
+    MPI.COMM_WORLD.barrier()
+  # end test_stagnation_with_controller
+
+  def test_reLUNet_warm_start(self):
+    dim = 2
+    basic_block = lambda: ReLUBlock(dim)
+
+    x0 = 12.0*torch.ones(5,dim) 
+    w0 = 3.0*torch.ones(5,dim) 
+
+    m = torchbraid.LayerParallel(MPI.COMM_WORLD,basic_block,4,2.0,max_levels=3,max_iters=8)
+    m.setPrintLevel(0)
+
+    results = []
+    for i in range(2):
+      xm = x0.clone()
+      xm.requires_grad = True
+      wm = m(xm)
+      wm.backward(w0)
+      results += [(wm.detach().clone(),xm.grad.clone())]
+
+    # the second solves start from the converged states of the first
+    fwd_iters = m.fwd_app.getIterationHistory()
+    bwd_iters = m.bwd_app.getIterationHistory()
+    self.assertTrue(fwd_iters[1]<=fwd_iters[0])
+    self.assertTrue(bwd_iters[1]<=bwd_iters[0])
+
+    self.assertTrue(torch.norm(results[0][0]-results[1][0])<=1e-6*torch.norm(results[0][0]))
+    if MPI.COMM_WORLD.Get_rank()==0:
+      self.assertTrue(torch.norm(results[0][1]-results[1][1])<=1e-6*torch.norm(results[0][1]))
+
+    # a ragged batch falls back to zero states
+    xm = x0[0:3].clone()
+    wm = m(xm)
+    self.assertEqual(wm.size(),torch.Size([3,dim]))
+
+    # cold starts repeat the iterations of the first solve
+    m.setWarmStart(False)
+    for i in range(2):
+      wm = m(x0.clone())
+      self.assertEqual(m.fwd_app.getIterationHistory()[-1],fwd_iters[0])
+
+    MPI.COMM_WORLD.barrier()
+  # end test_reLUNet_warm_start
+
+  def test_reLUNet_Approx_nonuniform(self):
+    dim = 2
+    basic_block = lambda: ReLUBlock(dim)
+
+    x0 = 12.0*torch.ones(5,dim) # forward initial cond
+    w0 = 3.0*torch.ones(5,dim) # adjoint initial cond
+    max_levels = 3
+    max_iters = 8
+
+    # a different number of steps on each rank
+    num_steps = [3 if r%2==0 else 2 for r in range(MPI.COMM_WORLD.Get_size())]
+
+    rank = MPI.COMM_WORLD.Get_rank()
+    try:
+      self.backForwardProp(dim,basic_block,x0,w0,max_levels,max_iters,test_tol=1e-6,
+                           prefix='reLUNet_Approx_nonuniform',num_steps=num_steps)
+    except RuntimeError as err:
+      raise RuntimeError("proc=%d) reLUNet_Approx_nonuniform..failure" % rank) from err
+
+    MPI.COMM_WORLD.barrier()
+  # end test_reLUNet_Approx_nonuniform
+
+  def test_reLUNet_Approx_level_cfactors(self):
+    dim = 2
+    basic_block = lambda: ReLUBlock(dim)
+
+    x0 = 12.0*torch.ones(5,dim) # forward initial cond
+    w0 = 3.0*torch.ones(5,dim) # adjoint initial cond
+    max_levels = 3
+    max_iters = 8
+
+    # a different coarsening factor on each level
+    rank = MPI.COMM_WORLD.Get_rank()
+    try:
+      self.backForwardProp(dim,basic_block,x0,w0,max_levels,max_iters,test_tol=1e-6,
+                           prefix='reLUNet_Approx_level_cfactors',num_steps=8,cfactors={0:2,1:4})
+    except RuntimeError as err:
+      raise RuntimeError("proc=%d) reLUNet_Approx_level_cfactors..failure" % rank) from err
+
+    MPI.COMM_WORLD.barrier()
+  # end test_reLUNet_Approx_level_cfactors
+
+  def test_fine_points(self):
+    m = torchbraid.LayerParallel(MPI.COMM_WORLD,lambda: ReLUBlock(2),[3 if r%2==0 else 2 for r in range(MPI.COMM_WORLD.Get_size())],2.0,max_levels=3)
+    m.setCFactor(2,level=0)
+    m.setCFactor(3,level=1)
+
+    fwd_app = m.fwd_app
+    bwd_app = m.bwd_app
+    self.assertEqual(fwd_app.getFinePoint(5,0),5)
+    self.assertEqual(fwd_app.getFinePoint(5,1),10)
+    self.assertEqual(fwd_app.getFinePoint(5,2),30)
+
+    # the steps of the backward grid mirror the forward grid, and padded points 
+    # repeat the step of the last point of the rank
+    fwd_steps = fwd_app.getGridSteps()
+    bwd_steps = bwd_app.getGridSteps()
+    self.assertEqual(fwd_steps[0],0)
+    self.assertEqual(fwd_steps[-1],fwd_app.num_steps)
+    for point,step in enumerate(bwd_steps):
+      self.assertEqual(step,fwd_app.num_steps-fwd_steps[bwd_app.getMirroredPoint(point)])
+    for point,step in enumerate(fwd_steps):
+      self.assertEqual(fwd_steps[fwd_app.getLastPoint(point)],step)
+      self.assertEqual(fwd_app.getTimePoint(fwd_app.getTimeGridPoint(point)),fwd_app.getLastPoint(point))
+  # end test_fine_points
+
+  def test_reLUNet_data_parallel(self):
+    dim = 2
+    basic_block = lambda: ReLUBlock(dim)
+
+    # every rank is a serial time domain, the replicas average their gradients
+    time_comm,data_comm = torchbraid.utils.split_communicator(MPI.COMM_WORLD,1)
+    data_rank = data_comm.Get_rank()
+
+    x0 = (1.0+data_rank)*torch.ones(5,dim)
+    w0 = 3.0*torch.ones(5,dim)
+
+    m = torchbraid.LayerParallel(time_comm,basic_block,4,2.0,max_levels=1,max_iters=1)
+    m.setPrintLevel(0)
+    m.setDataParallel(data_comm,bucket_bytes=32)
+
+    xm = x0.clone()
+    xm.requires_grad = True
+    wm = m(xm)
+    wm.backward(w0)
+
+    # the reference averages the serial gradients over the replicas
+    f = m.buildSequentialOnRoot()
+    xf = x0.clone()
+    xf.requires_grad = True
+    wf = f(xf)
+    wf.backward(w0)
+
+    self.assertTrue(torch.norm(wm-wf)<=1e-12*torch.norm(wf))
+    self.assertTrue(torch.norm(xm.grad-xf.grad)<=1e-12*torch.norm(xf.grad))
+    for pf,pm in zip(f.parameters(),m.parameters()):
+      mean_grad = data_comm.allreduce(pf.grad.numpy(),op=MPI.SUM)/data_comm.Get_size()
+      self.assertTrue(torch.norm(pm.grad-torch.from_numpy(mean_grad))<=1e-12*max(torch.norm(pm.grad),1.0))
+
+    MPI.COMM_WORLD.barrier()
+  # end test_reLUNet_data_parallel
+
+  def test_reLUNet_serial_execution(self):
+    dim = 2
+    basic_block = lambda: ReLUBlock(dim)
+
+    x0 = 12.0*torch.ones(5,dim) # forward initial cond
+    w0 = 3.0*torch.ones(5,dim) # adjoint initial cond
+
+    # every rank builds a serial model, braid is used unless serial execution is set
+    m = torchbraid.LayerParallel(MPI.COMM_SELF,basic_block,4,2.0,max_levels=1,max_iters=1)
+    m.setPrintLevel(0)
+    self.assertFalse(m.useSerialExecution())
+
+    keys = list(m.state_dict().keys())
+    f = m.buildSequentialOnRoot()
+
+    results = []
+    for serial in [True,False]:
+      m.setSerialExecution(serial)
+      m.zero_grad()
+
+      xm = x0.clone()
+      xm.requires_grad = True
+      wm = m(xm)
+      wm.backward(w0)
+      results += [(wm.detach().clone(),xm.grad.clone(),[p.grad.clone() for p in m.parameters()])]
+
+    # the parameters are the same for both paths
+    self.assertEqual(list(m.state_dict().keys()),keys)
+
+    xf = x0.clone()
+    xf.requires_grad = True
+    wf = f(xf)
+    wf.backward(w0)
+
+    for wm,xm_grad,param_grads in results:
+      self.assertTrue(torch.norm(wm-wf)<=1e-12*torch.norm(wf))
+      self.assertTrue(torch.norm(xm_grad-xf.grad)<=1e-12*torch.norm(xf.grad))
+      for pf,pm_grad in zip(f.parameters(),param_grads):
+        self.assertTrue(torch.norm(pf.grad-pm_grad)<=1e-12*max(torch.norm(pf.grad),1.0))
+
+    # serial execution requires a single rank
+    if MPI.COMM_WORLD.Get_size()>1:
+      m = torchbraid.LayerParallel(MPI.COMM_WORLD,basic_block,4,2.0,max_levels=1,max_iters=1)
+      self.assertFalse(m.useSerialExecution())
+      with self.assertRaises(ValueError):
+        m.setSerialExecution(True)
+
+    MPI.COMM_WORLD.barrier()
+  # end test_reLUNet_serial_execution
+
   def copyParameterGradToRoot(self,m):
     comm     = m.getMPIComm()
     my_rank  = m.getMPIComm().Get_rank()
@@ -215,7 +682,7 @@ class TestTorchBraid(unittest.TestCase):
       return None
   # end copyParametersToRoot
 
-  def backForwardProp(self,dim, basic_block,x0,w0,max_levels,max_iters,test_tol,prefix,ref_pair=None,check_grad=True,num_steps=4,print_level=0):
+  def backForwardProp(self,dim, basic_block,x0,w0,max_levels,max_iters,test_tol,prefix,ref_pair=None,check_grad=True,num_steps=4,print_level=0,primal_cache=None,output_placement=None,coarse_propagator=None,step_kernels=None,cfactors=None):
     Tf = 2.0
 
     # this is the torchbraid class being tested 
@@ -223,12 +690,22 @@ class TestTorchBraid(unittest.TestCase):
     m = torchbraid.LayerParallel(MPI.COMM_WORLD,basic_block,num_steps,Tf,max_levels=max_levels,max_iters=max_iters,spatial_ref_pair=ref_pair)
     m.setPrintLevel(print_level)
     m.setSkipDowncycle(False)
+    if primal_cache is not None:
+      m.setPrimalCachePolicy(primal_cache)
+    if output_placement is not None:
+      m.setOutputPlacement(output_placement)
+    if coarse_propagator is not None:
+      m.setCoarsePropagator(coarse_propagator)
+    if step_kernels is not None:
+      m.setStepKernels(step_kernels)
+    if cfactors is not None:
+      for level,cfactor in cfactors.items():
+        m.setCFactor(cfactor,level)
 
     w0 = m.copyVectorFromRoot(w0)
 
     # this is the reference torch "solution"
     #######################################
-    dt = Tf/num_steps
     f = m.buildSequentialOnRoot()
 
     # run forward/backward propgation
@@ -293,7 +770,8 @@ class TestTorchBraid(unittest.TestCase):
           print('%s: p grad error (mean,stddev) = %.6e, %.6e' % (prefix,stats.mean(param_errors),stats.stdev(param_errors)))
 
       print('\n')
-        
+
+    return m
   # forwardPropSerial
 
   import sys
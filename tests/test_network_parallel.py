@@ -113,6 +113,48 @@ class TestTorchBraid(unittest.TestCase):
       assert(False) # can't run on more than four ranks
   # end test_distributeFromRoot
 
+  def test_distributeFromRoot_costs(self):
+    # dummy class to test distribution
+    class Network:
+      def children(self):
+        return [i for i in range(13)]
+   
+    comm = MPI.COMM_WORLD
+    network = Network()
+    costs = [8.0]+11*[1.0]+[4.0]
+
+    size = comm.Get_size()
+
+    result = torchbraid.distributeNetworkFromRoot(comm,network,costs)
+    all_results = comm.allgather(result)
+
+    # contiguous, and no worse than the equal count distribution
+    self.assertEqual(sum(all_results,[]),list(range(0,13)))
+    self.assertTrue(all([len(r)>0 for r in all_results]))
+
+    equal = comm.allgather(torchbraid.distributeNetworkFromRoot(comm,network))
+    cost = lambda parts: max([sum([costs[i] for i in r]) for r in parts])
+    self.assertTrue(cost(all_results)<=cost(equal))
+
+    self.assertEqual(torchbraid.partitionByCost([10,1,1,1,1,1,1,1,10],3),[0,1,8,9])
+    self.assertEqual(torchbraid.partitionByCost([1,1,1,1],2),[0,2,4])
+  # end test_distributeFromRoot_costs
+
+  def test_estimateLayerCosts(self):
+    network = nn.Sequential(nn.Conv1d(1,4,3,padding=1),nn.ReLU(),nn.Flatten(),nn.Linear(32,10))
+    x = torch.randn(2,1,8)
+
+    flops = torchbraid.estimateLayerCosts(network,x,method='flops')
+    self.assertEqual(flops,[3*2*4*8*3,3*2*4*8,3*2*32,3*2*10*32])
+
+    times = torchbraid.estimateLayerCosts(network,x,method='time')
+    self.assertEqual(len(times),4)
+    self.assertTrue(all([t>=0.0 for t in times]))
+
+    with self.assertRaises(ValueError):
+      torchbraid.estimateLayerCosts(network,x,method='guess')
+  # end test_estimateLayerCosts
+
   def test_linearNet_Exact(self):
     dim = 2
     basic_block = lambda: LinearBlock(dim)
@@ -154,6 +196,39 @@ class TestTorchBraid(unittest.TestCase):
 
     MPI.COMM_WORLD.barrier()
   # end test_reLUNet_Exact
+
+  def test_reLUNet_serial_execution(self):
+    dim = 2
+
+    x0 = 12.0*torch.ones(5,dim) # forward initial cond
+    w0 = 3.0*torch.ones(5,dim) # adjoint initial cond
+
+    # every rank builds a serial network, braid is used unless serial execution is set
+    layers = [ReLUBlock(dim) for _ in range(4)]
+    m = torchbraid.NetworkParallel(MPI.COMM_SELF,layers,max_levels=1,max_iters=1)
+    m.setPrintLevel(0)
+    self.assertFalse(m.useSerialExecution())
+
+    results = []
+    for serial in [True,False]:
+      m.setSerialExecution(serial)
+      m.zero_grad()
+
+      xm = x0.clone()
+      xm.requires_grad = True
+      wm = m(xm)
+      wm.backward(w0)
+      results += [(wm.detach().clone(),xm.grad.clone(),[p.grad.clone() for p in m.parameters()])]
+
+    # braid with a single level gives the same result
+    (ws,xs_grad,ps_grads),(wb,xb_grad,pb_grads) = results
+    self.assertTrue(torch.norm(ws-wb)<=1e-12*torch.norm(wb))
+    self.assertTrue(torch.norm(xs_grad-xb_grad)<=1e-12*torch.norm(xb_grad))
+    for ps,pb in zip(ps_grads,pb_grads):
+      self.assertTrue(torch.norm(ps-pb)<=1e-12*max(torch.norm(pb),1.0))
+
+    MPI.COMM_WORLD.barrier()
+  # end test_reLUNet_serial_execution
  
   def test_convNet_Exact(self):
     dim = 128
@@ -31,7 +31,8 @@
 
 from .layer_parallel import LayerParallel
 from .rnn_layer_parallel import RNN_Parallel
-from .network_parallel import NetworkParallel, distributeNetworkFromRoot
+from .network_parallel import NetworkParallel, distributeNetworkFromRoot, estimateLayerCosts, partitionByCost
+from .inexact_solve_controller import InexactSolveController
 
 #from . import torchbraid_app
 from .braid_vector import BraidVector
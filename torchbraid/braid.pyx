@@ -268,6 +268,13 @@ cdef extern from "_braid.h":
     int _braid_InitGuess(braid_Core  core,
                          int   level);
 
+    ##
+    # the rank owning a time index on a level (-1 if out of range)
+    int _braid_GetProc(braid_Core  core,
+                       int         level,
+                       int         index,
+                       int        *proc_ptr);
+
     ## 
     # helper functions for accessing primal vectors
     int _braid_UGetVectorRef(braid_Core        core,
@@ -33,6 +33,38 @@ import torch.autograd
 
 import torchbraid.utils as utils
 
+from mpi4py import MPI
+
+def packGradients(grads,layer):
+  """
+  Build the tensors sent for a layer's gradients: a flag for each 
+  parameter (is the gradient set), followed by the gradients with
+  zeros replacing None.
+  """
+  params = list(layer.parameters())
+  flags = torch.tensor([0.0 if g is None else 1.0 for g in grads])
+  return [flags]+[torch.zeros(p.size(),dtype=p.dtype) if g is None else g for g,p in zip(grads,params)]
+
+def unpackGradients(flags,grads):
+  return [g if f==1.0 else None for f,g in zip(flags.tolist(),grads)]
+
+def transferBuffer(t):
+  """
+  The numpy array used to send or receive a tensor, it is communicated as
+  bytes (MPI has no half precision type). Numpy has no bfloat16, so those
+  are upcast to a float32 copy that is copied back with copyTransfer.
+  """
+  if t.dtype==torch.bfloat16:
+    return t.float().numpy()
+  return t.numpy()
+
+def copyTransfer(t,buf):
+  """
+  Copy a received transfer buffer into the tensor (only bfloat16 needs it).
+  """
+  if t.dtype==torch.bfloat16:
+    t.copy_(torch.from_numpy(buf))
+
 class BraidFunction(torch.autograd.Function):
   @staticmethod
   def forward(ctx, fwd_app, bwd_app, x, *params):
@@ -41,26 +73,41 @@ class BraidFunction(torch.autograd.Function):
     num_ranks     = fwd_app.getMPIComm().Get_size()
 
     # copy the input to all processors (ensure consistency)
-    shape = comm.bcast(x.size(),root=0)
+    shape,dtype = comm.bcast((x.size(),x.dtype),root=0)
 
     # setup context
     ctx.fwd_app = fwd_app
     ctx.bwd_app = bwd_app
     ctx.save_for_backward(None, *params)
 
-    fwd_app.setShape(shape)
-    bwd_app.setShape(shape)
+    fwd_app.setShape(shape,dtype)
 
     if my_rank==0:
       result = fwd_app.run(x)
     else:
       result = fwd_app.run(None)
 
+    # only ranks receiving the output allocate it, the others get zeros that
+    # take no memory (a broadcast scalar)
+    placement = fwd_app.getOutputPlacement()
     if my_rank!=num_ranks-1:
-      result = torch.zeros(shape)
+      if placement=='all' or (placement=='root' and my_rank==0):
+        result = torch.empty(shape,dtype=dtype)
+      else:
+        result = torch.zeros((),dtype=dtype).expand(shape)
+
+    # move the output of the last layer to where it's needed
+    if num_ranks>1 and placement!='last':
+      buf = transferBuffer(result)
+      if placement=='all':
+        comm.Bcast([buf,MPI.BYTE],root=num_ranks-1)
+      elif my_rank==num_ranks-1:
+        comm.Send([buf,MPI.BYTE],dest=0,tag=26)
+      elif my_rank==0:
+        comm.Recv([buf,MPI.BYTE],source=num_ranks-1,tag=26)
+      copyTransfer(result,buf)
 
-    # broadcast the output of the last layer 
-    comm.Bcast(result.numpy(),root=num_ranks-1)
+    bwd_app.setShape(shape,dtype)
 
     return result
 
@@ -70,12 +117,15 @@ class BraidFunction(torch.autograd.Function):
     my_rank       = ctx.bwd_app.getMPIComm().Get_rank()
     num_ranks     = ctx.bwd_app.getMPIComm().Get_size()
 
-    # copy the input to the final processor (where iter time integration begins)
-    if num_ranks>1:
+    # copy the input to the final processor (where iter time integration begins),
+    # unless the output (and the loss) only lives there
+    if num_ranks>1 and ctx.fwd_app.getOutputPlacement()!='last':
+      buf = transferBuffer(grad_output)
       if my_rank==0:
-        comm.Send(grad_output.numpy(),dest=num_ranks-1)
+        comm.Send([buf,MPI.BYTE],dest=num_ranks-1)
       elif my_rank==num_ranks-1: 
-        comm.Recv(grad_output.numpy(),source=0)
+        comm.Recv([buf,MPI.BYTE],source=0)
+        copyTransfer(grad_output,buf)
 
     if my_rank==num_ranks-1:
       result = ctx.bwd_app.run(grad_output)
@@ -83,21 +133,48 @@ class BraidFunction(torch.autograd.Function):
       result = ctx.bwd_app.run(None)
 
     # send gradients to the right (braid doesn't maintain symmetry with the forward and
-    # adjoint problems)
+    # adjoint problems), this is started immediately and completed below
+    grads = ctx.bwd_app.grads
+    exchange = ctx.bwd_app.getGradientExchange()
+    if my_rank<num_ranks-1:
+      exchange.start(packGradients(grads[-1],ctx.bwd_app.fwd_app.layer_models[-1]))
+    else:
+      exchange.start()
+
     # grad_input follows the input to forward: fwd_app, bwd_app, x, params
     grad_input = (None,None) 
     grad_input += (result,)
 
-    grads = ctx.bwd_app.grads
-    if my_rank<num_ranks-1:
-      comm.send(grads[-1],dest=my_rank+1,tag=22)
-    if my_rank>0:
-      neighbor_model = comm.recv(source=my_rank-1,tag=22)
-      grads.insert(0,neighbor_model)
-
     # flatten the grads array
     grads = [g for sublist in grads for g in sublist]
 
+    # average the local gradients over data parallel replicas while the neighbor 
+    # gradients are in flight (the rank>0 first layer gradients come from the left)
+    grad_allreduce = ctx.bwd_app.getGradientAllreduce()
+    if grad_allreduce is not None:
+      num_local = len(ctx.needs_input_grad)-3
+      if my_rank>0:
+        num_local -= len(list(ctx.bwd_app.fwd_app.layer_models[0].parameters()))
+      local_reduce = grad_allreduce.start(grads[0:num_local])
+
+    if my_rank>0:
+      params = list(ctx.bwd_app.fwd_app.layer_models[0].parameters())
+      flags = torch.empty(len(params))
+      neighbor_grads = [torch.empty(p.size(),dtype=p.dtype) for p in params]
+      exchange.wait([flags]+neighbor_grads)
+
+      neighbor_grads = unpackGradients(flags,neighbor_grads)
+      if grad_allreduce is not None:
+        neighbor_grads = grad_allreduce.start(neighbor_grads).wait()
+    else:
+      neighbor_grads = []
+      exchange.wait()
+
+    if grad_allreduce is not None:
+      grads = local_reduce.wait()
+
+    grads = neighbor_grads + grads
+
     for grad_needed,param in zip(ctx.needs_input_grad[3:],grads):
       if grad_needed:
         grad_input += (param,)
@@ -34,14 +34,47 @@ from collections.abc import Iterable
 
 from mpi4py import MPI
 
+def storageViews(storage,shapes):
+  """
+  Split a flat storage tensor into views with the requested shapes.
+  """
+  views = []
+  beg = 0
+  for s in shapes:
+    end = beg+torch.Size(s).numel()
+    views += [storage[beg:end].view(s)]
+    beg = end
+  return views
+
+def flatVector(shapes,dtype,level,pool=None):
+  """
+  Build a vector whose tensors are views into a single flat storage
+  tensor, taken from the pool if it is specified. The values of the 
+  tensors are not initialized.
+  """
+  total = sum([torch.Size(s).numel() for s in shapes])
+  if pool is not None:
+    storage = pool.acquire((total,),dtype)
+  else:
+    storage = torch.empty(total,dtype=dtype)
+
+  return BraidVector(tuple(storageViews(storage,shapes)),level,pooled=pool is not None,storage=storage)
+
 class BraidVector:
   instance = -1 
 
-  def __init__(self,tensor,level):
+  def __init__(self,tensor,level,pooled=False,storage=None):
+    """
+    If storage is specified the tensors are views into this flat tensor,
+    this lets braid operate on all the tensors at once. If pooled is true, 
+    the tensors (or the storage) were taken from a TensorPool and are owned
+    by this vector (see releaseTensors).
+    """
     BraidVector.instance += 1
 
     self.instance = BraidVector.instance
     self.weight_tensor_data_ = []
+    self.weight_version_ = None
     self.layer_data_ = None
 
     if isinstance(tensor,torch.Tensor):
@@ -61,9 +94,37 @@ class BraidVector:
     self.level_  = level
     self.send_flag_ = False;
 
+    self.storage_ = storage
+
+    # tensors owned by this vector that are returned to the pool on release
+    if not pooled:
+      self.pooled_ = []
+    elif storage is not None:
+      self.pooled_ = [storage]
+    else:
+      self.pooled_ = list(self.tensor_data_)
+
   def __del__(self):
     self.tensor_data_ = None
     self.weight_tensor_data_ = None
+    self.storage_ = None
+    self.pooled_ = None
+
+  def releaseTensors(self,pool):
+    """
+    Return the pooled tensors owned by this vector to the pool. This
+    is called when braid frees the vector.
+    """
+    for t in self.pooled_:
+      pool.release(t)
+    self.pooled_ = []
+
+  def getStorage(self):
+    """
+    Get the flat tensor the state tensors are views into, this
+    is None if the tensors do not share a storage.
+    """
+    return self.storage_
 
   def setLayerData(self,layer_data):
     self.layer_data_ = layer_data
@@ -74,23 +135,39 @@ class BraidVector:
   def getLayerData(self):
     return self.layer_data_
 
-  def addWeightTensors(self,weights):
+  def addWeightTensors(self,weights,version=None):
     """
-     
+    Attach the weights of the layer applied to this vector. The version
+    identifies the weights, (rank, layer index, count), so messages can
+    omit weights the receiver already holds.
     """
     self.weight_tensor_data_ = list(weights)
+    self.weight_version_ = version
 
   def releaseWeightTensors(self):
     self.weight_tensor_data_ = []
+    self.weight_version_ = None
+
+  def weightVersion(self):
+    return self.weight_version_
 
   def replaceTensor(self,tensor,i=0):
     """
     Replace the tensor. This is a shallow
     copy of the tensor. This method returns the old
-    tensor object.
+    tensor object. The old tensor is no longer owned
+    by this vector, so it is not returned to a pool.
     """
+    if self.storage_ is not None:
+      # the remaining tensors are still views into the storage, 
+      # so it can no longer be recycled
+      self.storage_ = None
+      self.pooled_ = []
+
     if isinstance(tensor,torch.Tensor):
       old_t = self.tensor_data_[i]
+      self.pooled_ = [p for p in self.pooled_ if p is not old_t]
+
       tensor_lst = list(self.tensor_data_)
       tensor_lst[i] = tensor
       self.tensor_data_= tuple(tensor_lst)
@@ -100,6 +177,7 @@ class BraidVector:
         assert(isinstance(t,torch.Tensor))
 
       old_t = self.tensor_data_
+      self.pooled_ = []
 
       # if the input is a tuple, that is the full data
       self.tensor_data_ = tuple(tensor)
@@ -133,13 +211,29 @@ class BraidVector:
   def setSendFlag(self,send_flag):
     self.send_flag_ = send_flag
   
-  def clone(self):
-    tensors = [t.detach().clone() for t in self.tensors()]
-    cl = BraidVector(tuple(tensors),self.level())
-
-    # copy any weight tensors
-    tensors = [t.detach().clone() for t in self.weightTensors()]
-    cl.addWeightTensors(tensors)
+  def clone(self,pool=None):
+    """
+    Copy the vector. If a pool is specified the state tensors of 
+    the clone are taken from the pool.
+    """
+    dtypes = set([t.dtype for t in self.tensors()])
+    if len(dtypes)==1:
+      # copy into a single flat storage
+      cl = flatVector([t.size() for t in self.tensors()],dtypes.pop(),self.level(),pool)
+      if self.storage_ is not None:
+        cl.getStorage().copy_(self.storage_)
+      else:
+        for dest,src in zip(cl.tensors(),self.tensors()):
+          dest.copy_(src.detach())
+    else:
+      if pool is None:
+        tensors = [t.detach().clone() for t in self.tensors()]
+      else:
+        tensors = [pool.acquire(t.size(),t.dtype).copy_(t.detach()) for t in self.tensors()]
+      cl = BraidVector(tuple(tensors),self.level(),pooled=pool is not None)
+
+    # the weight tensors are not modified by braid, so they are shared
+    cl.addWeightTensors(self.weightTensors(),self.weightVersion())
 
     # copy layer information
     cl.setLayerData(self.getLayerData())
@@ -0,0 +1,204 @@
+#@HEADER
+# ************************************************************************
+# 
+#                        Torchbraid v. 0.1
+# 
+# Copyright 2020 National Technology & Engineering Solutions of Sandia, LLC 
+# (NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S. 
+# Government retains certain rights in this software.
+# 
+# Torchbraid is licensed under 3-clause BSD terms of use:
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+# 
+# 3. Neither the name National Technology & Engineering Solutions of Sandia, 
+# LLC nor the names of the contributors may be used to endorse or promote 
+# products derived from this software without specific prior written permission.
+# 
+# Questions? Contact Eric C. Cyr (eccyr@sandia.gov)
+# 
+# ************************************************************************
+#@HEADER
+
+import math
+import torch
+
+import numpy as np
+
+from mpi4py import MPI
+
+class InexactSolveController:
+  """
+  Adjusts the iterations and tolerances of the forward and backward solves 
+  between minibatches, spending just enough MGRIT work per training step. 
+
+  After each optimizer step call step(loss). The controller then looks at:
+    - the residual norms of the last forward and backward solves: if a solve
+      ended above its tolerance its iterations are increased, if it reached the
+      tolerance early they are decreased
+    - the loss change: if the loss grows by more than a factor of 
+      (1+loss_increase_tol) both solves get another iteration
+    - the gradient agreement: the cosine between the gradient and a running
+      average of recent gradients, if it drops below grad_agreement_tol the 
+      backward solve gets another iteration
+  Call epoch() at the end of each epoch to tighten the tolerances by tol_decay
+  (down to min_tol). The tolerances are also set as the absolute tolerances of
+  the solves so they stop early when met. The iterations set are the maximum of 
+  the solves, stagnation detection (see setStagnationTol) may cap them lower.
+  """
+  def __init__(self,fwd_tol=1e-3,bwd_tol=1e-3,min_iters=1,max_fwd_iters=10,max_bwd_iters=10,
+                    tol_decay=1.0,min_tol=1e-12,loss_increase_tol=0.1,grad_agreement_tol=0.0,
+                    grad_average=0.9):
+    self.fwd_tol            = fwd_tol
+    self.bwd_tol            = bwd_tol
+    self.min_iters          = min_iters
+    self.max_fwd_iters      = max_fwd_iters
+    self.max_bwd_iters      = max_bwd_iters
+    self.tol_decay          = tol_decay
+    self.min_tol            = min_tol
+    self.loss_increase_tol  = loss_increase_tol
+    self.grad_agreement_tol = grad_agreement_tol
+    self.grad_average       = grad_average
+
+    self.fwd_iters = min_iters
+    self.bwd_iters = min_iters
+
+    self.model      = None
+    self.prev_loss  = None
+    self.grad_avg   = None
+    self.history    = []
+  # end __init__
+
+  def attach(self,model):
+    """
+    Attach to a LayerParallel, NetworkParallel or RNN_Parallel module, this sets
+    the initial iterations and tolerances of its solves.
+    """
+    self.model = model
+    self.applySettings()
+
+  def applySettings(self):
+    # the module passes these to all its apps (see ParallelSettings)
+    self.model.setFwdMaxIters(self.fwd_iters)
+    self.model.setBwdMaxIters(self.bwd_iters)
+    self.model.setFwdAbsTol(self.fwd_tol)
+    self.model.setBwdAbsTol(self.bwd_tol)
+
+  def getIterations(self):
+    return self.fwd_iters,self.bwd_iters
+
+  def getTolerances(self):
+    return self.fwd_tol,self.bwd_tol
+
+  def getHistory(self):
+    """
+    Get a list with one dictionary for each step describing the observations and
+    the resulting iterations.
+    """
+    return self.history
+
+  def epoch(self):
+    self.fwd_tol = max(self.tol_decay*self.fwd_tol,self.min_tol)
+    self.bwd_tol = max(self.tol_decay*self.bwd_tol,self.min_tol)
+    self.applySettings()
+
+  def step(self,loss):
+    """
+    Update the iterations after a training step (this is collective). The loss
+    is taken from a rank holding the output of the network.
+    """
+    comm = self.model.getMPIComm()
+    num_ranks = comm.Get_size()
+
+    # make sure all ranks make the same decisions
+    loss_rank = num_ranks-1 if self.model.fwd_app.getOutputPlacement()=='last' else 0
+    loss = comm.bcast(float(loss),root=loss_rank)
+
+    fwd_rnorms = self.model.fwd_app.getLastResidualNorms()
+    bwd_rnorms = self.model.bwd_app.getLastResidualNorms()
+
+    loss_increased = self.prev_loss is not None and loss>self.prev_loss*(1.0+self.loss_increase_tol)
+    agreement = self.gradientAgreement(comm)
+    grad_disagrees = agreement is not None and agreement<self.grad_agreement_tol
+
+    # compare with the iterations the solves were allowed, stagnation detection
+    # may have capped them below the controller's iterations
+    fwd_change = self.residualChange(fwd_rnorms,self.fwd_tol,self.model.fwd_app.getIterationCap())
+    bwd_change = self.residualChange(bwd_rnorms,self.bwd_tol,self.model.bwd_app.getIterationCap())
+    if loss_increased:
+      fwd_change = max(fwd_change,1)
+      bwd_change = max(bwd_change,1)
+    if grad_disagrees:
+      bwd_change = max(bwd_change,1)
+
+    self.fwd_iters = min(max(self.fwd_iters+fwd_change,self.min_iters),self.max_fwd_iters)
+    self.bwd_iters = min(max(self.bwd_iters+bwd_change,self.min_iters),self.max_bwd_iters)
+    self.applySettings()
+
+    self.history += [{'loss'      : loss,
+                      'agreement' : agreement,
+                      'fwd_rnorm' : fwd_rnorms[-1] if fwd_rnorms else None,
+                      'bwd_rnorm' : bwd_rnorms[-1] if bwd_rnorms else None,
+                      'fwd_iters' : self.fwd_iters,
+                      'bwd_iters' : self.bwd_iters}]
+    self.prev_loss = loss
+  # end step
+
+  def residualChange(self,rnorms,tol,iters):
+    """
+    Return +1 if the solve ended above the tolerance, -1 if it reached the 
+    tolerance before its last iteration and 0 otherwise.
+    """
+    if not rnorms:
+      return 0
+    if rnorms[-1]>tol:
+      return 1
+    if len(rnorms)<iters:
+      return -1
+    return 0
+
+  def gradientAgreement(self,comm):
+    """
+    Compute the cosine between the gradient of the local parameters and the 
+    running average of recent gradients (reduced over all ranks).
+    """
+    grads = [p.grad.detach().flatten() for p in self.model.parameters() if p.grad is not None]
+    if len(grads)==0:
+      grad = torch.zeros(0)
+    else:
+      grad = torch.cat(grads)
+
+    # every rank takes part in the reduction, the last entry counts the ranks 
+    # without a matching average (then the averages are restarted everywhere)
+    local = np.zeros(4)
+    if self.grad_avg is not None and self.grad_avg.numel()==grad.numel():
+      local[0:3] = [torch.dot(grad,self.grad_avg).item(),
+                    torch.dot(grad,grad).item(),
+                    torch.dot(self.grad_avg,self.grad_avg).item()]
+    else:
+      local[3] = 1.0
+    total = np.zeros(4)
+    comm.Allreduce(local,total,op=MPI.SUM)
+
+    agreement = None
+    if total[3]==0.0:
+      if total[1]>0.0 and total[2]>0.0:
+        agreement = total[0]/math.sqrt(total[1]*total[2])
+
+      self.grad_avg = self.grad_average*self.grad_avg+(1.0-self.grad_average)*grad
+    else:
+      self.grad_avg = grad.clone()
+
+    return agreement
+  # end gradientAgreement
+
+# end InexactSolveController
@@ -40,6 +40,8 @@ import copy
 
 from torchbraid.braid_function import BraidFunction
 from torchbraid.utils import ContextTimerManager
+from torchbraid.parallel_settings import ParallelSettings
+import torchbraid.utils as utils
 
 import torchbraid.odenet_apps as apps
 
@@ -64,7 +66,7 @@ class ODEBlock(nn.Module):
     return y
 # end ODEBlock
 
-class LayerParallel(nn.Module):
+class LayerParallel(nn.Module,ParallelSettings):
   
   class ExecLP:
     """Helper class for btorchuilding composite neural network modules
@@ -111,9 +113,15 @@ class LayerParallel(nn.Module):
     self.comm = comm
 
     self.exec_helper = self.ExecLP(comm.Get_rank())
+    self.exec_helper_used = False
 
-    # optional parameters
-    global_steps = num_steps*comm.Get_size()
+    # the number of steps on this rank, or a list with the steps on each rank
+    if isinstance(num_steps,(list,tuple)):
+      assert(len(num_steps)==comm.Get_size())
+      global_steps = sum(num_steps)
+      num_steps = num_steps[comm.Get_rank()]
+    else:
+      global_steps = num_steps*comm.Get_size()
 
     self.dt = Tf/global_steps
   
@@ -127,6 +135,9 @@ class LayerParallel(nn.Module):
                                          spatial_ref_pair=spatial_ref_pair)
     self.bwd_app = apps.BackwardODENetApp(self.fwd_app,self.timer_manager)
 
+    # evaluate the layers without braid (see setSerialExecution)
+    self.serial_execution = False
+
     self.enable_diagnostics = False
   # end __init__
 
@@ -134,6 +145,10 @@ class LayerParallel(nn.Module):
     """Short for compose operator, returns a functor that allows contstruction of composite neural 
        networks using this LayerParallel module.
     """
+    # the composed operators run on rank 0, which must hold the output
+    if self.fwd_app.getOutputPlacement()=='last':
+      raise ValueError('comp_op: the compose operator requires the output on rank 0, it can not be used with the \'last\' output placement')
+    self.exec_helper_used = True
     return self.exec_helper
 
   def zero_grad(self):
@@ -142,47 +157,88 @@ class LayerParallel(nn.Module):
       l.zero_grad()
     self.local_layers.zero_grad()
 
-  def getTimerManager(self):
-    """
-    Get a TimerContextManager that describes how much time is taken by what.
-    """
-    return self.timer_manager
+  def setMaxIters(self,max_iters):
+    self.setNumRelax(max_iters)
 
-  def setPrintLevel(self,print_level,tb_print=False):
+  def setDataParallel(self,data_comm,bucket_bytes=2**22):
     """
-    Set the print level for this module. If tb_print (torchbraid print) is
-    set to true this method sets the internal printing diagnostics. If it is
-    false, the print level is passed along to xbraid. 
+    Average the parameter gradients over data parallel replicas after the backward
+    solve. Each replica runs its own layer parallel solve (on the communicator
+    passed to the constructor) with its shard of the minibatch, see 
+    utils.split_communicator. Use None to turn this off.
     """
+    grad_allreduce = None
+    if data_comm is not None:
+      grad_allreduce = utils.GradientAllreduce(data_comm,bucket_bytes)
 
-    self.fwd_app.setPrintLevel(print_level,tb_print)
-    self.bwd_app.setPrintLevel(print_level,tb_print)
+    for fwd_app,bwd_app in self.getAppPairs():
+      bwd_app.setGradientAllreduce(grad_allreduce)
 
-  def setNumRelax(self,relax,level=-1):
-    self.fwd_app.setNumRelax(relax,level=level)
-    self.bwd_app.setNumRelax(relax,level=level)
+  def setPrimalCachePolicy(self,policy,budget=None):
+    """
+    Store the forward graphs of the fine level steps for use in the backward
+    pass, instead of recomputing them. This trades memory for compute, the 
+    policy is one of
 
-  def setMaxIters(self,max_iters):
-    self.fwd_app.setNumRelax(max_iters)
-    self.bwd_app.setNumRelax(max_iters)
+      'none'  - recompute every step (the default)
+      'all'   - store every step
+      k (int) - store the state of every k-th step as a checkpoint, and 
+                recompute the graphs of the steps after it when needed
 
-  def setFwdMaxIters(self,max_iters):
-    self.fwd_app.setMaxIters(max_iters)
+    budget is the maximum memory (in bytes) used by the cache. Call this 
+    before the first forward.
+    """
+    for fwd_app,bwd_app in self.getAppPairs():
+      fwd_app.setPrimalCachePolicy(policy,budget)
 
-  def setBwdMaxIters(self,max_iters):
-    self.bwd_app.setMaxIters(max_iters)
+  def setCoarsePropagator(self,propagator):
+    """
+    Set the layer used for the coarse level steps: 'fine' (the fine layer at the
+    start of the step, the default), 'average' (the average of the weights of the
+    fine layers spanned by the step) or a callable propagator(layers,level) 
+    returning the module to apply, for instance a reduced width or low rank 
+    surrogate of the layers. The backward solve uses the same coarse layers.
+    """
+    for fwd_app,bwd_app in self.getAppPairs():
+      fwd_app.setCoarsePropagator(propagator)
 
-  def setFMG(self):
-    self.fwd_app.setFMG()
-    self.bwd_app.setFMG()
+  def setStepKernels(self,mode):
+    """
+    Compile the forward step of each local layer with TorchScript ('trace' or
+    'script'), or evaluate it eagerly (None, the default). Tracing requires 
+    layers without data dependent control flow.
+    """
+    for fwd_app,bwd_app in self.getAppPairs():
+      fwd_app.setStepKernels(mode)
 
-  def setCFactor(self,cfactor):
-    self.fwd_app.setCFactor(cfactor)
-    self.bwd_app.setCFactor(cfactor)
+  def setOutputPlacement(self,placement):
+    """
+    Set which ranks hold the output of forward: 'all' (the default), 'root'
+    (rank 0 only) or 'last' (the last rank only). The loss must be computed on
+    a rank holding the output. With 'last' the gradient passed to backward 
+    is used on the last rank directly, otherwise it is taken from rank 0. 
+    'last' can not be used with the compose operator (see comp_op), which 
+    evaluates on rank 0.
+    """
+    if placement=='last' and self.exec_helper_used:
+      raise ValueError('setOutputPlacement: \'last\' can not be used with the compose operator (comp_op), which requires the output on rank 0')
+    for fwd_app,bwd_app in self.getAppPairs():
+      fwd_app.setOutputPlacement(placement)
+
+  def setSerialExecution(self,serial):
+    """
+    Evaluate the local layers as a sequence of ODE blocks under native autograd,
+    instead of with braid. This is only possible on a single rank, and is off 
+    by default. No braid statistics (residual history, iteration counts) are
+    recorded on this path. The parameters are not changed, so the state_dict 
+    is the same either way.
+    """
+    if serial and self.comm.Get_size()>1:
+      raise ValueError('setSerialExecution: serial execution requires a single rank ({} were used)'.format(self.comm.Get_size()))
+    self.serial_execution = serial
 
-  def setSkipDowncycle(self,skip):
-    self.fwd_app.setSkipDowncycle(skip)
-    self.bwd_app.setSkipDowncycle(skip)
+  def useSerialExecution(self):
+    return self.serial_execution
 
   def getMPIComm(self):
     return self.fwd_app.getMPIComm()
@@ -191,14 +247,24 @@ class LayerParallel(nn.Module):
     # we are doing this to take adavtage of
     # pytorch's autograd which functions "naturally"
     # with the torch.autograd.function
+    if self.useSerialExecution():
+      # the same computation as the ODEBlocks of buildSequentialOnRoot
+      with self.timer_manager.timer("LayerParallel::serial"):
+        for layer in self.layer_models:
+          y = self.dt*layer(x)
+          y.add_(x)
+          x = y
+      return x
+
     params = list(self.parameters())
 
-    if self.training:
-      self.fwd_app.trainNetwork()
-      self.bwd_app.trainNetwork() # for consistency, though the bwd_app should *only* be used in training
-    else:
-      self.fwd_app.evalNetwork()
-      self.bwd_app.evalNetwork()
+    for fwd_app,bwd_app in self.getAppPairs():
+      if self.training:
+        fwd_app.trainNetwork()
+        bwd_app.trainNetwork() # for consistency, though the bwd_app should *only* be used in training
+      else:
+        fwd_app.evalNetwork()
+        bwd_app.evalNetwork()
 
     return BraidFunction.apply(self.fwd_app,self.bwd_app,x,*params) 
   # end forward
@@ -292,6 +358,10 @@ class LayerParallel(nn.Module):
     if num_ranks==1:
       return vec
 
+    # the root already holds the output
+    if self.fwd_app.getOutputPlacement()!='last':
+      return vec if my_rank==0 else None
+
     # send the output of the last layer to the root
     if my_rank==0:
       remote_final = comm.recv(source=num_ranks-1,tag=build_seq_tag)
@@ -321,14 +391,20 @@ class LayerParallel(nn.Module):
       result = comm.recv(source=0,tag=build_seq_tag)
       return result
 
-  def getTimersString(self):
+  def getTimersString(self,summary=False):
     """
-    Print the timers recored by the model.
+    Print the timers recored by the model. If summary is true, the timers are 
+    reduced across processors, reporting the imbalance and slowest rank for each
+    timer, instead of printing the timers of every processor.
     """
     comm     = self.comm
     my_rank  = self.comm.Get_rank() 
     num_proc = self.comm.Get_size() 
 
+    if summary:
+      result = self.timer_manager.getReducedResultString(comm)
+      return result if my_rank==0 else None
+
     local_result = self.timer_manager.getResultString()
     result = comm.gather(local_result,root=0)
 
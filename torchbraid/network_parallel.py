@@ -40,21 +40,125 @@ import copy
 
 from torchbraid.braid_function import BraidFunction
 from torchbraid.utils import ContextTimerManager
+from torchbraid.parallel_settings import ParallelSettings
+import torchbraid.utils as utils
 
 import torchbraid.resnet_apps as apps
 
 import numpy as np
 
-def distributeNetworkFromRoot(comm,network):
+from timeit import default_timer as timer
+
+def timeLayer(layer,x):
+  """
+  Time the forward and backward of a layer applied to x.
+  """
+  x = x.detach().requires_grad_(True)
+  inputs = [x]+[p for p in layer.parameters() if p.requires_grad]
+
+  start = timer()
+  y = layer(x)
+  torch.autograd.grad(y,inputs,grad_outputs=torch.ones_like(y),allow_unused=True)
+  return timer()-start
+
+def countLayerFlops(layer,x):
+  """
+  Estimate the forward and backward multiply-adds of a layer applied to x. Linear
+  and convolution layers are counted exactly, other leaf modules count the size
+  of their output. The backward is taken to be twice the forward.
+  """
+  flops = [0]
+  def count(module,inputs,output):
+    if isinstance(module,nn.Linear):
+      flops[0] += output.numel()*module.in_features
+    elif isinstance(module,nn.modules.conv._ConvNd):
+      flops[0] += output.numel()*(module.in_channels//module.groups)*int(np.prod(module.kernel_size))
+    elif torch.is_tensor(output):
+      flops[0] += output.numel()
+
+  handles = [m.register_forward_hook(count) for m in layer.modules() if len(list(m.children()))==0]
+  with torch.no_grad():
+    layer(x)
+  for h in handles:
+    h.remove()
+
+  return 3*flops[0]
+
+def estimateLayerCosts(network,x,method='time',num_trials=3):
+  """
+  Estimate the forward+backward cost of each child of the network, the children
+  are applied in sequence starting from the sample input x.
+
+  network: the network to estimate, usually on the root
+  x: a sample input to the network
+  method: 'time' to use the fastest of num_trials timings, or 'flops' to count 
+          multiply-adds
+
+  returns: a list with the cost of each child, this can be passed to
+           distributeNetworkFromRoot
+  """
+  if method not in ['time','flops']:
+    raise ValueError('Cost method must be \'time\' or \'flops\', found \'{}\''.format(method))
+
+  costs = []
+  for child in network.children():
+    if method=='time':
+      costs += [min([timeLayer(child,x) for _ in range(num_trials)])]
+    else:
+      costs += [countLayerFlops(child,x)]
+
+    with torch.no_grad():
+      x = child(x)
+
+  return costs
+# end estimateLayerCosts
+
+def partitionByCost(costs,num_parts):
+  """
+  Split a sequence of costs into contiguous, non-empty parts minimizing the 
+  maximum cost of a part.
+
+  returns: the offsets of the parts, part i is costs[count[i]:count[i+1]]
+  """
+  n = len(costs)
+  assert(n>=num_parts)
+
+  prefix = np.concatenate([[0.0],np.cumsum(costs)])
+
+  # best[k][j]: minimal maximum cost splitting the first j costs into k+1 parts,
+  # split[k][j]: where the last of those parts begins
+  best  = np.full((num_parts,n+1),np.inf)
+  split = np.zeros((num_parts,n+1),dtype=int)
+  best[0,1:] = prefix[1:]
+  for k in range(1,num_parts):
+    for j in range(k+1,n+1):
+      for i in range(k,j):
+        value = max(best[k-1,i],prefix[j]-prefix[i])
+        if value<best[k,j]:
+          best[k,j]  = value
+          split[k,j] = i
+
+  count = (num_parts+1)*[0]
+  count[num_parts] = n
+  for k in range(num_parts-1,0,-1):
+    count[k] = int(split[k,count[k+1]])
+
+  return count
+# end partitionByCost
+
+def distributeNetworkFromRoot(comm,network,costs=None):
   """
   Function takes the network on the root and distributes children across multiple processors
 
   comm: Communicator to use for distribution
   network: defined on the root (ignored elsewhere), children will be distributed
+  costs: the cost of each child on the root (see estimateLayerCosts), if this is None
+         all children are assumed to cost the same
 
   returns: Network's on each processor, on the root it will contain references to the
            layers selected for this processors. The children will be distributed
-           accordinng to processor rank in a linear way. The work will not be load balanced.
+           accordinng to processor rank in a linear way. If costs are provided, the 
+           contiguous distribution minimizing the maximum cost on a processor is used.
   """
 
   num_ranks = comm.Get_size()
@@ -65,21 +169,25 @@ def distributeNetworkFromRoot(comm,network):
 
     assert(len(children)>=num_ranks)
 
-    even = len(children) // num_ranks
-    remain = len(children) % num_ranks
-
-    # figure out how many layers to distribute to each processor
-    # (adds an additional for each remaining processors)
-    count = (num_ranks+1)*[0]
-    offset = 0
-    for i in range(num_ranks):
-      count[i+1] = offset+even 
-      offset += even
-      if remain>0:
-        count[i+1] += 1
-        remain -= 1
-        offset += 1
-    assert(offset==len(children))
+    if costs is not None:
+      assert(len(costs)==len(children))
+      count = partitionByCost(costs,num_ranks)
+    else:
+      even = len(children) // num_ranks
+      remain = len(children) % num_ranks
+
+      # figure out how many layers to distribute to each processor
+      # (adds an additional for each remaining processors)
+      count = (num_ranks+1)*[0]
+      offset = 0
+      for i in range(num_ranks):
+        count[i+1] = offset+even 
+        offset += even
+        if remain>0:
+          count[i+1] += 1
+          remain -= 1
+          offset += 1
+      assert(offset==len(children))
 
     # now that the counts are setup properly, it should be trivial
     all_children = num_ranks*[None]
@@ -92,7 +200,7 @@ def distributeNetworkFromRoot(comm,network):
 
 # end distributedNetworkFromRoot
 
-class NetworkParallel(nn.Module):
+class NetworkParallel(nn.Module,ParallelSettings):
   
   class ExecLP:
     """Helper class for building composite neural network modules
@@ -139,6 +247,7 @@ class NetworkParallel(nn.Module):
     self.comm = comm
 
     self.exec_helper = self.ExecLP(comm.Get_rank())
+    self.exec_helper_used = False
 
     self.layers = layers[:] # copy the list (so we don't modify the passed in value)
                             # note that this _does_not_ copy the layers, just the list
@@ -148,12 +257,19 @@ class NetworkParallel(nn.Module):
 
     self.fwd_app = apps.ForwardResNetApp(comm,self.layers,max_levels,max_iters,self.timer_manager)
     self.bwd_app = apps.BackwardResNetApp(self.fwd_app,self.timer_manager)
+
+    # evaluate the layers without braid (see setSerialExecution)
+    self.serial_execution = False
   # end __init__
 
   def comp_op(self):
     """Short for compose operator, returns a functor that allows contstruction of composite neural 
        networks using this LayerParallel module.
     """
+    # the composed operators run on rank 0, which must hold the output
+    if self.fwd_app.getOutputPlacement()=='last':
+      raise ValueError('comp_op: the compose operator requires the output on rank 0, it can not be used with the \'last\' output placement')
+    self.exec_helper_used = True
     return self.exec_helper
 
   def zero_grad(self):
@@ -162,47 +278,48 @@ class NetworkParallel(nn.Module):
       l.zero_grad()
     self.local_layers.zero_grad()
 
-  def getTimerManager(self):
-    """
-    Get a TimerContextManager that describes how much time is taken by what.
-    """
-    return self.timer_manager
-
-  def setPrintLevel(self,print_level,tb_print=False):
-    """
-    Set the print level for this module. If tb_print (torchbraid print) is
-    set to true this method sets the internal printing diagnostics. If it is
-    false, the print level is passed along to xbraid. 
-    """
-
-    self.fwd_app.setPrintLevel(print_level,tb_print)
-    self.bwd_app.setPrintLevel(print_level,tb_print)
-
-  def setNumRelax(self,relax,level=-1):
-    self.fwd_app.setNumRelax(relax,level=level)
-    self.bwd_app.setNumRelax(relax,level=level)
-
   def setMaxIters(self,max_iters):
     self.fwd_app.setNumRelax(max_iters)
     self.bwd_app.setNumRelax(max_iters)
 
-  def setFwdMaxIters(self,max_iters):
-    self.fwd_app.setMaxIters(max_iters)
+  def setDataParallel(self,data_comm,bucket_bytes=2**22):
+    """
+    Average the gradients over data parallel replicas (see LayerParallel.setDataParallel).
+    """
+    if data_comm is None:
+      self.bwd_app.setGradientAllreduce(None)
+    else:
+      self.bwd_app.setGradientAllreduce(utils.GradientAllreduce(data_comm,bucket_bytes))
 
-  def setBwdMaxIters(self,max_iters):
-    self.bwd_app.setMaxIters(max_iters)
+  def setPrimalCachePolicy(self,policy,budget=None):
+    """
+    Store the forward graphs of the steps, see LayerParallel.setPrimalCachePolicy.
+    """
+    self.fwd_app.setPrimalCachePolicy(policy,budget)
 
-  def setFMG(self):
-    self.fwd_app.setFMG()
-    self.bwd_app.setFMG()
+  def setOutputPlacement(self,placement):
+    """
+    Set which ranks hold the output of forward: 'all', 'root' or 'last' ('last'
+    can not be used with the compose operator, see comp_op).
+    """
+    if placement=='last' and self.exec_helper_used:
+      raise ValueError('setOutputPlacement: \'last\' can not be used with the compose operator (comp_op), which requires the output on rank 0')
+    self.fwd_app.setOutputPlacement(placement)
 
-  def setCFactor(self,cfactor):
-    self.fwd_app.setCFactor(cfactor)
-    self.bwd_app.setCFactor(cfactor)
+  def setSerialExecution(self,serial):
+    """
+    Evaluate the local layers in sequence under native autograd, instead of 
+    with braid. This is only possible on a single rank, and is off by default.
+    No braid statistics (residual history, iteration counts) are recorded on 
+    this path. The parameters are not changed, so the state_dict is the same
+    either way.
+    """
+    if serial and self.comm.Get_size()>1:
+      raise ValueError('setSerialExecution: serial execution requires a single rank ({} were used)'.format(self.comm.Get_size()))
+    self.serial_execution = serial
 
-  def setSkipDowncycle(self,skip):
-    self.fwd_app.setSkipDowncycle(skip)
-    self.bwd_app.setSkipDowncycle(skip)
+  def useSerialExecution(self):
+    return self.serial_execution
 
   def getMPIComm(self):
     return self.fwd_app.getMPIComm()
@@ -211,6 +328,10 @@ class NetworkParallel(nn.Module):
     # we are doing this to take adavtage of
     # pytorch's autograd which functions "naturally"
     # with the torch.autograd.function
+    if self.useSerialExecution():
+      with self.timer_manager.timer("NetworkParallel::serial"):
+        return self.local_layers(x)
+
     params = list(self.parameters())
 
     if self.training:
@@ -233,6 +354,10 @@ class NetworkParallel(nn.Module):
     if num_ranks==1:
       return vec
 
+    # the root already holds the output
+    if self.fwd_app.getOutputPlacement()!='last':
+      return vec if my_rank==0 else None
+
     # send the output of the last layer to the root
     if my_rank==0:
       remote_final = comm.recv(source=num_ranks-1,tag=build_seq_tag)
@@ -262,14 +387,20 @@ class NetworkParallel(nn.Module):
       result = comm.recv(source=0,tag=build_seq_tag)
       return result
 
-  def getTimersString(self):
+  def getTimersString(self,summary=False):
     """
-    Print the timers recored by the model.
+    Print the timers recored by the model. If summary is true, the timers are 
+    reduced across processors, reporting the imbalance and slowest rank for each
+    timer, instead of printing the timers of every processor.
     """
     comm     = self.comm
     my_rank  = self.comm.Get_rank() 
     num_proc = self.comm.Get_size() 
 
+    if summary:
+      result = self.timer_manager.getReducedResultString(comm)
+      return result if my_rank==0 else None
+
     local_result = self.timer_manager.getResultString()
     result = comm.gather(local_result,root=0)
 
@@ -42,6 +42,18 @@ import copy
 
 from mpi4py import MPI
 
+class ODEStepKernel(torch.nn.Module):
+  """
+  The forward Euler step of a layer, this is compiled by ForwardODENetApp.setStepKernels.
+  """
+  def __init__(self,layer):
+    super(ODEStepKernel,self).__init__()
+    self.layer = layer
+
+  def forward(self,x,dt):
+    return x+dt*self.layer(x)
+# end ODEStepKernel
+
 class ForwardODENetApp(BraidApp):
 
   def __init__(self,comm,layer_models,local_num_steps,Tf,max_levels,max_iters,timer_manager,spatial_ref_pair=None):
@@ -67,6 +79,9 @@ class ForwardODENetApp(BraidApp):
       # this is a sentinel at the end of the processors and layers
       self.layer_models.append(None)
 
+    # persistent requests for the neighbor exchange in updateParallelWeights
+    self.buildParallelWeightExchange()
+
     # build up the core
     self.py_core = self.initCore()
 
@@ -74,26 +89,71 @@ class ForwardODENetApp(BraidApp):
     self.use_deriv = False
 
     self.parameter_shapes = []
+    self.parameter_dtypes = []
     for p in layer_models[0].parameters(): 
       self.parameter_shapes += [p.data.size()]
+      self.parameter_dtypes += [p.data.dtype]
 
     self.temp_layer = copy.deepcopy(self.layer_models[0])
     self.clearTempLayerWeights()
+
+    self.primal_cache = utils.PrimalCache()
+
+    # the layers used for coarse level steps (see setCoarsePropagator)
+    self.coarse_propagator = None
+    self.coarse_spec = None
+    self.coarse_template = copy.deepcopy(self.layer_models[0])
+    self.coarse_layers = dict()
+
+    # compiled fine steps of the local layers (see setStepKernels)
+    self.step_kernel_mode = None
+    self.step_kernels = dict()
+
+    # versions of the layer weights, these are bumped when the weights change
+    self.versioned_weights = True
+    self.weight_versions = len(self.layer_models)*[0]
+    self.weight_states   = len(self.layer_models)*[None]
   # end __init__
 
   def __del__(self):
     pass
 
+  def destroy(self):
+    self.weight_exchange.free()
+    BraidApp.destroy(self)
+
   def getTensorShapes(self):
     return list(self.shape0)+self.parameter_shapes
 
-  def setVectorWeights(self,t,tf,level,x):
-    layer = self.getLayer(t,tf,level)
+  def getTensorDTypes(self):
+    return len(self.shape0)*[self.dtype0]+self.parameter_dtypes
+
+  def setVectorWeights(self,point,x):
+    layer = self.getLayer(point)
     if layer!=None:
       weights = [p.data for p in layer.parameters()]
     else:
       weights = []
-    x.addWeightTensors(weights)
+    x.addWeightTensors(weights,self.getWeightVersion(point,layer))
+
+  def getWeightVersion(self,point,layer):
+    index = self.getLocalStepIndex(point)
+    if layer is None or layer is self.temp_layer:
+      return None
+    return (self.my_rank,index,self.weight_versions[index])
+
+  def updateWeightVersions(self):
+    """
+    Bump the versions of the local layers whose parameters changed since the 
+    last run. In place updates (e.g. by an optimizer) bump the tensor versions
+    and assignments change the data pointers. The neighbor layer is updated by
+    the weight exchange, so its version is bumped with each exchange.
+    """
+    for i,layer in enumerate(self.layer_models[:-1]):
+      state = [(p.data_ptr(),p._version) for p in layer.parameters()]
+      if state!=self.weight_states[i]:
+        self.weight_states[i] = state
+        self.weight_versions[i] += 1
 
   def clearTempLayerWeights(self):
     layer = self.temp_layer
@@ -102,8 +162,13 @@ class ForwardODENetApp(BraidApp):
       dest_p.data = torch.empty(())
   # end setLayerWeights
 
-  def setLayerWeights(self,t,tf,level,weights):
-    layer = self.getLayer(t,tf,level)
+  def setLayerWeights(self,point,weights):
+    layer = self.getLayer(point)
+
+    # vectors carry the weights of local layers from the layer itself, so only
+    # the temporary layer (for a neighbor's step) needs them
+    if layer is not self.temp_layer:
+      return
 
     with torch.no_grad():
       for dest_p,src_w in zip(list(layer.parameters()),weights):
@@ -111,33 +176,158 @@ class ForwardODENetApp(BraidApp):
   # end setLayerWeights
 
   def initializeVector(self,t,x):
-    self.setVectorWeights(t,0.0,0,x)
+    self.setVectorWeights(self.getTimePoint(t),x)
 
-  def updateParallelWeights(self):
-    # send everything to the left (this helps with the adjoint method)
+  def exchangeWeights(self,layer):
+    """
+    The tensors sent to the left neighbor for a layer.
+    """
+    if layer is None:
+      return []
+    return [t.data for t in list(layer.parameters())+list(layer.buffers())]
+
+  def buildParallelWeightExchange(self):
     comm          = self.getMPIComm()
     my_rank       = self.getMPIComm().Get_rank()
     num_ranks     = self.getMPIComm().Get_size()
 
-    if my_rank>0:
-      comm.send(self.layer_models[0],dest=my_rank-1,tag=22)
-    if my_rank<num_ranks-1:
-      neighbor_model = comm.recv(source=my_rank+1,tag=22)
-      self.layer_models[-1] = neighbor_model
+    # send to the left, receive from the right (the neighbor model is at the end)
+    dest   = my_rank-1 if my_rank>0 else None
+    source = my_rank+1 if my_rank<num_ranks-1 else None
+
+    send_weights = self.exchangeWeights(self.layer_models[0])
+    recv_weights = self.exchangeWeights(self.layer_models[-1])
+
+    send_shapes = [w.size() for w in send_weights]
+    recv_shapes = [w.size() for w in recv_weights]
+    dtype = utils.exchange_dtype(send_weights+recv_weights)
+
+    self.weight_exchange = utils.NeighborExchange(comm,send_shapes,dest,recv_shapes,source,tag=24,dtype=dtype)
+
+  def updateParallelWeights(self):
+    # send everything to the left (this helps with the adjoint method), 
+    # this is completed when the neighbor layer is needed
+    self.weight_exchange.start(self.exchangeWeights(self.layer_models[0]))
+
+  def completeParallelWeights(self):
+    if self.weight_exchange.isActive():
+      self.weight_exchange.wait(self.exchangeWeights(self.layer_models[-1]))
+
+  def setPrimalCachePolicy(self,policy,budget=None):
+    """
+    Set which forward graphs are stored for the adjoint: 'none', 'all' or
+    checkpoints at every k-th step (an integer, see PrimalCache). The budget 
+    limits the memory (in bytes) used by the cache. Storing graphs requires a
+    final FC relaxation of the forward problem.
+    """
+    self.primal_cache.setPolicy(policy,budget)
+    if self.primal_cache.enabled():
+      self.finalRelax()
+
+    # the checkpoints replace the states braid keeps at the F-points
+    self.setRequireStorage(not self.primal_cache.usesCheckpoints())
+
+  def getPrimalCache(self):
+    return self.primal_cache
+
+  def setCoarsePropagator(self,propagator):
+    """
+    Set the layer used for the steps on the coarse levels:
+
+      None or 'fine' - the fine layer at the start of the step (the default)
+      'average'      - a layer whose weights average the fine layers the step spans
+      callable       - propagator(layers,level) returns the module applied for a
+                       step spanning the fine layers, e.g. a low rank surrogate
+
+    The coarse layers are built once per forward solve.
+    """
+    if propagator is None or propagator=='fine':
+      self.coarse_propagator = None
+    elif propagator=='average':
+      self.coarse_propagator = self.averageLayers
+    elif callable(propagator):
+      self.coarse_propagator = propagator
+    else:
+      raise ValueError('setCoarsePropagator: propagator must be "fine", "average" or a callable ("{}" was used)'.format(propagator))
+
+    self.coarse_spec = propagator
+    self.coarse_layers = dict()
+
+  def getCoarsePropagator(self):
+    return self.coarse_spec
+
+  def averageLayers(self,layers,level):
+    """
+    Build a layer whose parameters are the average of the parameters of the
+    layers, buffers are taken from the first layer.
+    """
+    layer = copy.deepcopy(self.coarse_template)
+    params = [list(l.parameters()) for l in layers]
+    with torch.no_grad():
+      for i,dest_p in enumerate(layer.parameters()):
+        dest_p.data = sum([p[i].data for p in params])/len(layers)
+      for dest_b,src_b in zip(layer.buffers(),layers[0].buffers()):
+        dest_b.data = src_b.data.clone()
+    return layer
+
+  def getSpannedLayers(self,start,stop):
+    """
+    The fine layers between the fine grid points start and stop. Fine layers on
+    the left neighbor are represented by the temporary layer holding the weights
+    sent with the vector.
+    """
+    begin = self.getLocalStepIndex(start)
+    end   = max(self.getLocalStepIndex(stop),begin+1)
+
+    layers = [self.temp_layer] if begin<0 else []
+    for index in range(max(begin,0),end):
+      if index==len(self.layer_models)-1:
+        self.completeParallelWeights()
+      layers += [self.layer_models[index]]
+    return layers
+
+  def getStepLayer(self,start,stop,level):
+    """
+    The layer applied for the step between the fine grid points start and stop.
+    This is the fine layer unless a coarse propagator is set and the level is coarse.
+    """
+    if level==0 or self.coarse_propagator is None:
+      return self.getLayer(start)
+
+    key = (level,self.getLocalStepIndex(start),self.getLocalStepIndex(stop))
+    layer = self.coarse_layers.get(key)
+    if layer is None:
+      with self.timer("coarse layer"):
+        layer = self.coarse_propagator(self.getSpannedLayers(start,stop),level)
+      self.coarse_layers[key] = layer
+    return layer
+
+  def clearRunCaches(self):
+    self.primal_cache.clear()
+    self.coarse_layers = dict()
 
   def run(self,x):
     # turn on derivative path (as requried)
     self.use_deriv = self.training
 
+    # graphs and coarse layers from the last run are no longer valid
+    self.clearRunCaches()
+
     # run the braid solver
     with self.timer("runBraid"):
 
+      # the weights may have changed since the last run
+      self.updateWeightVersions()
+
       # do boundary exchange for parallel weights
       if self.use_deriv:
+        self.weight_versions[-1] += 1
         self.updateParallelWeights()
 
       y = self.runBraid(x)
 
+      self.completeParallelWeights()
+
       # reset derivative papth
       self.use_deriv = False
 
@@ -150,8 +340,12 @@ class ForwardODENetApp(BraidApp):
   def timer(self,name):
     return self.timer_manager.timer("ForWD::"+name)
 
-  def getLayer(self,t,tf,level):
-    index = self.getLocalTimeStepIndex(t,tf,level)
+  def getLayer(self,point):
+    index = self.getLocalStepIndex(point)
+    if index==len(self.layer_models)-1:
+      # the neighbor layer weights may still be in flight
+      self.completeParallelWeights()
+
     if index < 0:
       #pre_str = "\n{}: WARNING: getLayer index negative at {}: {}\n".format(self.my_rank,t,index)
       #stack_str = utils.stack_string('{}: |- '.format(self.my_rank))
@@ -168,63 +362,181 @@ class ForwardODENetApp(BraidApp):
 
     return params
 
-  def eval(self,y,tstart,tstop,level,done,x=None):
+  def eval(self,y,tstart,tstop,level,done,tindex):
     """
     Method called by "my_step" in braid. This is
-    required to propagate from tstart to tstop, with the initial
-    condition x. The level is defined by braid
+    required to propagate from tstart to tstop, the level 
+    and the time index of tstart are defined by braid
     """
+    start = self.getFinePoint(tindex,level)
+    stop  = self.getFinePoint(tindex+1,level)
 
-    # this function is used twice below to define an in place evaluation
-    def in_place_eval(t_y,tstart,tstop,level,t_x=None):
-      # get some information about what to do
-      dt = tstop-tstart
-      layer = self.getLayer(tstart,tstop,level) # resnet "basic block"
+    self.setLayerWeights(start,y.weightTensors())
 
-      #print(self.my_rank, ": FWDeval level ", level, " ", tstart, "->", tstop, " using layer ", layer.getID(), ": ", layer.linearlayer.weight[0].data)
+    t_y = y.tensor().detach()
 
-      if t_x==None:
-        t_x = t_y
-      else:
-        t_y.copy_(t_x)
+    cache = done and level==0 and self.use_deriv and self.shouldCachePrimal(start)
+    if cache and not self.primal_cache.usesCheckpoints():
+      # store the graph for the adjoint 
+      self.cachePrimal(t_y,tstart,tstop,level,start,stop)
+    else:
+      if cache:
+        # store the state, the adjoint recomputes the graphs from it
+        self.primal_cache.storeCheckpoint(self.getGlobalStepIndex(start),t_y.detach().clone())
 
-      q = dt*layer(t_x)
-      t_y.add_(q)
-      del q
-    # end in_place_eval
+      # no gradients are necessary here, so don't compute them
+      with torch.no_grad():
+        self.inPlaceEval(t_y,tstart,tstop,level,start,stop,use_kernel=True)
 
-    # there are two paths by which eval is called:
-    #  1. x is a BraidVector: my step has called this method
-    #  2. x is a torch tensor: called internally (probably for the adjoint) 
+    if y.getSendFlag():
+      self.clearTempLayerWeights()
 
-    if isinstance(y,BraidVector):
-      self.setLayerWeights(tstart,tstop,level,y.weightTensors())
+      y.releaseWeightTensors()
+      y.setSendFlag(False)
+    # wipe out any sent information
 
-      t_y = y.tensor().detach()
+    self.setVectorWeights(stop,y)
+  # end eval
 
-      # no gradients are necessary here, so don't compute them
-      with torch.no_grad():
-        in_place_eval(t_y,tstart,tstop,level)
+  def inPlaceEval(self,t_y,tstart,tstop,level,start,stop,t_x=None,use_kernel=False):
+    """
+    Compute t_y = t_x + dt*layer(t_x), if t_x is not specified t_y is
+    updated in place. The step kernel is only used if use_kernel is true.
+    """
+    # get some information about what to do
+    dt = tstop-tstart
+    layer = self.getStepLayer(start,stop,level) # resnet "basic block"
 
-      if y.getSendFlag():
-        self.clearTempLayerWeights()
+    if t_x is None:
+      t_x = t_y
+    else:
+      t_y.copy_(t_x)
 
-        y.releaseWeightTensors()
-        y.setSendFlag(False)
-      # wipe out any sent information
+    kernel = self.getStepKernel(start,dt,layer,t_x) if use_kernel else None
+    if kernel is not None:
+      t_y.copy_(kernel(t_x,torch.tensor(dt,dtype=t_x.dtype)))
+      return
 
-      self.setVectorWeights(tstop,0.0,level,y)
+    q = dt*layer(t_x)
+    t_y.add_(q)
+    del q
+  # end inPlaceEval
 
-    else: 
-      x.requires_grad = True 
+  def setStepKernels(self,mode):
+    """
+    Compile the step x+dt*layer(x) of each local layer with TorchScript, this 
+    removes the python overhead of the layer in the forward steps that don't
+    require gradients. The mode is 'trace', 'script' or None (eager, the 
+    default). Layers that fail to compile, the neighbor layer and the coarse 
+    propagator layers are evaluated eagerly.
+    """
+    if mode not in [None,'trace','script']:
+      raise ValueError('setStepKernels: mode must be None, "trace" or "script" ("{}" was used)'.format(mode))
+
+    self.step_kernel_mode = mode
+    self.step_kernels = dict()
+
+  def getStepKernel(self,start,dt,layer,t_x):
+    """
+    Get the compiled step for a layer (compiling it on first use), None
+    is returned if the step should be evaluated eagerly.
+    """
+    if self.step_kernel_mode is None:
+      return None
+
+    index = self.getLocalStepIndex(start)
+    if index<0 or index>=len(self.layer_models)-1 or layer is not self.layer_models[index]:
+      return None
+
+    # the compiled step fixes the train/eval behavior (dropout, batch norm), so 
+    # each mode has its own kernel
+    key = (index,layer.training)
+    kernel = self.step_kernels.get(key)
+    if kernel is None:
+      with self.timer("compile step"):
+        kernel = ODEStepKernel(layer)
+        try:
+          if self.step_kernel_mode=='trace':
+            kernel = torch.jit.trace(kernel,(t_x,torch.tensor(dt,dtype=t_x.dtype)))
+          else:
+            kernel = torch.jit.script(kernel)
+        except Exception:
+          # fall back to the eager layer
+          kernel = False
+      self.step_kernels[key] = kernel
+
+    return kernel if kernel is not False else None
+
+  def shouldCachePrimal(self,start):
+    # only local layers are cached, the temporary layer changes weights
+    index = self.getLocalStepIndex(start)
+    if index<0:
+      return False
+
+    # segments are recomputed from the first local step at the latest
+    if index==0 and self.primal_cache.usesCheckpoints():
+      return True
+    return self.primal_cache.shouldStore(self.getGlobalStepIndex(start))
+
+  def cachePrimal(self,t_y,tstart,tstop,level,start,stop):
+    """
+    Evaluate the time step with gradients, storing the graph in the
+    primal cache. The result is copied into t_y.
+    """
+    # the input is copied, the vector is modified in place by braid
+    x = t_y.detach().clone()
+    y = t_y.detach().clone()
+
+    x.requires_grad = True
+    with utils.SavedTensorCounter() as counter:
       with torch.enable_grad():
-        in_place_eval(y,tstart,tstop,level,t_x=x)
-  # end eval
+        self.inPlaceEval(y,tstart,tstop,level,start,stop,t_x=x)
 
-  def getPrimalWithGrad(self,tstart,tstop,level):
+    nbytes = counter.nbytes + 2*t_y.numel()*t_y.element_size()
+    self.primal_cache.store((level,self.getGlobalStepIndex(start)),y,x,nbytes)
+
+    t_y.copy_(y.detach())
+  # end cachePrimal
+
+  def recomputeSegment(self,index,with_grad=True):
+    """
+    Recompute the fine steps from the last checkpoint up to the local step 
+    index. With gradients the graphs of the steps are stored as the segment of
+    the primal cache and the graph of the step is returned, otherwise the 
+    state at the start of the step is returned.
+    """
+    first,x = self.primal_cache.getCheckpoint(self.local_offset+index)
+    last = index if with_grad else index-1
+
+    segment = dict()
+    for i in range(first-self.local_offset,last+1):
+      start = self.getLocalStepPoint(i)
+      tstart,tstop = (self.local_offset+i)*self.dt,(self.local_offset+i+1)*self.dt
+
+      x = x.detach()
+      y = x.clone()
+      if with_grad:
+        x.requires_grad = True
+        with torch.enable_grad():
+          self.inPlaceEval(y,tstart,tstop,0,start,start+1,t_x=x)
+        segment[(0,self.local_offset+i)] = (y,x)
+      else:
+        with torch.no_grad():
+          self.inPlaceEval(y,tstart,tstop,0,start,start+1,t_x=x)
+      x = y
+
+    if not with_grad:
+      return x
+
+    self.primal_cache.storeSegment(segment)
+    return segment[(0,self.local_offset+index)]
+  # end recomputeSegment
+
+  def getPrimalWithGrad(self,tstart,tstop,level,start,stop):
     """ 
     Get the forward solution associated with this
-    time step and also get its derivative. This is
+    time step (between the fine grid points start and
+    stop) and also get its derivative. This is
     used by the BackwardApp in computation of the
     adjoint (backprop) state and parameter derivatives.
     Its intent is to abstract the forward solution
@@ -232,19 +544,40 @@ class ForwardODENetApp(BraidApp):
     being recomputed.
     """
     
-    layer = self.getLayer(tstart,tstop,level)
+    layer = self.getLayer(start)
+    index = self.getLocalStepIndex(start)
+    checkpoints = self.primal_cache.usesCheckpoints() and index>=0
+
+    if level==0 and self.primal_cache.enabled():
+      entry = self.primal_cache.get((level,self.getGlobalStepIndex(start)))
+      if entry is None and checkpoints:
+        entry = self.recomputeSegment(index)
+      if entry is not None:
+        y,x = entry
+        return (y, x), layer
+
+    b_x = self.getUVector(0,self.getLastPoint(start))
+    if b_x is None and checkpoints:
+      # braid only keeps the C-point states when checkpoints are used
+      t_x = self.recomputeSegment(index,with_grad=False)
+    else:
+      t_x = b_x.tensor()
+      self.setLayerWeights(start,b_x.weightTensors())
 
-    b_x = self.getUVector(0,tstart)
-    t_x = b_x.tensor()
+    # the fine state is restricted to the (spatially coarse) level of the adjoint
+    if self.spatial_mg:
+      for l in range(level):
+        t_x = self.spatial_coarse(t_x,l)
 
-    self.setLayerWeights(tstart,tstop,level,b_x.weightTensors())
+    # the coarse layer may be built from the weights just set
+    layer = self.getStepLayer(start,stop,level)
 
     x = t_x.detach()
     y = t_x.detach().clone()
 
-    x.requires_grad = t_x.requires_grad
-
-    self.eval(y,tstart,tstop,0,done=0,x=x)
+    x.requires_grad = True
+    with torch.enable_grad():
+      self.inPlaceEval(y,tstart,tstop,level,start,stop,t_x=x)
     return (y, x), layer
   # end getPrimalWithGrad
 
@@ -277,17 +610,52 @@ class BackwardODENetApp(BraidApp):
     self.finalRelax()
 
     self.timer_manager = timer_manager
+
+    # built on first use by getGradientExchange
+    self.grad_exchange = None
   # end __init__
 
   def __del__(self):
     self.fwd_app = None
 
+  def destroy(self):
+    if self.grad_exchange is not None:
+      self.grad_exchange.free()
+    BraidApp.destroy(self)
+
   def getTensorShapes(self):
     return self.shape0
 
   def timer(self,name):
     return self.timer_manager.timer("BckWD::"+name)
 
+  def getGradientExchange(self):
+    """
+    Get the exchange used to send the gradients of the neighbor layer to the
+    right (see BraidFunction.backward). The message is a flag for each parameter
+    (is the gradient None) followed by the gradients.
+    """
+    if self.grad_exchange is None:
+      comm          = self.getMPIComm()
+      my_rank       = self.getMPIComm().Get_rank()
+      num_ranks     = self.getMPIComm().Get_size()
+
+      dest   = my_rank+1 if my_rank<num_ranks-1 else None
+      source = my_rank-1 if my_rank>0 else None
+
+      send_layer = self.fwd_app.layer_models[-1]
+      send_params = list(send_layer.parameters()) if send_layer is not None else []
+      recv_params = list(self.fwd_app.layer_models[0].parameters())
+
+      send_shapes = [torch.Size([len(send_params)])]+[p.size() for p in send_params]
+      recv_shapes = [torch.Size([len(recv_params)])]+[p.size() for p in recv_params]
+      dtype = utils.exchange_dtype(send_params+recv_params)
+
+      self.grad_exchange = utils.NeighborExchange(comm,send_shapes,dest,recv_shapes,source,tag=25,dtype=dtype)
+
+    return self.grad_exchange
+  # end getGradientExchange
+
   def run(self,x):
 
     try:
@@ -321,6 +689,9 @@ class BackwardODENetApp(BraidApp):
       for l in self.fwd_app.layer_models:
          if l==None: continue
          l.zero_grad()
+
+      # release the stored forward graphs
+      self.fwd_app.getPrimalCache().clear()
     except:
       print('\n**** Torchbraid Internal Exception ****\n')
       traceback.print_exc()
@@ -328,7 +699,7 @@ class BackwardODENetApp(BraidApp):
     return f
   # end forward
 
-  def eval(self,w,tstart,tstop,level,done):
+  def eval(self,w,tstart,tstop,level,done,tindex):
     """
     Evaluate the adjoint problem for a single time step. Here 'w' is the
     adjoint solution. The variables 'x' and 'y' refer to the forward
@@ -337,7 +708,9 @@ class BackwardODENetApp(BraidApp):
     try:
         # we need to adjust the time step values to reverse with the adjoint
         # this is so that the renumbering used by the backward problem is properly adjusted
-        (t_y,t_x),layer = self.fwd_app.getPrimalWithGrad(self.Tf-tstop,self.Tf-tstart,level)
+        start = self.getMirroredPoint(self.getFinePoint(tindex+1,level))
+        stop  = self.getMirroredPoint(self.getFinePoint(tindex,level))
+        (t_y,t_x),layer = self.fwd_app.getPrimalWithGrad(self.Tf-tstop,self.Tf-tstart,level,start,stop)
 
         # t_x should have no gradient (for memory reasons)
         assert(t_x.grad is None)
@@ -359,12 +732,19 @@ class BackwardODENetApp(BraidApp):
         # perform adjoint computation
         t_w = w.tensor()
         t_w.requires_grad = False
-        t_y.backward(t_w)
-
-        # this little bit of pytorch magic ensures the gradient isn't
-        # stored too long in this calculation (in particulcar setting
-        # the grad to None after saving it and returning it to braid)
-        t_w.copy_(t_x.grad.detach()) 
+        if done==1:
+          t_y.backward(t_w,retain_graph=True)
+
+          # this little bit of pytorch magic ensures the gradient isn't
+          # stored too long in this calculation (in particulcar setting
+          # the grad to None after saving it and returning it to braid)
+          t_w.copy_(t_x.grad.detach()) 
+          t_x.grad = None
+        else:
+          # only the adjoint state is needed, the parameter gradients are not
+          # computed (the graph may be stored in the primal cache, so keep it)
+          g_x, = torch.autograd.grad(t_y,t_x,t_w,retain_graph=True)
+          t_w.copy_(g_x)
 
         for p,s in zip(layer.parameters(),required_grad_state):
           p.requires_grad = s
@@ -0,0 +1,138 @@
+#@HEADER
+# ************************************************************************
+# 
+#                        Torchbraid v. 0.1
+# 
+# Copyright 2020 National Technology & Engineering Solutions of Sandia, LLC 
+# (NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S. 
+# Government retains certain rights in this software.
+# 
+# Torchbraid is licensed under 3-clause BSD terms of use:
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+# 
+# 3. Neither the name National Technology & Engineering Solutions of Sandia, 
+# LLC nor the names of the contributors may be used to endorse or promote 
+# products derived from this software without specific prior written permission.
+# 
+# Questions? Contact Eric C. Cyr (eccyr@sandia.gov)
+# 
+# ************************************************************************
+#@HEADER
+
+class ParallelSettings:
+  """
+  The solver settings shared by the parallel modules (LayerParallel, 
+  NetworkParallel and RNN_Parallel). A module using this holds a timer_manager
+  and the pairs of forward and backward apps returned by getAppPairs, the 
+  settings are passed along to every app.
+  """
+
+  def getAppPairs(self):
+    return [(self.fwd_app,self.bwd_app)]
+
+  def getApps(self):
+    return [app for pair in self.getAppPairs() for app in pair]
+
+  def getTimerManager(self):
+    """
+    Get a TimerContextManager that describes how much time is taken by what.
+    """
+    return self.timer_manager
+
+  def enableTracing(self,capacity=65536):
+    """
+    Record a timeline of the timed events on each processor, keeping the last 
+    capacity events.
+    """
+    self.timer_manager.enableTracing(capacity)
+
+  def writeTrace(self,filename):
+    """
+    Write the timelines of all processors to a Chrome trace file (collective).
+    Tracing must be enabled first (see enableTracing).
+    """
+    tracer = self.timer_manager.getTracer()
+    if tracer is None:
+      raise RuntimeError('writeTrace: tracing is not enabled, call enableTracing before running')
+    tracer.writeChromeTrace(self.getMPIComm(),filename)
+
+  def setPrintLevel(self,print_level,tb_print=False):
+    for app in self.getApps():
+      app.setPrintLevel(print_level,tb_print)
+
+  def setNumRelax(self,relax,level=-1):
+    for app in self.getApps():
+      app.setNumRelax(relax,level=level)
+
+  def setFwdMaxIters(self,max_iters):
+    for fwd_app,bwd_app in self.getAppPairs():
+      fwd_app.setMaxIters(max_iters)
+
+  def setBwdMaxIters(self,max_iters):
+    for fwd_app,bwd_app in self.getAppPairs():
+      bwd_app.setMaxIters(max_iters)
+
+  def setFwdAbsTol(self,abs_tol):
+    for fwd_app,bwd_app in self.getAppPairs():
+      fwd_app.setAbsTol(abs_tol)
+
+  def setBwdAbsTol(self,abs_tol):
+    for fwd_app,bwd_app in self.getAppPairs():
+      bwd_app.setAbsTol(abs_tol)
+
+  def setFMG(self):
+    for app in self.getApps():
+      app.setFMG()
+
+  def setCFactor(self,cfactor,level=-1):
+    for app in self.getApps():
+      app.setCFactor(cfactor,level)
+
+  def setSkipDowncycle(self,skip):
+    for app in self.getApps():
+      app.setSkipDowncycle(skip)
+
+  def setRelTol(self,rel_tol):
+    for app in self.getApps():
+      app.setRelTol(rel_tol)
+
+  def setStagnationTol(self,stagnation_tol,min_iters=1):
+    """
+    Cap the iterations where the residual stops decreasing by at least a factor
+    of stagnation_tol (None disables).
+    """
+    for app in self.getApps():
+      app.setStagnationTol(stagnation_tol,min_iters)
+
+  def setWarmStart(self,enable):
+    """
+    Seed the states of each solve with the states braid kept from the previous
+    one (the default), or start from zero states.
+    """
+    for app in self.getApps():
+      app.setWarmStart(enable)
+
+  def setInexactSolveController(self,controller):
+    """
+    Attach an InexactSolveController, call its step method after each training step.
+    """
+    self.inexact_solve_controller = controller
+    controller.attach(self)
+
+  def setBufferDType(self,dtype):
+    """
+    Set the dtype of the vectors communicated between processors (None for full precision).
+    """
+    for app in self.getApps():
+      app.setBufferDType(dtype)
+# end ParallelSettings
@@ -32,14 +32,13 @@
 import torch
 
 from braid_vector import BraidVector
-from torchbraid_app import BraidApp
+from torchbraid_app import BraidApp, weightBufferSize
 import utils 
 
 import sys
 import traceback
 import resource
 import copy
-import pickle
 
 from mpi4py import MPI
 
@@ -59,6 +58,29 @@ def getLocalMemory(comm,message):
   result = '%.2f MiB' % (usage/2**20)
   print(('{}) ' + message).format(comm.Get_rank(),result))
 
+def layerTensors(layer):
+  """
+  The parameters and buffers of a layer, these are the tensors
+  communicated for the layer.
+  """
+  return list(layer.parameters())+list(layer.buffers())
+
+def layerWeights(layer):
+  return [t.data for t in layerTensors(layer)]
+
+def layerTemplates(layers):
+  """
+  Copy the architecture of the layers, with empty weights. The 
+  weights are filled in before the layer is used.
+  """
+  templates = []
+  for l in layers:
+    t = copy.deepcopy(l)
+    for w in layerTensors(t):
+      w.data = torch.empty((),dtype=w.dtype)
+    templates += [t]
+  return templates
+
 class ForwardResNetApp(BraidApp):
 
   def __init__(self,comm,layers,max_levels,max_iters,timer_manager):
@@ -74,6 +96,10 @@ class ForwardResNetApp(BraidApp):
     num_ranks     = self.getMPIComm().Get_size()
     self.my_rank = my_rank
 
+    # The architecture of the layers is exchanged once here, after this only the
+    # parameters and buffers are communicated (see updateParallelWeights and
+    # the weight tensors in the braid vectors)
+
     # send everything to the left (this helps with the adjoint method)
     if my_rank>0:
       comm.send(self.layer_models[0],dest=my_rank-1,tag=22)
@@ -84,15 +110,29 @@ class ForwardResNetApp(BraidApp):
       # this is a sentinel at the end of the processors and layers
       self.layer_models.append(None)
 
+    # send the layer architectures to the right, these are used for steps that
+    # start on the left neighbor (their weights come in the braid vector)
+    if my_rank<num_ranks-1:
+      comm.send(layerTemplates(layers[0:self.local_num_steps]),dest=my_rank+1,tag=23)
+    if my_rank>0:
+      self.left_layers = comm.recv(source=my_rank-1,tag=23)
+    else:
+      self.left_layers = []
+
+    # persistent requests for the neighbor exchange in updateParallelWeights
+    self.buildParallelWeightExchange()
+
     # build up the core
     self.py_core = self.initCore()
 
     self.timer_manager = timer_manager
     self.use_deriv = False
-    self.layer_data_size = 0
 
-    for l in self.layer_models:
-      self.layer_data_size = max(self.layer_data_size,len(pickle.dumps(l)))
+    # the weights are added to the buffer, so make sure the largest layer fits
+    local_size = max([0]+[weightBufferSize(layerWeights(l)) for l in layers[0:self.local_num_steps]])
+    self.layer_data_size = comm.allreduce(local_size,op=MPI.MAX)
+
+    self.primal_cache = utils.PrimalCache()
   # end __init__
 
   def __del__(self):
@@ -102,31 +142,91 @@ class ForwardResNetApp(BraidApp):
     return list(self.shape0)
 
   def getLayerDataSize(self):
+    # this is the space needed for the weight tensors
     return self.layer_data_size
 
-  def setVectorLayer(self,t,tf,level,x):
-    layer = self.getLayer(t,tf,level)
-    x.setLayerData(layer)
+  def setVectorWeights(self,point,x):
+    layer = self.getLayer(point)
+    if layer!=None:
+      weights = layerWeights(layer)
+    else:
+      weights = []
+    x.addWeightTensors(weights)
+
+  def setLayerWeights(self,point,weights):
+    index = self.getLocalStepIndex(point)
+
+    # only layers owned by the left neighbor use the communicated weights,
+    # the rest are already available locally
+    if index<0 and -index<=len(self.left_layers):
+      layer = self.left_layers[index]
+      with torch.no_grad():
+        for dest_w,src_w in zip(layerTensors(layer),weights):
+          dest_w.data = src_w
+  # end setLayerWeights
 
   def initializeVector(self,t,x):
-    self.setVectorLayer(t,0.0,0,x)
+    self.setVectorWeights(self.getTimePoint(t),x)
 
-  def updateParallelWeights(self):
-    # send everything to the left (this helps with the adjoint method)
+  def exchangeWeights(self,layer):
+    """
+    The tensors sent to the left neighbor for a layer.
+    """
+    if layer is None:
+      return []
+    return layerWeights(layer)
+
+  def buildParallelWeightExchange(self):
     comm          = self.getMPIComm()
     my_rank       = self.getMPIComm().Get_rank()
     num_ranks     = self.getMPIComm().Get_size()
 
-    if my_rank>0:
-      comm.send(self.layer_models[0],dest=my_rank-1,tag=22)
-    if my_rank<num_ranks-1:
-      neighbor_model = comm.recv(source=my_rank+1,tag=22)
-      self.layer_models[-1] = neighbor_model
+    # send to the left, receive from the right (the neighbor model is at the end)
+    dest   = my_rank-1 if my_rank>0 else None
+    source = my_rank+1 if my_rank<num_ranks-1 else None
+
+    send_weights = self.exchangeWeights(self.layer_models[0])
+    recv_weights = self.exchangeWeights(self.layer_models[-1])
+
+    send_shapes = [w.size() for w in send_weights]
+    recv_shapes = [w.size() for w in recv_weights]
+    dtype = utils.exchange_dtype(send_weights+recv_weights)
+
+    self.weight_exchange = utils.NeighborExchange(comm,send_shapes,dest,recv_shapes,source,tag=24,dtype=dtype)
+
+  def updateParallelWeights(self):
+    # send everything to the left (this helps with the adjoint method), 
+    # this is completed when the neighbor layer is needed
+    self.weight_exchange.start(self.exchangeWeights(self.layer_models[0]))
+
+  def completeParallelWeights(self):
+    if self.weight_exchange.isActive():
+      self.weight_exchange.wait(self.exchangeWeights(self.layer_models[-1]))
+
+  def setPrimalCachePolicy(self,policy,budget=None):
+    """
+    Set which forward graphs are stored for the adjoint: 'none', 'all' or
+    checkpoints at every k-th step (an integer, see PrimalCache). The budget 
+    limits the memory (in bytes) used by the cache. Storing graphs requires a
+    final FC relaxation of the forward problem.
+    """
+    self.primal_cache.setPolicy(policy,budget)
+    if self.primal_cache.enabled():
+      self.finalRelax()
+
+    # the checkpoints replace the states braid keeps at the F-points
+    self.setRequireStorage(not self.primal_cache.usesCheckpoints())
+
+  def getPrimalCache(self):
+    return self.primal_cache
 
   def run(self,x):
     # turn on derivative path (as requried)
     self.use_deriv = self.training
 
+    # graphs from the last run are no longer valid
+    self.primal_cache.clear()
+
     # run the braid solver
     with self.timer("runBraid"):
 
@@ -136,6 +236,8 @@ class ForwardResNetApp(BraidApp):
 
       y = self.runBraid(x)
 
+      self.completeParallelWeights()
+
       # reset derivative papth
       self.use_deriv = False
 
@@ -147,26 +249,22 @@ class ForwardResNetApp(BraidApp):
   def timer(self,name):
     return self.timer_manager.timer("ForWD::"+name)
 
-  def getLayer(self,t,tf,level):
-    index = self.getLocalTimeStepIndex(t,tf,level)
-    if index < 0:
-      pre_str = "\n{}: WARNING: getLayer index negative at {}: {}\n".format(self.my_rank,t,index)
+  def getLayer(self,point):
+    index = self.getLocalStepIndex(point)
+    if index==len(self.layer_models)-1:
+      # the neighbor layer weights may still be in flight
+      self.completeParallelWeights()
+
+    if index < 0 and -index<=len(self.left_layers):
+      return self.left_layers[index]
+    elif index < 0:
+      pre_str = "\n{}: WARNING: getLayer index negative at {}: {}\n".format(self.my_rank,point,index)
       stack_str = utils.stack_string('{}: |- '.format(self.my_rank))
       print(pre_str+stack_str)
       return None
 
     return self.layer_models[index]
 
-  def setLayer(self,t,tf,level,layer):
-    index = self.getLocalTimeStepIndex(t,tf,level)
-    if index < 0:
-      pre_str = "\n{}: WARNING: getLayer index negative at {}: {}\n".format(self.my_rank,t,index)
-      stack_str = utils.stack_string('{}: |- '.format(self.my_rank))
-      print(pre_str+stack_str)
-      return
-
-    self.layer_models[index] = layer
-
   def parameters(self):
     params = []
     for l in self.layer_models:
@@ -175,52 +273,113 @@ class ForwardResNetApp(BraidApp):
 
     return params
 
-  def eval(self,y,tstart,tstop,level,done):
+  def eval(self,y,tstart,tstop,level,done,tindex):
     """
     Method called by "my_step" in braid. This is
     required to propagate from tstart to tstop.
-    The level is defined by braid
+    The level and the time index of tstart are 
+    defined by braid
     """
+    start = self.getFinePoint(tindex,level)
+    stop  = self.getFinePoint(tindex+1,level)
 
-    # this function is used twice below to define an in place evaluation
-    def in_place_eval(t_y,tstart,tstop,level,t_x=None):
-      # get some information about what to do
-      dt = tstop-tstart
-      layer = self.getLayer(tstart,tstop,level) # resnet "basic block"
-
-      if t_x==None:
-        t_x = t_y
-      else:
-        t_y.copy_(t_x)
-
-      q = layer(t_x)
-      t_y.copy_(q)
-      del q
-    # end in_place_eval
-
-    self.setLayer(tstart,tstop,level,y.getLayerData())
-    layer = self.getLayer(tstart,tstop,level) # resnet "basic block"
+    self.setLayerWeights(start,y.weightTensors())
+    layer = self.getLayer(start) # resnet "basic block"
 
     t_y = y.tensor().detach()
 
-    # no gradients are necessary here, so don't compute them
-    with torch.no_grad():
-      q = layer(t_y)
-      t_y.copy_(q)
+    cache = done and level==0 and self.use_deriv and self.shouldCachePrimal(start)
+    if cache and not self.primal_cache.usesCheckpoints():
+      # store the graph for the adjoint 
+      self.cachePrimal(t_y,level,start)
+    else:
+      if cache:
+        # store the state, the adjoint recomputes the graphs from it
+        self.primal_cache.storeCheckpoint(self.getGlobalStepIndex(start),t_y.detach().clone())
+
+      # no gradients are necessary here, so don't compute them
+      with torch.no_grad():
+        q = layer(t_y)
+        t_y.copy_(q)
 
     if y.getSendFlag():
-      y.setLayerData(None)
+      y.releaseWeightTensors()
       y.setSendFlag(False)
     # wipe out any sent information
 
-    # move the layer
-    self.setVectorLayer(tstop,0.0,level,y)
+    # move the weights
+    self.setVectorWeights(stop,y)
   # end eval
 
-  def getPrimalWithGrad(self,tstart,tstop,level):
+  def shouldCachePrimal(self,start):
+    # only local layers are cached, the left layers change weights
+    index = self.getLocalStepIndex(start)
+    if index<0:
+      return False
+
+    # segments are recomputed from the first local step at the latest
+    if index==0 and self.primal_cache.usesCheckpoints():
+      return True
+    return self.primal_cache.shouldStore(self.getGlobalStepIndex(start))
+
+  def cachePrimal(self,t_y,level,start):
+    """
+    Evaluate the time step with gradients, storing the graph in the
+    primal cache. The result is copied into t_y.
+    """
+    layer = self.getLayer(start)
+
+    # the input is copied, the vector is modified in place by braid
+    x = t_y.detach().clone()
+    x.requires_grad = True
+
+    with utils.SavedTensorCounter() as counter:
+      with torch.enable_grad():
+        y = layer(x)
+
+    nbytes = counter.nbytes + 2*t_y.numel()*t_y.element_size()
+    self.primal_cache.store((level,self.getGlobalStepIndex(start)),y,x,nbytes)
+
+    t_y.copy_(y.detach())
+  # end cachePrimal
+
+  def recomputeSegment(self,index,with_grad=True):
+    """
+    Recompute the steps from the last checkpoint up to the local step index.
+    With gradients the graphs of the steps are stored as the segment of the
+    primal cache and the graph of the step is returned, otherwise the state
+    at the start of the step is returned.
+    """
+    first,x = self.primal_cache.getCheckpoint(self.local_offset+index)
+    last = index if with_grad else index-1
+
+    segment = dict()
+    for i in range(first-self.local_offset,last+1):
+      layer = self.getLayer(self.getLocalStepPoint(i))
+
+      x = x.detach()
+      if with_grad:
+        x.requires_grad = True
+        with torch.enable_grad():
+          y = layer(x)
+        segment[(0,self.local_offset+i)] = (y,x)
+      else:
+        with torch.no_grad():
+          y = layer(x)
+      x = y
+
+    if not with_grad:
+      return x
+
+    self.primal_cache.storeSegment(segment)
+    return segment[(0,self.local_offset+index)]
+  # end recomputeSegment
+
+  def getPrimalWithGrad(self,tstart,tstop,level,start,stop):
     """ 
     Get the forward solution associated with this
-    time step and also get its derivative. This is
+    time step (between the fine grid points start and
+    stop) and also get its derivative. This is
     used by the BackwardApp in computation of the
     adjoint (backprop) state and parameter derivatives.
     Its intent is to abstract the forward solution
@@ -228,10 +387,25 @@ class ForwardResNetApp(BraidApp):
     being recomputed.
     """
     
-    layer = self.getLayer(tstart,tstop,level)
-
-    b_x = self.getUVector(0,tstart)
-    t_x = b_x.tensor()
+    layer = self.getLayer(start)
+    index = self.getLocalStepIndex(start)
+    checkpoints = self.primal_cache.usesCheckpoints() and index>=0
+
+    if level==0 and self.primal_cache.enabled():
+      entry = self.primal_cache.get((level,self.getGlobalStepIndex(start)))
+      if entry is None and checkpoints:
+        entry = self.recomputeSegment(index)
+      if entry is not None:
+        y,x = entry
+        return (y, x), layer
+
+    b_x = self.getUVector(0,self.getLastPoint(start))
+    if b_x is None and checkpoints:
+      # braid only keeps the C-point states when checkpoints are used
+      t_x = self.recomputeSegment(index,with_grad=False)
+    else:
+      t_x = b_x.tensor()
+      self.setLayerWeights(start,b_x.weightTensors())
 
     x = t_x.detach()
     y = t_x.detach().clone()
@@ -269,6 +443,9 @@ class BackwardResNetApp(BraidApp):
     self.setRevertedRanks(1)
 
     self.timer_manager = timer_manager
+
+    # built on first use by getGradientExchange
+    self.grad_exchange = None
   # end __init__
 
   def __del__(self):
@@ -280,6 +457,33 @@ class BackwardResNetApp(BraidApp):
   def timer(self,name):
     return self.timer_manager.timer("BckWD::"+name)
 
+  def getGradientExchange(self):
+    """
+    Get the exchange used to send the gradients of the neighbor layer to the
+    right (see BraidFunction.backward). The message is a flag for each parameter
+    (is the gradient None) followed by the gradients.
+    """
+    if self.grad_exchange is None:
+      comm          = self.getMPIComm()
+      my_rank       = self.getMPIComm().Get_rank()
+      num_ranks     = self.getMPIComm().Get_size()
+
+      dest   = my_rank+1 if my_rank<num_ranks-1 else None
+      source = my_rank-1 if my_rank>0 else None
+
+      send_layer = self.fwd_app.layer_models[-1]
+      send_params = list(send_layer.parameters()) if send_layer is not None else []
+      recv_params = list(self.fwd_app.layer_models[0].parameters())
+
+      send_shapes = [torch.Size([len(send_params)])]+[p.size() for p in send_params]
+      recv_shapes = [torch.Size([len(recv_params)])]+[p.size() for p in recv_params]
+      dtype = utils.exchange_dtype(send_params+recv_params)
+
+      self.grad_exchange = utils.NeighborExchange(comm,send_shapes,dest,recv_shapes,source,tag=25,dtype=dtype)
+
+    return self.grad_exchange
+  # end getGradientExchange
+
   def run(self,x):
 
     try:
@@ -313,6 +517,9 @@ class BackwardResNetApp(BraidApp):
       for l in self.fwd_app.layer_models:
          if l==None: continue
          l.zero_grad()
+
+      # release the stored forward graphs
+      self.fwd_app.getPrimalCache().clear()
     except:
       print('\n**** Torchbraid Internal Exception ****\n')
       traceback.print_exc()
@@ -320,7 +527,7 @@ class BackwardResNetApp(BraidApp):
     return f
   # end forward
 
-  def eval(self,w,tstart,tstop,level,done):
+  def eval(self,w,tstart,tstop,level,done,tindex):
     """
     Evaluate the adjoint problem for a single time step. Here 'w' is the
     adjoint solution. The variables 'x' and 'y' refer to the forward
@@ -329,7 +536,9 @@ class BackwardResNetApp(BraidApp):
     try:
         # we need to adjust the time step values to reverse with the adjoint
         # this is so that the renumbering used by the backward problem is properly adjusted
-        (t_y,t_x),layer = self.fwd_app.getPrimalWithGrad(self.Tf-tstop,self.Tf-tstart,level)
+        start = self.getMirroredPoint(self.getFinePoint(tindex+1,level))
+        stop  = self.getMirroredPoint(self.getFinePoint(tindex,level))
+        (t_y,t_x),layer = self.fwd_app.getPrimalWithGrad(self.Tf-tstop,self.Tf-tstart,level,start,stop)
 
         # we are going to change the required gradient, make sure they return
         # to where they started!
@@ -353,12 +562,15 @@ class BackwardResNetApp(BraidApp):
         # perform adjoint computation
         t_w = w.tensor()
         t_w.requires_grad = False
-        t_y.backward(t_w)
+
+        # the graph is retained as it may be stored in the primal cache
+        t_y.backward(t_w,retain_graph=True)
 
         # this little bit of pytorch magic ensures the gradient isn't
         # stored too long in this calculation (in particulcar setting
         # the grad to None after saving it and returning it to braid)
         t_w.copy_(t_x.grad.detach()) 
+        t_x.grad = None
 
 #        for p,s in zip(layer.parameters(),required_grad_state):
 #          p.requires_grad = s
@@ -71,6 +71,7 @@ class ForwardBraidApp(parent.BraidApp):
     self.user_dt_ratio = self._dt_ratio_
 
     self.seq_shapes = None
+    self.seq_dtypes = None
     self.backpropped = dict()
   # end __init__
 
@@ -87,10 +88,13 @@ class ForwardBraidApp(parent.BraidApp):
   def getTensorShapes(self):
     return list(self.shape0)+self.seq_shapes
 
-  def getSequenceVector(self,t,tf,level):
-    index = self.getLocalTimeStepIndex(t,tf,level)
+  def getTensorDTypes(self):
+    return len(self.shape0)*[self.dtype0]+self.seq_dtypes
+
+  def getSequenceVector(self,point):
+    index = self.getLocalStepIndex(point)
     if index<0: 
-      pre_str = "\n{}: WARNING: getSequenceVector index negative at {}: {}\n".format(self.my_rank,t,index)
+      pre_str = "\n{}: WARNING: getSequenceVector index negative at {}: {}\n".format(self.my_rank,point,index)
       stack_str = utils.stack_string('{}: |- '.format(self.my_rank))
       print(pre_str+stack_str)
  
@@ -118,7 +122,7 @@ class ForwardBraidApp(parent.BraidApp):
   # end setLayerWeights
 
   def initializeVector(self,t,x):
-    seq_x = self.getSequenceVector(t,None,level=0)
+    seq_x = self.getSequenceVector(self.getTimePoint(t))
     x.addWeightTensors((seq_x,))
 
   def run(self,x,h_c):
@@ -130,6 +134,7 @@ class ForwardBraidApp(parent.BraidApp):
 
     self.x = x
     self.seq_shapes = [x[:,0,:].shape]
+    self.seq_dtypes = [x.dtype]
 
     with self.timer("run:precomm"):
       recv_request = None
@@ -163,12 +168,15 @@ class ForwardBraidApp(parent.BraidApp):
   def timer(self,name):
     return self.timer_manager.timer("ForWD::"+name)
 
-  def eval(self,g0,tstart,tstop,level,done):
+  def eval(self,g0,tstart,tstop,level,done,tindex):
     """
     Method called by "my_step" in braid. This is
     required to propagate from tstart to tstop, with the initial
-    condition x. The level is defined by braid
+    condition x. The level and the time index of tstart are 
+    defined by braid
     """
+    start = self.getFinePoint(tindex,level)
+    stop  = self.getFinePoint(tindex+1,level)
 
     with self.timer("eval"):
       # there are two paths by which eval is called:
@@ -201,19 +209,26 @@ class ForwardBraidApp(parent.BraidApp):
   
             t_yh = (1.0-dt_ratio)*h + dt_ratio*t_yh
             t_yc = (1.0-dt_ratio)*c + dt_ratio*t_yc
-        self.backpropped[tstart,tstop] = ((h,c),(t_yh,t_yc))
+        self.backpropped[start,stop] = ((h,c),(t_yh,t_yc))
   
-      seq_x = self.getSequenceVector(tstop,None,level)
+      seq_x = self.getSequenceVector(stop)
   
       g0.addWeightTensors((seq_x,))
-      g0.replaceTensor(t_yh,0)
-      g0.replaceTensor(t_yc,1)
+      if not done:
+        # copy in place, keeping the storage of the vector
+        t_h.copy_(t_yh)
+        t_c.copy_(t_yc)
+      else:
+        # the input tensors are saved for backprop, so replace them
+        g0.replaceTensor(t_yh,0)
+        g0.replaceTensor(t_yc,1)
   # end eval
 
-  def getPrimalWithGrad(self,tstart,tstop,level):
+  def getPrimalWithGrad(self,tstart,tstop,level,start,stop):
     """ 
     Get the forward solution associated with this
-    time step and also get its derivative. This is
+    time step (between the fine grid points start and
+    stop) and also get its derivative. This is
     used by the BackwardApp in computation of the
     adjoint (backprop) state and parameter derivatives.
     Its intent is to abstract the forward solution
@@ -221,13 +236,13 @@ class ForwardBraidApp(parent.BraidApp):
     being recomputed.
     """
     
-    if level==0 and (tstart,tstop) in self.backpropped:
+    if level==0 and (start,stop) in self.backpropped:
       with self.timer("getPrimalWithGrad-short"):
-        x,y = self.backpropped[(tstart,tstop)]
+        x,y = self.backpropped[(start,stop)]
       return y,x
 
     with self.timer("getPrimalWithGrad-long"):
-      b_x = self.getUVector(0,tstart)
+      b_x = self.getUVector(0,self.getLastPoint(start))
       t_x = b_x.tensors()
   
       x = tuple([v.detach() for v in t_x])
@@ -307,7 +322,7 @@ class BackwardBraidApp(parent.BraidApp):
     return f
   # end forward
 
-  def eval(self,w,tstart,tstop,level,done):
+  def eval(self,w,tstart,tstop,level,done,tindex):
     """
     Evaluate the adjoint problem for a single time step. Here 'w' is the
     adjoint solution. The variables 'x' and 'y' refer to the forward
@@ -317,7 +332,9 @@ class BackwardBraidApp(parent.BraidApp):
       try:
         # we need to adjust the time step values to reverse with the adjoint
         # this is so that the renumbering used by the backward problem is properly adjusted
-        t_y,t_x = self.fwd_app.getPrimalWithGrad(self.Tf-tstop,self.Tf-tstart,level)
+        start = self.getMirroredPoint(self.getFinePoint(tindex+1,level))
+        stop  = self.getMirroredPoint(self.getFinePoint(tindex,level))
+        t_y,t_x = self.fwd_app.getPrimalWithGrad(self.Tf-tstop,self.Tf-tstart,level,start,stop)
 
         # play with the parameter gradients to make sure they are on apprpriately,
         # store the initial state so we can revert them later
@@ -44,15 +44,15 @@ class BraidFunction(torch.autograd.Function):
     # copy the input to all processors (ensure consistency)
     comm = fwd_app.getMPIComm()
     with fwd_app.timer("func:precomm"):
-      shape = comm.bcast((h.size(),c.size()),root=0)
+      shape,dtype = comm.bcast(((h.size(),c.size()),h.dtype),root=0)
 
     # setup context
     ctx.fwd_app = fwd_app
     ctx.bwd_app = bwd_app
     ctx.save_for_backward(x, h,c, *params)
 
-    fwd_app.setShape(shape)
-    bwd_app.setShape(shape)
+    fwd_app.setShape(shape,dtype)
+    bwd_app.setShape(shape,dtype)
 
     h_c = (h,c)
 
@@ -41,6 +41,7 @@ from mpi4py import MPI
 import copy
 
 from torchbraid.utils import ContextTimerManager
+from torchbraid.parallel_settings import ParallelSettings
 from torchbraid.rnn_braid_function import BraidFunction
 
 import torchbraid.rnn_apps as apps
@@ -51,7 +52,7 @@ import torchbraid.rnn_apps as apps
 #  a python level module
 ##########################################################
 
-class RNN_Parallel(nn.Module):
+class RNN_Parallel(nn.Module,ParallelSettings):
   class ExecLP:
     """Helper class for btorchuilding composite neural network modules
 
@@ -118,28 +119,6 @@ class RNN_Parallel(nn.Module):
   def zero_grad(self):
     self.RNN_models.zero_grad()
 
-  def getTimerManager(self):
-    """
-    Get a TimerContextManager that describes how much time is taken by what.
-    """
-    return self.timer_manager
-
-  def setPrintLevel(self,print_level):
-    self.fwd_app.setPrintLevel(print_level)
-    self.bwd_app.setPrintLevel(print_level)
-
-  def setNumRelax(self,relax,level=-1):
-    self.fwd_app.setNumRelax(relax,level=level)
-    self.bwd_app.setNumRelax(relax,level=level)
-
-  def setCFactor(self,cfactor):
-    self.fwd_app.setCFactor(cfactor)
-    self.bwd_app.setCFactor(cfactor)
-
-  def setSkipDowncycle(self,skip):
-    self.fwd_app.setSkipDowncycle(skip)
-    self.bwd_app.setSkipDowncycle(skip)
-
   def getMPIComm(self):
     return self.fwd_app.getMPIComm()
 
@@ -228,14 +207,20 @@ class RNN_Parallel(nn.Module):
       result = comm.recv(source=0,tag=build_seq_tag)
       return result
 
-  def getTimersString(self):
+  def getTimersString(self,summary=False):
     """
-    Print the timers recored by the model.
+    Print the timers recored by the model. If summary is true, the timers are 
+    reduced across processors, reporting the imbalance and slowest rank for each
+    timer, instead of printing the timers of every processor.
     """
     comm     = self.comm
     my_rank  = self.comm.Get_rank() 
     num_proc = self.comm.Get_size()
     
+    if summary:
+      result = self.timer_manager.getReducedResultString(comm)
+      return result if my_rank==0 else None
+
     local_result = self.timer_manager.getResultString()
     result = comm.gather(local_result,root=0)
 
@@ -35,8 +35,10 @@
 import torch
 import numpy as np
 import traceback
+import collections
 
-from braid_vector import BraidVector
+from braid_vector import BraidVector, flatVector
+from utils import TensorPool
 
 cimport mpi4py.MPI as MPI
 
@@ -53,7 +55,7 @@ def output_exception(label):
 class BraidApp:
 
   def __init__(self,prefix_str,comm,local_num_steps,Tf,max_levels,max_iters,
-               spatial_ref_pair=None,require_storage=False,abs_tol=1e-12):
+               spatial_ref_pair=None,require_storage=False,abs_tol=1e-12,buffer_dtype=None):
 
     self.prefix_str = prefix_str # prefix string for helping to debug hopefully
     self.tb_print_level = 0      # set print level internally to zero
@@ -64,21 +66,69 @@ class BraidApp:
     self.print_level = 2
     self.nrelax      = 0
     self.cfactor     = 2
+    self.cfactors    = dict() # coarsening factors set for individual levels
     self.skip_downcycle = 0
     self.require_storage = require_storage
     self.abs_tol = abs_tol
+    self.rel_tol = None
+
+    # iteration cap adjusted when the residual stagnates (None disables)
+    self.stagnation_tol       = None
+    self.stagnation_min_iters = 1
+    self.current_max_iters    = max_iters
+
+    # seed each run with the fine grid states braid kept from the last run
+    self.warm_start = True
+
+    # residual norms and iteration counts of recent runs
+    self.rnorm_history = collections.deque(maxlen=100)
+    self.iter_history  = collections.deque(maxlen=100)
+
+    # versioned weights sent and received in vector messages (see my_bufpack),
+    # apps that version their weights set versioned_weights
+    self.versioned_weights    = False
+    self.sent_weight_versions = dict()
+    self.recv_weights         = dict()
+    self.missed_weights       = 0
 
     self.mpi_comm        = comm
     self.Tf              = Tf
     self.local_num_steps = local_num_steps
-    self.num_steps       = local_num_steps*self.mpi_comm.Get_size()
+
+    # the number of steps can differ between ranks, braid distributes the time 
+    # points evenly so ranks with fewer steps are padded (see getTimeGridPoint)
+    self.step_counts     = self.mpi_comm.allgather(local_num_steps)
+    self.step_offsets    = np.cumsum([0]+self.step_counts).tolist()
+    self.num_steps       = self.step_offsets[-1]
+    self.max_local_steps = max(self.step_counts)
+    self.uniform_steps   = min(self.step_counts)==self.max_local_steps
+    self.time_grid       = None
+
+    # the global step starting at each fine grid point (see getGridSteps), the
+    # steps are looked up with the integer time indices braid passes to my_step
+    self.grid_steps      = None
+    self.last_points     = None
+    self.local_offset    = self.step_offsets[self.mpi_comm.Get_rank()]
 
     self.dt       = Tf/self.num_steps
-    self.t0_local = self.mpi_comm.Get_rank()*local_num_steps*self.dt
-    self.tf_local = (self.mpi_comm.Get_rank()+1.0)*local_num_steps*self.dt
+    self.t0_local = self.step_offsets[self.mpi_comm.Get_rank()]*self.dt
+    self.tf_local = self.step_offsets[self.mpi_comm.Get_rank()+1]*self.dt
 
     self.x_final = None
     self.shape0 = None
+    self.dtype0 = torch.get_default_dtype()
+
+    self.buffer_dtype = None
+    self.setBufferDType(buffer_dtype)
+
+    # recycles the state tensors of vectors freed by braid
+    self.tensor_pool = TensorPool()
+
+    # ranks holding the output of the network after a run
+    self.output_placement = 'all'
+
+    # averages the parameter gradients over data parallel replicas (None is off)
+    self.grad_allreduce = None
   
     comm          = self.getMPIComm()
     my_rank       = self.getMPIComm().Get_rank()
@@ -132,8 +182,9 @@ class BraidApp:
     cdef braid_PtFcnBufUnpack b_bufunpack = <braid_PtFcnBufUnpack> my_bufunpack
     cdef braid_PtFcnSCoarsen b_coarsen = <braid_PtFcnSCoarsen> my_coarsen
     cdef braid_PtFcnSRefine b_refine = <braid_PtFcnSRefine> my_refine
+    cdef braid_PtFcnTimeGrid b_timegrid = <braid_PtFcnTimeGrid> my_timegrid
 
-    ntime = self.num_steps
+    ntime = self.max_local_steps*self.mpi_comm.Get_size()
     tstart = 0.0
     tstop = self.Tf
 
@@ -146,6 +197,9 @@ class BraidApp:
                b_bufsize, b_bufpack, b_bufunpack, 
                &core)
 
+    if not self.uniform_steps:
+      braid_SetTimeGrid(core,b_timegrid)
+
     if self.spatial_mg:
       braid_SetSpatialCoarsen(core,b_coarsen)
       braid_SetSpatialRefine(core,b_refine)
@@ -174,12 +228,20 @@ class BraidApp:
   # end initCore
 
   def __del__(self):
+    self.destroy()
+
+  def destroy(self):
+    """
+    Destroy the braid core, the app can not be run afterwards. Call this
+    before freeing the communicator of the app.
+    """
     if self.py_core is not None:
       py_core = <PyBraid_Core> self.py_core
       core = py_core.getCore()
 
       # Destroy Braid Core C-Struct
       braid_Destroy(core) # this should be on
+      self.py_core = None
     # end core
 
   def diagnostics(self,enable):
@@ -197,26 +259,121 @@ class BraidApp:
   def getTensorShapes(self):
     return self.shape0
 
-  def setShape(self,shape):
+  def getTensorDTypes(self):
+    """
+    The dtype of each tensor in getTensorShapes, by default all tensors use
+    the dtype passed to setShape.
+    """
+    return len(self.shape0)*[self.dtype0]
+
+  def setShape(self,shape,dtype=None):
     # the shape to use if non-exists for taking advantage of allocations in braid
     if isinstance(shape,torch.Size):
       self.shape0 = (shape,)
     else:
       self.shape0 = shape
 
+    if dtype is not None:
+      self.dtype0 = dtype
+
+  def setBufferDType(self,dtype):
+    """
+    Set the dtype used to send floating point tensors between processors. If
+    this is a reduced precision type (torch.float16 or torch.bfloat16) message
+    sizes are reduced, and the tensors are upcast to their original dtype on
+    unpack. Use None (the default) to send tensors in their own dtype.
+    """
+    if dtype is not None and not dtype.is_floating_point:
+      raise ValueError('Buffer dtype must be a floating point type, found \'{}\''.format(dtype))
+
+    self.buffer_dtype = dtype
+
+  def getBufferDType(self):
+    return self.buffer_dtype
+
+  def setOutputPlacement(self,placement):
+    """
+    Set which ranks hold the output of the network after a run: 'all' (the
+    default) broadcasts it to every rank, 'root' sends it to rank 0 only, and
+    'last' leaves it on the last rank where it is computed. Ranks that do not
+    hold the output see zeros (a read only tensor that is not allocated).
+    """
+    if placement not in ['all','root','last']:
+      raise ValueError('Output placement must be \'all\', \'root\' or \'last\', found \'{}\''.format(placement))
+
+    self.output_placement = placement
+
+  def getOutputPlacement(self):
+    return self.output_placement
+
+  def setGradientAllreduce(self,grad_allreduce):
+    """
+    Set a GradientAllreduce used to average the parameter gradients over data
+    parallel replicas, use None to turn this off.
+    """
+    self.grad_allreduce = grad_allreduce
+
+  def getGradientAllreduce(self):
+    return self.grad_allreduce
+
+  def getTensorPool(self):
+    """
+    Get the pool used to allocate the state tensors of braid vectors. Use
+    this to get hit/miss statistics, or to set the high water mark.
+    """
+    return self.tensor_pool
+
+  def setTensorPoolHighWaterMark(self,high_water):
+    """
+    Set the maximum number of bytes held by the tensor pool (None is unlimited).
+    """
+    self.tensor_pool.setHighWaterMark(high_water)
+
   def initializeStates(self):
     try:
       t = 0.0
       for i in range(self.local_num_steps+1):
         t = self.t0_local + i*self.dt
-        u_vec = self.getUVector(0,t)
+        u_vec = self.getUVector(0,self.getTimePoint(t))
         if u_vec!=None:
+          self.seedVector(t,u_vec)
           self.initializeVector(t,u_vec)
     except:
       output_exception("{}:initializeStates: rank {}, t={}".format(self.prefix_str,self.getMPIComm().Get_rank(),t))
    
   # end initializeStates
 
+  def setWarmStart(self,enable):
+    """
+    Braid keeps the fine grid states (C-points, or all points when storage is
+    required) between runs, by default these seed the next run. Disable this
+    to start each run from zero states.
+    """
+    self.warm_start = enable
+
+  def seedVector(self,t,u):
+    """
+    Prepare a fine grid state kept by braid as the initial guess of the next
+    run. It is zeroed if warm starts are off, or if its shape or dtype no 
+    longer matches (for instance for a ragged final batch).
+    """
+    if self.getTimePoint(t)==0:
+      return
+
+    shapes = [torch.Size(s) for s in self.getTensorShapes()]
+    dtypes = list(self.getTensorDTypes())
+
+    matches = [v.size() for v in u.tensors()]==shapes and [v.dtype for v in u.tensors()]==dtypes
+    if matches and self.warm_start:
+      return
+
+    if matches:
+      for v in u.tensors():
+        v.zero_()
+    else:
+      u.replaceTensor([torch.zeros(s,dtype=d) for s,d in zip(shapes,dtypes)])
+  # end seedVector
+
   def finalRelax(self):
     """
     Force the application to do a final FC relaxtion sweep. This is useful for
@@ -226,6 +383,15 @@ class BraidApp:
     cdef braid_Core core = py_core.getCore()
     braid_SetFinalFCRelax(core)
 
+  def setRequireStorage(self,require):
+    """
+    Keep the states of all the fine grid points (instead of only the C-points)
+    between iterations, this must be set before the first run.
+    """
+    cdef braid_Core core = (<PyBraid_Core> self.py_core).getCore()
+    self.require_storage = require
+    braid_SetStorage(core,0 if require else -1)
+
   def runBraid(self,x):
     cdef PyBraid_Core py_core = <PyBraid_Core> self.py_core
     cdef braid_Core core = py_core.getCore()
@@ -242,6 +408,13 @@ class BraidApp:
 
        braid_Drive(core) # my_step -> App:eval -> resnet "basic block"
 
+       # a rank missed weights that were only sent by version, the run is
+       # repeated with the full weights in every message
+       if self.checkMissedWeights():
+         self.clearRunCaches()
+         braid_Drive(core)
+
+       self.recordBraidStats()
        self.printBraidStats()
 
        fin = self.getFinal()
@@ -252,22 +425,116 @@ class BraidApp:
 
     return fin
 
-  def printBraidStats(self):
+  def clearRunCaches(self):
+    """
+    Clear anything cached during a run that depends on received weights.
+    """
+    pass
+
+  def recordBraidStats(self):
+    """
+    Record the residual norms and the iteration count of the last run, and
+    update the iteration cap if stagnation detection is on.
+    """
     cdef PyBraid_Core py_core = <PyBraid_Core> self.py_core
     cdef braid_Core core = py_core.getCore()
 
-    cdef double resnorm 
-    cdef int iter_cnt 
-    cdef int niter = -1 # used for lookup
+    cdef int iter_cnt = 0
+    cdef int nrequest
+    cdef double[::1] rnorms
+
+    braid_GetNumIter(core, &iter_cnt);
+
+    rnorms = np.zeros(max(iter_cnt,1))
+    nrequest = max(iter_cnt,1)
+    braid_GetRNorms(core, &nrequest, &rnorms[0]);
+
+    # braid reports missing norms as negative
+    history = [r for r in np.asarray(rnorms)[0:nrequest].tolist() if r>=0.0]
+
+    self.rnorm_history.append(history)
+    self.iter_history.append(iter_cnt)
+
+    self.updateIterationCap(history)
+  # end recordBraidStats
+
+  def updateIterationCap(self,rnorms):
+    """
+    Cap the iterations of the following runs at the iteration where the residual
+    of this run stagnated, that is where the ratio of successive residual norms 
+    exceeds the stagnation tolerance. If a capped run is still converging the 
+    cap is raised by one, up to the maximum number of iterations.
+    """
+    if self.stagnation_tol is None:
+      return
+
+    cap = self.current_max_iters
+    stagnated = None
+    for k in range(1,len(rnorms)):
+      if rnorms[k-1]>0.0 and rnorms[k]/rnorms[k-1]>self.stagnation_tol:
+        stagnated = k
+        break
+
+    if stagnated is not None:
+      cap = max(stagnated,self.stagnation_min_iters)
+    elif len(rnorms)>=cap:
+      cap = cap+1
+
+    self.setIterationCap(min(cap,self.max_iters))
+  # end updateIterationCap
+
+  def setIterationCap(self,cap):
+    if cap==self.current_max_iters:
+      return
+
+    self.current_max_iters = cap
+
+    core = (<PyBraid_Core> self.py_core).getCore()
+    braid_SetMaxIter(core, cap)
+
+  def getIterationCap(self):
+    """
+    Get the maximum number of iterations used by the next run.
+    """
+    return self.current_max_iters
+
+  def getResidualHistory(self):
+    """
+    Get the per-iteration residual norms for each of the recent runs, oldest first.
+    """
+    return list(self.rnorm_history)
+
+  def getIterationHistory(self):
+    """
+    Get the iteration count for each of the recent runs, oldest first.
+    """
+    return list(self.iter_history)
 
+  def getLastResidualNorms(self):
+    if len(self.rnorm_history)==0:
+      return None
+    return self.rnorm_history[-1]
+
+  def getLastIterationCount(self):
+    if len(self.iter_history)==0:
+      return None
+    return self.iter_history[-1]
+
+  def setHistoryLength(self,length):
+    """
+    Set the number of runs kept in the residual and iteration histories.
+    """
+    self.rnorm_history = collections.deque(self.rnorm_history,maxlen=length)
+    self.iter_history  = collections.deque(self.iter_history,maxlen=length)
+
+  def printBraidStats(self):
     # no printing internally enabled
     if self.tb_print_level==0:
       return
 
-    braid_GetNumIter(core, &iter_cnt);
-
-    niter = -1
-    braid_GetRNorms(core, &niter, &resnorm);
+    history = self.getLastResidualNorms()
+    iter_cnt = self.getLastIterationCount()
+    resnorm = history[-1] if len(history)>0 else -1.0
 
     my_rank       = self.getMPIComm().Get_rank()
     if my_rank==0:
@@ -302,20 +569,71 @@ class BraidApp:
     braid_SetNRelax(core,level,self.nrelax)
 
   def setMaxIters(self,max_iters):
+    """
+    Set the maximum number of iterations. With stagnation detection on, the
+    iteration cap (see updateIterationCap) is kept when the maximum is unchanged
+    or lowered (down to the new maximum). Raising the maximum resets the cap to
+    it, so the additional iterations are run.
+    """
+    if self.stagnation_tol is not None and max_iters<=self.max_iters:
+      self.current_max_iters = min(self.current_max_iters,max_iters)
+    else:
+      self.current_max_iters = max_iters
     self.max_iters = max_iters
 
     core = (<PyBraid_Core> self.py_core).getCore()
-    braid_SetMaxIter(core, self.max_iters)
+    braid_SetMaxIter(core, self.current_max_iters)
+
+  def setRelTol(self,rel_tol):
+    """
+    Stop iterating once the residual norm is reduced by a factor of rel_tol
+    relative to the initial residual. This replaces the absolute tolerance, 
+    use setAbsTol to restore it.
+    """
+    self.rel_tol = rel_tol
+
+    core = (<PyBraid_Core> self.py_core).getCore()
+    braid_SetRelTol(core, rel_tol)
+
+  def setAbsTol(self,abs_tol):
+    self.abs_tol = abs_tol
+    self.rel_tol = None
+
+    core = (<PyBraid_Core> self.py_core).getCore()
+    braid_SetAbsTol(core, abs_tol)
+
+  def setStagnationTol(self,stagnation_tol,min_iters=1):
+    """
+    Detect stagnation of the residual: when the ratio of successive residual
+    norms in a run exceeds stagnation_tol (for instance 0.5), the iterations of 
+    the following runs are capped where the stagnation began (but at least 
+    min_iters). Use None to disable, this restores the maximum iterations.
+    """
+    self.stagnation_tol = stagnation_tol
+    self.stagnation_min_iters = min_iters
+
+    if stagnation_tol is None:
+      self.setIterationCap(self.max_iters)
 
   def setFMG(self):
     core = (<PyBraid_Core> self.py_core).getCore()
     braid_SetFMG(core)
 
-  def setCFactor(self,cfactor):
-    self.cfactor = cfactor 
+  def setCFactor(self,cfactor,level=-1):
+    if level<0:
+      self.cfactor = cfactor 
+    else:
+      self.cfactors[level] = cfactor
 
     core = (<PyBraid_Core> self.py_core).getCore()
-    braid_SetCFactor(core,-1,self.cfactor) # -1 implies chage on all levels
+    braid_SetCFactor(core,level,cfactor) # -1 implies chage on all levels
+
+  def getCFactor(self,level):
+    """
+    The coarsening factor from a level to the next coarser one (as braid does,
+    a factor set for the level takes precedence).
+    """
+    return self.cfactors.get(level,self.cfactor)
 
   def setSkipDowncycle(self,skip):
     if skip:
@@ -328,16 +646,17 @@ class BraidApp:
 
   def setRevertedRanks(self,reverted):
     self.reverted = reverted 
+    self.time_grid = None
+    self.grid_steps = None
     core = (<PyBraid_Core> self.py_core).getCore()
     braid_SetRevertedRanks(core,reverted)
 
-  def getUVector(self,level,t):
+  def getUVector(self,level,index):
     cdef braid_Core core = (<PyBraid_Core> self.py_core).getCore()
     cdef braid_BaseVector bv
 
     with self.timer("getUVector"): 
       
-      index = self.getGlobalTimeStepIndex(t,None,level)
       _braid_UGetVectorRef(core, level,index,&bv)
 
       # this can be null, return that the vector was not found
@@ -349,11 +668,156 @@ class BraidApp:
   def getMPIComm(self):
     return self.mpi_comm
 
+  def getMessageDestination(self,level):
+    """
+    The rank receiving the vectors this rank sends on a level. Braid sends to
+    the rank owning the point after the last local point on the level.
+    """
+    cdef braid_Core core = (<PyBraid_Core> self.py_core).getCore()
+    cdef int proc = -1
+
+    _braid_GetProc(core,level,core.grids[level].iupper+1,&proc)
+    return proc
+
+  def shouldSendWeights(self,dest,level,version):
+    """
+    Should the weights with this version be included in a message to dest. This 
+    is true the first time a version is sent to dest on a level, and the version
+    is recorded as sent. Otherwise the message only carries the version.
+    """
+    rank,index,count = version
+    if self.sent_weight_versions.get((dest,level,index))==count:
+      return False
+
+    self.sent_weight_versions[(dest,level,index)] = count
+    return True
+
+  def storeReceivedWeights(self,version,weights):
+    # copies, the received tensors belong to the vector being unpacked
+    rank,index,count = version
+    self.recv_weights[(rank,index)] = (count,[w.detach().clone() for w in weights])
+
+  def getReceivedWeights(self,version):
+    """
+    The stored weights of a version, None if they were not received. The miss
+    is recorded and the run is repeated with the full weights (see checkMissedWeights).
+    """
+    rank,index,count = version
+    entry = self.recv_weights.get((rank,index))
+    if entry is None or entry[0]!=count:
+      self.missed_weights += 1
+      return None
+    return entry[1]
+
+  def checkMissedWeights(self):
+    """
+    Did any rank miss weights sent by version in the last run. If so the sent
+    versions are forgotten on all ranks, so the next messages carry the weights.
+    """
+    if not self.versioned_weights or self.mpi_comm.Get_size()==1:
+      return False
+
+    missed = self.mpi_comm.allreduce(self.missed_weights)
+    self.missed_weights = 0
+    if missed==0:
+      return False
+
+    self.sent_weight_versions = dict()
+    return True
+
+  def getFinePoint(self,tindex,level):
+    """
+    The fine grid point of braid's time index on a level (braid maps index i on
+    a level to index i*cfactor on the next finer level).
+    """
+    for l in range(level):
+      tindex *= self.getCFactor(l)
+    return tindex
+
+  def getMirroredPoint(self,point):
+    """
+    The point of the mirrored (reverted) grid with the same time, the backward
+    apps use this to look up the forward problem.
+    """
+    return self.max_local_steps*self.mpi_comm.Get_size()-point
+
+  def getGridSteps(self):
+    """
+    The global step starting at each fine grid point, and the last point with 
+    the same step (padding repeats steps, see getTimeGridPoint).
+    """
+    if self.grid_steps is None:
+      npoints = self.max_local_steps*self.mpi_comm.Get_size()+1
+      steps = [self.forwardGridStep(i) for i in range(npoints)]
+      if self.reverted:
+        steps = [self.num_steps-s for s in reversed(steps)]
+
+      last = npoints*[npoints-1]
+      for i in reversed(range(npoints-1)):
+        last[i] = last[i+1] if steps[i]==steps[i+1] else i
+
+      self.grid_steps = steps
+      self.last_points = last
+    return self.grid_steps
+
+  def getGlobalStepIndex(self,point):
+    return self.getGridSteps()[point]
+
+  def getLocalStepIndex(self,point):
+    return self.getGridSteps()[point]-self.local_offset
+
+  def getLocalStepPoint(self,index):
+    """
+    The fine grid point where a local step starts (braid gives rank r the points
+    after r*max_local_steps).
+    """
+    return self.mpi_comm.Get_rank()*self.max_local_steps+index
+
+  def getLastPoint(self,point):
+    self.getGridSteps()
+    return self.last_points[point]
+
+  def getTimePoint(self,t):
+    """
+    The last fine grid point at time t. This is only for the callbacks that
+    braid gives no time index (e.g. my_init), steps use the index.
+    """
+    return int(np.searchsorted(self.getTimeGrid(),t+0.5*self.dt,side='right'))-1
+
   def getLocalTimeStepIndex(self,t,tf,level):
-    return round((t-self.t0_local) / self.dt)
+    return self.getLocalStepIndex(self.getTimePoint(t))
 
   def getGlobalTimeStepIndex(self,t,tf,level):
-    return round(t / self.dt)
+    return self.getTimePoint(t)
+
+  def getTimeGridPoint(self,index):
+    """
+    The time of a braid point. Braid gives each rank max_local_steps points, so
+    ranks with fewer steps are padded at the end with zero length steps (these
+    are skipped by my_step). The grid of the reverted (adjoint) problem mirrors
+    the forward grid.
+    """
+    if self.reverted:
+      return self.Tf-self.forwardTimeGridPoint(self.max_local_steps*self.mpi_comm.Get_size()-index)
+    return self.forwardTimeGridPoint(index)
+
+  def forwardTimeGridPoint(self,index):
+    return self.forwardGridStep(index)*self.dt
+
+  def forwardGridStep(self,index):
+    if index==0:
+      return 0
+
+    # braid gives rank r the points r*K+1 to (r+1)*K (rank 0 also has 0)
+    rank = (index-1) // self.max_local_steps
+    step = index-rank*self.max_local_steps
+    return self.step_offsets[rank]+min(step,self.step_counts[rank])
+
+  def getTimeGrid(self):
+    if self.time_grid is None:
+      npoints = self.max_local_steps*self.mpi_comm.Get_size()+1
+      self.time_grid = np.array([self.getTimeGridPoint(i) for i in range(npoints)])
+    return self.time_grid
 
   def setInitial(self,x0):
     cdef braid_Core core = (<PyBraid_Core> self.py_core).getCore()
@@ -380,8 +844,8 @@ class BraidApp:
   def buildInit(self,t):
     try:
       if t>0:
-        zeros = [torch.zeros(s) for s in self.shape0]
-        x = BraidVector(tuple(zeros),0)
+        x = flatVector(self.shape0,self.dtype0,0,self.tensor_pool)
+        x.getStorage().zero_()
       else:
         x = BraidVector(self.x0.tensors(),0)
   
@@ -395,7 +859,10 @@ class BraidApp:
 
   def access(self,t,u):
     if t==self.Tf:
-      self.x_final = u.clone()
+      # copy the tensors individually (not as views into a storage), 
+      # these are returned to the user
+      tensors = [v.detach().clone() for v in u.tensors()]
+      self.x_final = BraidVector(tuple(tensors),u.level())
 
   def getFinal(self):
     if self.x_final==None:
@@ -48,48 +48,103 @@ def output_exception(label):
   s = traceback.format_exc()
   print('\n**** Torchbraid Callbacks::{} Exception ****\n{}'.format(label,s))
 
+class TraceContext:
+  """
+  Set the braid context (level, times and iteration) of the app's tracer for
+  the events recorded within a callback, the previous context is restored on 
+  exit. Nothing is done when tracing is off. Unknown values are left as
+  -1 (level and iteration) or nan (times).
+  """
+  def __init__(self,pyApp,level=-1,tstart=float('nan'),tstop=float('nan'),iteration=-1):
+    self.tracer = None
+    if pyApp.timer_manager.isEnabled():
+      self.tracer = pyApp.timer_manager.getTracer()
+    self.context = (level,tstart,tstop,iteration)
+
+  def __enter__(self):
+    if self.tracer is not None:
+      self.previous = self.tracer.context
+      self.tracer.setContext(*self.context)
+    return self
+
+  def __exit__(self,except_type,except_value,except_traceback):
+    if self.tracer is not None:
+      self.tracer.setContext(*self.previous)
+    return False
+# end TraceContext
+
 ##
 # Define your Python Braid Vector as a C-struct
 
 cdef int my_access(braid_App app,braid_Vector u,braid_AccessStatus status):
 
   cdef double t
+  cdef int iteration
+  cdef int level
+  cdef int done
 
   try:
     pyApp = <object> app
-    with pyApp.timer("access"):
+    braid_AccessStatusGetTILD(status, &t, &iteration, &level, &done)
+
+    with TraceContext(pyApp,level,t,t,iteration), pyApp.timer("access"):
 
       # Create Numpy wrapper around u.v
       ten_u = <object> u
 
-      braid_AccessStatusGetT(status, &t)
-
       pyApp.access(t,ten_u)
   except:
     output_exception("my_access")
 
   return 0
 
+cdef int my_timegrid(braid_App app, double *ta, int *ilower, int *iupper):
+  try:
+    pyApp = <object> app
+    for i in range(ilower[0],iupper[0]+1):
+      ta[i-ilower[0]] = pyApp.getTimeGridPoint(i)
+  except:
+    output_exception("my_timegrid")
+
+  return 0
+
 cdef int my_step(braid_App app, braid_Vector ustop, braid_Vector fstop, braid_Vector vec_u, braid_StepStatus status):
   cdef double tstart
   cdef double tstop
   cdef int level
   cdef int done 
+  cdef int iteration
+  cdef int tindex
 
   try:
     pyApp = <object> app
-    with pyApp.timer("step"):
-
-      tstart = 0.0
-      tstop = 5.0
-      level = -1
-      braid_StepStatusGetTstartTstop(status, &tstart, &tstop)
-      braid_StepStatusGetLevel(status, &level)
-      braid_StepStatusGetDone(status, &done)
-
-      # modify the state vector in place
-      u =  <object> vec_u
-      pyApp.eval(u,tstart,tstop,level,done)
+
+    tstart = 0.0
+    tstop = 5.0
+    level = -1
+    braid_StepStatusGetTstartTstop(status, &tstart, &tstop)
+    braid_StepStatusGetLevel(status, &level)
+    braid_StepStatusGetDone(status, &done)
+
+    # zero length steps pad ranks with fewer steps, they are the identity
+    if tstart==tstop:
+      return 0
+
+    # the integer index of tstart on this level, used for the layer and vector
+    # lookups instead of the times
+    braid_StepStatusGetTIndex(status, &tindex)
+
+    # modify the state vector in place (step is called most often, so 
+    # skip the timer entirely when timing is disabled)
+    u =  <object> vec_u
+    if pyApp.timer_manager.isEnabled():
+      # events traced within the step carry its level, times and iteration
+      braid_StepStatusGetIter(status, &iteration)
+
+      with TraceContext(pyApp,level,tstart,tstop,iteration), pyApp.timer("step"):
+        pyApp.eval(u,tstart,tstop,level,done,tindex)
+    else:
+      pyApp.eval(u,tstart,tstop,level,done,tindex)
   except:
     output_exception("my_step: rank={}, step=({},{}), level={}, sf={}".format(pyApp.getMPIComm().Get_rank(),tstart,tstop,level,u.getSendFlag()))
 
@@ -115,6 +170,8 @@ cdef int my_free(braid_App app, braid_Vector u):
     with pyApp.timer("free"):
       # Cast u as a PyBraid_Vector
       pyU = <object> u
+      # recycle the tensors
+      pyU.releaseTensors(pyApp.getTensorPool())
       # Decrement the smart pointer
       Py_DECREF(pyU) 
       del pyU
@@ -123,17 +180,32 @@ cdef int my_free(braid_App app, braid_Vector u):
   return 0
 
 cdef int my_sum(braid_App app, double alpha, braid_Vector x, double beta, braid_Vector y):
-  # This routine cna be made faster by using the pyTorch tensor operations
-  # My initial attempt at this failed however
+  # computes y = alpha*x + beta*y, when the vectors have a flat storage this
+  # is done with a single operation over all the tensors
 
   try:
     pyApp = <object> app
-    with pyApp.timer("sum"):
-      bv_X = <object> x
-      bv_Y = <object> y
-      for ten_X,ten_Y in zip(bv_X.tensors(),bv_Y.tensors()):
-        ten_Y.mul_(float(beta))
-        ten_Y.add_(ten_X,alpha=float(alpha))
+    bv_X = <object> x
+    bv_Y = <object> y
+
+    with TraceContext(pyApp,bv_Y.level()), pyApp.timer("sum"):
+      store_X = bv_X.getStorage()
+      store_Y = bv_Y.getStorage()
+      if store_X is not None and store_Y is not None \
+         and store_X.dtype==store_Y.dtype and store_X.numel()==store_Y.numel():
+        pairs = [(store_X,store_Y)]
+      else:
+        pairs = zip(bv_X.tensors(),bv_Y.tensors())
+
+      for ten_X,ten_Y in pairs:
+        if beta==0.0:
+          # don't use mul_, this makes sure nan/inf values in y are overwritten
+          torch.mul(ten_X,float(alpha),out=ten_Y)
+        elif beta==1.0:
+          ten_Y.add_(ten_X,alpha=float(alpha))
+        else:
+          ten_Y.mul_(float(beta))
+          ten_Y.add_(ten_X,alpha=float(alpha))
   except:
     output_exception("my_sum")
 
@@ -142,9 +214,10 @@ cdef int my_sum(braid_App app, double alpha, braid_Vector x, double beta, braid_
 cdef int my_clone(braid_App app, braid_Vector u, braid_Vector *v_ptr):
   try:
     pyApp = <object> app
-    with pyApp.timer("clone"):
-      ten_U = <object> u 
-      v_mem = ten_U.clone()
+    ten_U = <object> u 
+
+    with TraceContext(pyApp,ten_U.level()), pyApp.timer("clone"):
+      v_mem = ten_U.clone(pyApp.getTensorPool())
       Py_INCREF(v_mem) # why do we need this?
       v_ptr[0] = <braid_Vector> v_mem
   except:
@@ -155,126 +228,322 @@ cdef int my_clone(braid_App app, braid_Vector u, braid_Vector *v_ptr):
 cdef int my_norm(braid_App app, braid_Vector u, double *norm_ptr):
   try:
     pyApp = <object> app
-    with pyApp.timer("norm"):
-      # Compute norm 
-      tensors_U = (<object> u).tensors()
-      norm_ptr[0] = 0.0
-      for ten_U in tensors_U:
-        val = torch.norm(ten_U).item()
-        norm_ptr[0] += val*val
-
-      math.sqrt(norm_ptr[0])
+    bv_U = <object> u
+
+    with TraceContext(pyApp,bv_U.level()), pyApp.timer("norm"):
+      # Compute norm (with a single synchronization)
+      storage = bv_U.getStorage()
+      if storage is not None:
+        norm_ptr[0] = torch.norm(storage).item()
+      else:
+        norms = [torch.norm(ten_U).double() for ten_U in bv_U.tensors()]
+        norm_ptr[0] = torch.norm(torch.stack(norms)).item()
   except:
     output_exception("my_norm")
 
   return 0
 
+##
+# Buffer format: a versioned header of integers, followed by the tensor data
+# and finally the pickled layer data. In order the header contains
+#
+#   version, level, num tensors, num weight tensors, layer data size (in bytes),
+#   weight version (rank, layer index, count), weights included flag
+#
+# and then for each tensor
+#
+#   rank, dtype code, wire dtype code, shape[0], ..., shape[rank-1]
+#
+# The layer data size in the header is the size of the pickled layer data
+# actually written, this may be less than the space reserved by the app
+# with getLayerDataSize. The header is padded to an 8 byte boundary, and
+# each tensor is stored
+# (aligned to its element size) using its wire dtype. The wire dtype is the
+# tensor dtype unless a reduced precision buffer dtype is set on the app, in
+# which case floating point tensors are sent in that dtype and upcast on
+# unpack.
+#
+# Vectors whose weights carry a version (see BraidVector.addWeightTensors) 
+# only include the weights the first time that version is sent to a rank on
+# a level, later messages carry the version and the receiver uses the weights
+# it stored. The rank of the version is -1 if the weights are not versioned.
+
+BUFFER_FORMAT_VERSION = 2
+BUFFER_HEADER_INTS    = 9
+
+# the list index is the dtype code used in the buffer header
+buffer_dtypes = [torch.float32,
+                 torch.float64,
+                 torch.float16,
+                 torch.bfloat16,
+                 torch.int64,
+                 torch.int32]
+buffer_dtype_codes = {d:i for i,d in enumerate(buffer_dtypes)}
+buffer_dtype_sizes = {d:torch.empty(0,dtype=d).element_size() for d in buffer_dtypes}
+
+def wireDType(dtype,buffer_dtype):
+  """
+  Compute the dtype a tensor is sent with, only floating point
+  tensors are reduced to the buffer dtype.
+  """
+  if buffer_dtype is None or not dtype.is_floating_point:
+    return dtype
+  return buffer_dtype
+# end wireDType
+
+def alignBytes(offset,alignment):
+  return ((offset+alignment-1)//alignment)*alignment
+
+def bufferLayout(shapes,wire_dtypes):
+  """
+  Compute the byte offsets for the packed buffer. Returns the start of the
+  data section, the start of each tensor, and the end of the data section
+  (where the layer data begins).
+  """
+  header_size = sizeof(int)*(BUFFER_HEADER_INTS+sum([len(s)+3 for s in shapes]))
+  data_offset = alignBytes(header_size,8)
+
+  offsets = []
+  end = data_offset
+  for s,w in zip(shapes,wire_dtypes):
+    end = alignBytes(end,buffer_dtype_sizes[w])
+    offsets += [end]
+    end += buffer_dtype_sizes[w]*s.numel()
+
+  return data_offset,offsets,end
+# end bufferLayout
+
+def weightBufferSize(weights):
+  """
+  Compute an upper bound on the number of bytes needed to add the weight
+  tensors to a packed buffer (header entries, alignment and data).
+  """
+  size = 8 # possible header alignment
+  for w in weights:
+    esize = buffer_dtype_sizes[w.dtype]
+    size += sizeof(int)*(len(w.size())+3) + (esize-1) + esize*w.numel()
+  return size
+# end weightBufferSize
+
 cdef int my_bufsize(braid_App app, int *size_ptr, braid_BufferStatus status):
 
   try:
     pyApp = <object> app
     with pyApp.timer("bufsize"):
       shapes = pyApp.getTensorShapes()
-      num_tensors = len(shapes) # all tensors
-      cnt = 0
-      total_shape = 0
+      dtypes = pyApp.getTensorDTypes()
+      buffer_dtype = pyApp.getBufferDType()
       layer_data_size = pyApp.getLayerDataSize()
-      for s in shapes:
-        cnt += s.numel() # pyApp.shape0[0].numel()
-        rank = len(s) #len(pyApp.shape0[0])
-        total_shape += rank*sizeof(int)
+
+      wire_dtypes = [wireDType(d,buffer_dtype) for d in dtypes]
   
       # because the braid vectors are sometimes moved with weight components, the app
       # object is responsible for making sure those are sized appropriately. 
   
       # Note size_ptr is an integer array of size 1, and we index in at location [0]
-  
-      # there are mulitple fields in a packed buffer, in orderr
-      size_ptr[0] = ( sizeof(int)              # level
-                    + sizeof(int)              # num tensors
-                    + sizeof(int)              # num weight tensors
-                    + sizeof(int)              # other layer information (size in bytes)
-                    + num_tensors*sizeof(int)  # tensor rank
-                    + total_shape              # tensor shapes
-                    + sizeof(float)*cnt        # tensor data
-                    + layer_data_size          # pickled layer size
-                    )
+      data_offset,offsets,end = bufferLayout(shapes,wire_dtypes)
+      size_ptr[0] = end+layer_data_size
   except:
     output_exception("my_bufsize")
 
   return 0
 
+# numpy dtypes of the wire dtypes, numpy has no bfloat16 so its bits are 
+# stored as 16 bit integers (see wireArray and wireTensor)
+buffer_numpy_dtypes = {torch.float32  : np.float32,
+                       torch.float64  : np.float64,
+                       torch.float16  : np.float16,
+                       torch.bfloat16 : np.uint16,
+                       torch.int64    : np.int64,
+                       torch.int32    : np.int32}
+
+cdef object bufferArray(void * buffer,int num_bytes):
+  """
+  Wrap a section of a raw braid buffer as a flat numpy byte array. No copy
+  is made, the returned array aliases the buffer memory.
+  """
+  cdef view.array raw
+
+  if num_bytes==0:
+    return np.empty(0,dtype=np.uint8)
+
+  raw = <char[:num_bytes]> (<char *> buffer)
+  return np.asarray(raw).view(np.uint8)
+# end bufferArray
+
+def wireArray(t,wire_dtype):
+  """
+  The values of a tensor in the wire dtype, as a flat numpy array.
+  """
+  t = t.detach().reshape(-1)
+  if wire_dtype==torch.bfloat16:
+    # torch rounds to bfloat16, the result is exact in float32 so its upper 
+    # 16 bits are the bfloat16 bits
+    f = t.to(torch.bfloat16).to(torch.float32).numpy()
+    return (f.view(np.uint32)>>16).astype(np.uint16)
+  return t.to(wire_dtype).numpy()
+# end wireArray
+
+def wireTensor(a,wire_dtype):
+  """
+  A tensor with the values of a flat numpy array in the wire dtype, this
+  aliases the array unless the wire dtype is bfloat16.
+  """
+  if wire_dtype==torch.bfloat16:
+    return torch.from_numpy((a.astype(np.uint32)<<16).view(np.float32))
+  return torch.from_numpy(a)
+# end wireTensor
+
+cdef packTensors(char * buffer,int num_bytes,tensors,offsets,wire_dtypes):
+  """
+  Copy the tensors into the data section of a buffer, converting
+  to the wire dtypes. Offsets are relative to the buffer pointer.
+  """
+  if num_bytes==0:
+    return
+
+  raw = bufferArray(buffer,num_bytes)
+  for t,o,w in zip(tensors,offsets,wire_dtypes):
+    n = buffer_dtype_sizes[w]*t.numel()
+    dest = raw[o:o+n].view(buffer_numpy_dtypes[w])
+    if w==torch.bfloat16:
+      dest[:] = wireArray(t,w)
+    else:
+      torch.from_numpy(dest).copy_(t.detach().reshape(-1))
+# end packTensors
+
+cdef object unpackTensors(char * buffer,int num_bytes,shapes,dtypes,offsets,wire_dtypes,int num_state,pool):
+  """
+  Copy the data section of a buffer into tensors, converting from the wire 
+  dtypes. Offsets are relative to the buffer pointer. If the state tensors 
+  (the first num_state tensors) share a dtype they are views into a single 
+  allocation taken from the pool. Returns the tensors, and that allocation
+  (or None).
+  """
+  raw = bufferArray(buffer,num_bytes)
+
+  state_shapes = shapes[0:num_state]
+  state_wire_dtypes = set(wire_dtypes[0:num_state])
+
+  flat = None
+  if num_state>0 and len(set(dtypes[0:num_state]))==1:
+    flat = pool.acquire((sum([s.numel() for s in state_shapes]),),dtypes[0])
+
+    w = wire_dtypes[0]
+    if len(state_wire_dtypes)==1 and w!=torch.bfloat16:
+      # a single wire dtype, the state data is contiguous so copy it in one pass
+      n = buffer_dtype_sizes[w]*flat.numel()
+      flat.copy_(torch.from_numpy(raw[offsets[0]:offsets[0]+n].view(buffer_numpy_dtypes[w])))
+      state_wire_dtypes = None
+  
+  tens = []
+  beg = 0
+  for i,(s,d,o,w) in enumerate(zip(shapes,dtypes,offsets,wire_dtypes)):
+    if flat is not None and i<num_state:
+      t = flat[beg:beg+s.numel()].view(s)
+      beg += s.numel()
+      if state_wire_dtypes is None:
+        tens += [t]
+        continue
+    else:
+      t = torch.empty(s,dtype=d)
+
+    n = buffer_dtype_sizes[w]*s.numel()
+    t.view(-1).copy_(wireTensor(raw[o:o+n].view(buffer_numpy_dtypes[w]),w))
+    tens += [t]
+
+  return tens,flat
+# end unpackTensors
+
 cdef int my_bufpack(braid_App app, braid_Vector u, void *buffer,braid_BufferStatus status):
 
   # Convert void * to a double array (note fbuffer is a C-array, so no bounds checking is done) 
   cdef int * ibuffer
-  cdef float * fbuffer
   cdef char * cbuffer 
-  cdef np.ndarray[float,ndim=1] np_U
   cdef int offset
-  cdef int foffset
-  cdef int sz
+  cdef int data_offset
+  cdef int end
   cdef view.array my_buf 
 
   try:
     pyApp = <object> app
-    with pyApp.timer("bufpack"):
-      bv_u = <object> u
-    
+    bv_u = <object> u
+
+    with TraceContext(pyApp,bv_u.level()), pyApp.timer("bufpack"):
       ibuffer = <int *> buffer
     
       # write out the buffer meta data
       level              = bv_u.level()
-      num_tensors        = len(bv_u.allTensors())
-      num_weight_tensors = len(bv_u.weightTensors())
+      weight_version     = bv_u.weightVersion()
       layer_data_size    = pyApp.getLayerDataSize()
+      buffer_dtype       = pyApp.getBufferDType()
+
+      # weights the receiver already holds are not sent
+      send_weights = True
+      if weight_version is not None:
+        dest = pyApp.getMessageDestination(level)
+        send_weights = pyApp.shouldSendWeights(dest,level,weight_version)
+      if send_weights:
+        all_tensors = bv_u.allTensors()
+      else:
+        all_tensors = list(bv_u.tensors())
+
+      num_tensors        = len(all_tensors)
+      num_weight_tensors = len(all_tensors)-len(bv_u.tensors())
     
       # pack up layers
       pbuf_src = None
+      pbuf_size = 0
       if bv_u.getLayerData() is not None: 
         pbuf_src = pickle.dumps(bv_u.getLayerData()) 
+        pbuf_size = len(pbuf_src)
     
-        assert(layer_data_size>=len(pbuf_src))
+        assert(layer_data_size>=pbuf_size)
       # end if bv_u.getLayerData
     
+      shapes      = [t.size() for t in all_tensors]
+      wire_dtypes = [wireDType(t.dtype,buffer_dtype) for t in all_tensors]
+      data_offset,offsets,end = bufferLayout(shapes,wire_dtypes)
     
-      ibuffer[0] = level
-      ibuffer[1] = num_tensors
-      ibuffer[2] = num_weight_tensors
-      ibuffer[3] = layer_data_size
+      ibuffer[0] = BUFFER_FORMAT_VERSION
+      ibuffer[1] = level
+      ibuffer[2] = num_tensors
+      ibuffer[3] = num_weight_tensors
+      ibuffer[4] = pbuf_size
+      if weight_version is not None:
+        ibuffer[5],ibuffer[6],ibuffer[7] = weight_version
+      else:
+        ibuffer[5],ibuffer[6],ibuffer[7] = -1,-1,-1
+      ibuffer[8] = 1 if send_weights else 0
     
-      offset = 4 # this is accomdating space for the four integers
-      for t in bv_u.allTensors():
+      offset = BUFFER_HEADER_INTS # this is accomdating space for the header integers
+      for t,w in zip(all_tensors,wire_dtypes):
         size = t.size() 
-        ibuffer[offset] = len(size)
+        ibuffer[offset]   = len(size)
+        ibuffer[offset+1] = buffer_dtype_codes[t.dtype]
+        ibuffer[offset+2] = buffer_dtype_codes[w]
         for i,s in enumerate(size):
-          ibuffer[i+offset+1] = s
+          ibuffer[i+offset+3] = s
             
-        offset += len(size)+1
+        offset += len(size)+3
       # end for a: creating space for the number tensors
     
-      # copy the data
-      foffset = 0
-      fbuffer = <float *>(buffer+offset*sizeof(int)) 
-      for ten_U in bv_u.allTensors():
-        np_U  = ten_U.numpy().ravel() # ravel provides a flatten accessor to the array
-    
-        # copy the tensor into the buffer
-        sz = len(np_U)
-        my_buf = <float[:sz]> (fbuffer)
-        my_buf[:] = np_U
-    
-        # update the float buffer pointer
-        fbuffer = <float*> (fbuffer+sz)
-        foffset += sz
+      # copy the data: the data section of the buffer is wrapped as a 
+      # flat tensor, and all the tensors are copied into it
+      packTensors(<char *> buffer+data_offset,end-data_offset,
+                  all_tensors,[o-data_offset for o in offsets],wire_dtypes)
     
       if pbuf_src is not None:
-        cbuffer = <char *>(buffer+offset*sizeof(int)+foffset*sizeof(float)) 
+        cbuffer = <char *> buffer+end
     
         my_buf = <char[:len(pbuf_src)]> cbuffer
         my_buf[:] = pbuf_src
       # end if layer_data_size
 
+      # only send the bytes used (the status is null when called outside of braid)
+      if status!=NULL:
+        braid_BufferStatusSetSize(status,end+pbuf_size)
+
   except:
     output_exception("my_bufpack")
 
@@ -282,65 +551,77 @@ cdef int my_bufpack(braid_App app, braid_Vector u, void *buffer,braid_BufferStat
 
 cdef int my_bufunpack(braid_App app, void *buffer, braid_Vector *u_ptr,braid_BufferStatus status):
   cdef int * ibuffer 
-  cdef float * fbuffer 
-  cdef void * vbuffer 
-  cdef np.ndarray[float,ndim=1] np_U
+  cdef char * cbuffer 
   cdef int offset
-  cdef int sz
+  cdef int data_offset
+  cdef int end
   cdef view.array my_buf 
 
   try:
     pyApp = <object>app
-    with pyApp.timer("bufunpack"):
+
+    # the level is in the header (read below, after the version check)
+    ibuffer = <int *> buffer
+    with TraceContext(pyApp,ibuffer[1]), pyApp.timer("bufunpack"):
 
       # read in the buffer metda data
-      ibuffer = <int *> buffer
-    
-      level              = ibuffer[0]
-      num_tensors        = ibuffer[1]
-      num_weight_tensors = ibuffer[2]
-      layer_data_size    = ibuffer[3]
+      version = ibuffer[0]
+      if version!=BUFFER_FORMAT_VERSION:
+        raise RuntimeError('Buffer format version {} does not match expected version {}'.format(version,BUFFER_FORMAT_VERSION))
+
+      level              = ibuffer[1]
+      num_tensors        = ibuffer[2]
+      num_weight_tensors = ibuffer[3]
+      layer_data_size    = ibuffer[4]
+      weight_version     = (ibuffer[5],ibuffer[6],ibuffer[7])
+      weights_included   = ibuffer[8]==1
     
-      offset = 4
+      offset = BUFFER_HEADER_INTS
       sizes = []
+      dtypes = []
+      wire_dtypes = []
       for t in range(num_tensors):
         rank = ibuffer[offset]
+        dtypes += [buffer_dtypes[ibuffer[offset+1]]]
+        wire_dtypes += [buffer_dtypes[ibuffer[offset+2]]]
         size = rank*[0]
         for i in range(rank):
-          size[i] = ibuffer[i+offset+1]
+          size[i] = ibuffer[i+offset+3]
             
-        sizes += [size]
-        offset += len(size)+1
+        sizes += [torch.Size(size)]
+        offset += len(size)+3
+
+      # weights sent earlier should have been received, a miss leaves the vector 
+      # without weights and the run is repeated (see BraidApp.getReceivedWeights)
+      stored_weights = None
+      if weight_version[0]>=0 and not weights_included:
+        stored_weights = pyApp.getReceivedWeights(weight_version)
+
+      data_offset,offsets,end = bufferLayout(sizes,wire_dtypes)
     
       # build up the braid vector
-      tens = [torch.zeros(s) for s in sizes]
-      vector_tensors = tens[0:num_tensors-num_weight_tensors]
-      weight_tensors = tens[num_tensors-num_weight_tensors:]
+      num_state = num_tensors-num_weight_tensors
+      tens,storage = unpackTensors(<char *> buffer+data_offset,end-data_offset,
+                                   sizes,dtypes,[o-data_offset for o in offsets],wire_dtypes,
+                                   num_state,pyApp.getTensorPool())
+
+      vector_tensors = tens[0:num_state]
+      weight_tensors = tens[num_state:]
     
-      # build an vector object and set the tensors to land in the correct places
-      u_obj = BraidVector(tuple(vector_tensors),level)
+      # build an vector object and set the tensors to land in the correct places, 
+      # the state storage is returned to the pool when the vector is freed
+      u_obj = BraidVector(tuple(vector_tensors),level,pooled=storage is not None,storage=storage)
       Py_INCREF(u_obj) 
+      if stored_weights is not None:
+        weight_tensors = stored_weights
+      elif weight_version[0]>=0 and weights_included:
+        pyApp.storeReceivedWeights(weight_version,weight_tensors)
       u_obj.addWeightTensors(weight_tensors)
     
-      # copy from the buffer into the braid vector
-      fbuffer = <float *>(buffer+(offset)*sizeof(int)) # level, rank, sizes
-      for ten_U in u_obj.allTensors():
-        np_U = ten_U.numpy().ravel() # ravel provides a flatten accessor to the array
-      
-        # copy the buffer into the tensor
-        sz = len(np_U)
-        my_buf = <float[:sz]> (fbuffer)
-        np_U[:] = my_buf
-        
-        # update the float buffer pointer
-        fbuffer = <float*> (fbuffer+sz)
-    
       if layer_data_size>0:
+        cbuffer = <char *> buffer+end
     
-        # this is to make sure I can use the vbuffer
-        vbuffer = fbuffer
-    
-        my_buf = <char[:layer_data_size]> vbuffer
+        my_buf = <char[:layer_data_size]> cbuffer
         layer_data = pickle.loads(my_buf)
         u_obj.setLayerData(layer_data)
       # end if layer_data_size
@@ -354,36 +635,60 @@ cdef int my_bufunpack(braid_App app, void *buffer, braid_Vector *u_ptr,braid_Buf
 
   return 0
 
+cdef object spatialTransfer(op,vec,int level):
+  """
+  Apply a spatial operator to each state tensor of a vector. The weight
+  tensors and layer data are carried through to the new vector.
+  """
+  tensors = tuple([op(t,level) for t in vec.tensors()])
+  out = BraidVector(tensors,level)
+  out.addWeightTensors(vec.weightTensors())
+  out.setLayerData(vec.getLayerData())
+  out.setSendFlag(vec.getSendFlag())
+  return out
+# end spatialTransfer
+
 cdef int my_coarsen(braid_App app, braid_Vector fu, braid_Vector *cu_ptr, braid_CoarsenRefStatus status):
   cdef int level = -1
+  cdef int iteration = -1
+  cdef double t
 
-  pyApp  = <object> app
-  with pyApp.timer("coarsen"):
-    ten_fu =  (<object> fu).tensor()
-
+  try:
+    pyApp  = <object> app
     braid_CoarsenRefStatusGetLevel(status,&level)
+    braid_CoarsenRefStatusGetIter(status,&iteration)
+    braid_CoarsenRefStatusGetT(status,&t)
 
-    cu_mem = pyApp.spatial_coarse(ten_fu,level)
-    cu_vec = BraidVector(cu_mem,level)
-    Py_INCREF(cu_vec) # why do we need this?
+    with TraceContext(pyApp,level,t,t,iteration), pyApp.timer("coarsen"):
+      cu_vec = spatialTransfer(pyApp.spatial_coarse,<object> fu,level)
+      Py_INCREF(cu_vec) # why do we need this?
 
-    cu_ptr[0] = <braid_Vector> cu_vec
+      cu_ptr[0] = <braid_Vector> cu_vec
+  except:
+    output_exception("my_coarsen")
 
   return 0
 
 cdef int my_refine(braid_App app, braid_Vector cu, braid_Vector *fu_ptr, braid_CoarsenRefStatus status):
   cdef int level = -1
+  cdef int trace_level = -1
+  cdef int iteration = -1
+  cdef double t
 
-  pyApp  = <object> app
-  with pyApp.timer("refine"):
-    ten_cu =  (<object> cu).tensor()
+  try:
+    pyApp  = <object> app
+    braid_CoarsenRefStatusGetLevel(status,&trace_level)
+    braid_CoarsenRefStatusGetIter(status,&iteration)
+    braid_CoarsenRefStatusGetT(status,&t)
 
-    braid_CoarsenRefStatusGetNRefine(status,&level)
+    with TraceContext(pyApp,trace_level,t,t,iteration), pyApp.timer("refine"):
+      braid_CoarsenRefStatusGetNRefine(status,&level)
 
-    fu_mem = pyApp.spatial_refine(ten_cu,level)
-    fu_vec = BraidVector(fu_mem,level)
-    Py_INCREF(fu_vec) # why do we need this?
+      fu_vec = spatialTransfer(pyApp.spatial_refine,<object> cu,level)
+      Py_INCREF(fu_vec) # why do we need this?
 
-    fu_ptr[0] = <braid_Vector> fu_vec
+      fu_ptr[0] = <braid_Vector> fu_vec
+  except:
+    output_exception("my_refine")
 
   return 0
@@ -29,8 +29,12 @@
 # ************************************************************************
 #@HEADER
 
-from .context_timer import ContextTimer
+from .context_timer import ContextTimer, TimerStatistics
 from .context_timer_manager import ContextTimerManager
+from .tracer import Tracer
+from .tensor_pool import TensorPool
+from .primal_cache import PrimalCache, SavedTensorCounter
+from .spatial_ref import SpatialRefPair
 
 # import some useful helper functions
 from .functional import l2_reg
@@ -38,6 +42,8 @@ from .gittools import git_rev
 
 # import bufpackunpack tools
 from .bufpackunpack import buffer_size, pack_buffer, unpack_buffer
+from .neighbor_exchange import NeighborExchange, exchange_dtype
+from .gradient_allreduce import GradientAllreduce, split_communicator
 
 import gc
 import torch
@@ -46,13 +46,14 @@ def buffer_size(tens):
   return sum([t.shape.numel() for t in tens])
 # end buffer_size 
 
-def pack_buffer(tens):
+def pack_buffer(tens,buf=None):
   """
   Pack the list of tensors into a 1D array. This
   packing assumes that the unpack direction already
   has has sized tensors
 
   tens: Input tensor (single), or a list of tensors
+  buf: Optional preallocated 1D array to pack into (this is returned)
   """
 
   if isinstance(tens,torch.Tensor):
@@ -61,10 +62,12 @@ def pack_buffer(tens):
   # flatten array and shove it into a flat buffer
   beg = 0
   end = 0
-  buf = np.zeros(buffer_size(tens))
+  if buf is None:
+    buf = np.zeros(buffer_size(tens))
   for t in tens:
     end += t.shape.numel()
-    buf[beg:end] = t.view(-1)[:]
+    # copy through torch, the buffer and tensor dtypes may differ (e.g. bfloat16)
+    torch.from_numpy(buf[beg:end]).copy_(t.detach().reshape(-1))
     beg = end
 
   return buf
@@ -86,7 +89,7 @@ def unpack_buffer(tens,buf):
   end = 0
   for t in tens:
     end += t.shape.numel()
-    t.view(-1).numpy()[:] = buf[beg:end]
+    t.data.view(-1).copy_(torch.from_numpy(buf[beg:end]))
     beg = end
 
 # end unpack_buffer
@@ -31,14 +31,56 @@
 
 from timeit import default_timer as timer
 
+import math
+
+class TimerStatistics:
+  """
+  Streaming statistics of a sequence of times: the count, total, min, max and
+  variance (using Welford's algorithm) are updated in constant memory.
+  """
+  def __init__(self):
+    self.count = 0
+    self.total = 0.0
+    self.min   = math.inf
+    self.max   = 0.0
+    self.mean  = 0.0
+    self.m2    = 0.0
+
+  def add(self,t):
+    self.count += 1
+    self.total += t
+    self.min    = min(self.min,t)
+    self.max    = max(self.max,t)
+
+    delta = t-self.mean
+    self.mean += delta/self.count
+    self.m2   += delta*(t-self.mean)
+
+  def getStdev(self):
+    if self.count>1:
+      return math.sqrt(self.m2/(self.count-1))
+    return 0.0
+
+  def asDict(self):
+    return {'count' : self.count,
+            'total' : self.total,
+            'mean'  : self.mean,
+            'stdev' : self.getStdev(),
+            'min'   : self.min if self.count>0 else 0.0,
+            'max'   : self.max}
+# end TimerStatistics
+
 class ContextTimer:
-  def __init__(self,name):
-    self.name   = name
-    self.times  = []
-    self.timing = False 
+  def __init__(self,name,manager=None):
+    self.name    = name
+    self.stats   = TimerStatistics()
+    self.timing  = False 
+    self.manager = manager
 
   def __enter__(self):
     self.timing = True
+    if self.manager is not None:
+      self.manager.enterScope(self)
     self.start_time = timer()
     return self
 
@@ -46,7 +88,10 @@ class ContextTimer:
     self.end_time = timer()
     self.timing = False
 
-    self.times += [ self.end_time-self.start_time ] 
+    elapsed = self.end_time-self.start_time
+    self.stats.add(elapsed)
+    if self.manager is not None:
+      self.manager.exitScope(self,self.start_time,self.end_time)
     return except_type==None
 
   def getName(self):
@@ -55,5 +100,44 @@ class ContextTimer:
   def isTiming(self):
     return self.timing
 
-  def getTimes(self):
-    return self.times
+  def getStatistics(self):
+    return self.stats
+
+  def getCount(self):
+    return self.stats.count
+
+  def getTotal(self):
+    return self.stats.total
+
+  def getMean(self):
+    return self.stats.mean
+
+  def getStdev(self):
+    return self.stats.getStdev()
+
+  def getMin(self):
+    return self.stats.min
+
+  def getMax(self):
+    return self.stats.max
+# end ContextTimer
+
+class NullTimer:
+  """
+  A timer that records nothing, returned by a disabled ContextTimerManager.
+  """
+  def __init__(self,name):
+    self.name = name
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self,except_type,except_value,except_traceback):
+    return except_type==None
+
+  def getName(self):
+    return self.name
+
+  def isTiming(self):
+    return False
+# end NullTimer
@@ -29,62 +29,249 @@
 # ************************************************************************
 #@HEADER
 
-from .context_timer import ContextTimer
+from .context_timer import ContextTimer, NullTimer, TimerStatistics
+from .tracer import Tracer
 
-import statistics as stats
+import json
+import numpy as np
+
+from mpi4py import MPI
 
 class ContextTimerManager:
   def __init__(self):
-    self.timers = dict()
+    self.timers  = dict()
+    self.enabled = True
+    self.tracer  = None
+    self.resetTimers()
 
   def resetTimers(self):
     self.timers = dict()
 
+    # call tree: maps the path of nested timer names to its statistics
+    self.tree   = dict()
+    self.scopes = []
+
+  def setEnabled(self,enabled):
+    """
+    Enable or disable timing. When disabled, timer returns a timer that records
+    nothing, and the braid step callback skips timing altogether.
+    """
+    self.enabled = enabled
+
+  def isEnabled(self):
+    return self.enabled
+
+  def enableTracing(self,capacity=65536):
+    """
+    Record every timed event into a Tracer with a ring buffer of the given capacity.
+    """
+    self.tracer = Tracer(capacity)
+
+  def disableTracing(self):
+    self.tracer = None
+
+  def getTracer(self):
+    return self.tracer
+
   def timer(self,name): 
+    if not self.enabled:
+      return NullTimer(name)
+
     if name in self.timers:
       timer_obj = self.timers[name]
     else:
-      timer_obj = ContextTimer(name) 
+      timer_obj = ContextTimer(name,self) 
       self.timers[name] = timer_obj
 
     return timer_obj
   # end timer
 
+  def enterScope(self,timer_obj):
+    self.scopes.append(timer_obj.getName())
+
+  def exitScope(self,timer_obj,start,stop):
+    elapsed = stop-start
+    if self.tracer is not None:
+      self.tracer.record(timer_obj.getName(),start,stop)
+
+    path = tuple(self.scopes)
+
+    # unwind to the scope being exited (robust to mismatched exits)
+    name = timer_obj.getName()
+    while len(self.scopes)>0 and self.scopes.pop()!=name:
+      path = tuple(self.scopes)
+
+    if len(path)==0:
+      return
+
+    if path not in self.tree:
+      self.tree[path] = TimerStatistics()
+    self.tree[path].add(elapsed)
+  # end exitScope
+
   def getTimers(self):
     return list(self.timers.values())
+
+  def getResultDict(self):
+    """
+    Get the timer statistics as a dictionary. The entry 'timers' maps each timer
+    name to its statistics, the entry 'tree' holds the call tree of nested timers,
+    each node holding its statistics and a 'children' dictionary.
+    """
+    timers = {name : timer.getStatistics().asDict() for name,timer in self.timers.items()}
+
+    tree = dict()
+    for path in sorted(self.tree.keys()):
+      children = tree
+      for name in path[:-1]:
+        children = children.setdefault(name,{'children' : dict()})['children']
+      node = children.setdefault(path[-1],{'children' : dict()})
+      node.update(self.tree[path].asDict())
+
+    return {'timers' : timers, 'tree' : tree}
+  # end getResultDict
+
+  def getResultJSON(self,**kwargs):
+    return json.dumps(self.getResultDict(),**kwargs)
  
   def getResultString(self):
     max_width = len("name")
     for name,timer in self.timers.items():
       max_width = max(max_width,len(name))
 
-    str_format = "  {name:<{width}} || {count:^16d} | {total:^16.4e} | {mean:^16.4e} | {stdev:^16.4e} |\n" 
+    str_format = "  {name:<{width}} || {count:^16d} | {total:^16.4e} | {mean:^16.4e} | {stdev:^16.4e} | {min:^16.4e} | {max:^16.4e} |\n" 
 
     result = ""
-    result +=    "  {name:^{width}} || {count:^16} | {total:^16} | {mean:^16} | {stdev:^16} |\n".format(name="timer",
+    result +=    "  {name:^{width}} || {count:^16} | {total:^16} | {mean:^16} | {stdev:^16} | {min:^16} | {max:^16} |\n".format(name="timer",
                                                                                           count="count",
                                                                                           total="total",
                                                                                           mean="mean",
                                                                                           stdev="stdev",
+                                                                                          min="min",
+                                                                                          max="max",
                                                                                           width=max_width)
     result += "======================================================\n"
 
     keys = list(self.timers.keys())
     keys.sort()
     for name in keys:
-      timer = self.timers[name]
-      times = timer.getTimes()
-      mean  = stats.mean(times)
-      total  = sum(times)
+      stats = self.timers[name].getStatistics().asDict()
+      result += str_format.format(name=name,width=max_width,**stats)
+
+    return result
+  # end getResultString
+
+  def reduceTimers(self,comm):
+    """
+    Reduce the timers across the ranks of a communicator (this is collective). 
+    Returns a dictionary mapping each timer name to the summed count and total,
+    the min and max of a single timing, the average, min and max of the per rank
+    totals, the imbalance ratio (max total/average total) and the slowest rank.
+    """
+    num_ranks = comm.Get_size()
+    my_rank   = comm.Get_rank()
+
+    # not every rank needs to have every timer
+    names = set()
+    for remote_names in comm.allgather(list(self.timers.keys())):
+      names.update(remote_names)
+    names = sorted(names)
 
-      if len(times)>1:
-        stdev = stats.stdev(times)
-      else:
-        stdev = 0.0
+    count = np.zeros(len(names))
+    total = np.zeros(len(names))
+    t_min = np.full(len(names),np.inf)
+    t_max = np.zeros(len(names))
+    for i,name in enumerate(names):
+      if name in self.timers:
+        stats = self.timers[name].getStatistics()
+        count[i] = stats.count
+        total[i] = stats.total
+        t_min[i] = stats.min
+        t_max[i] = stats.max
 
-      result += str_format.format(name=name,count=len(times),total=total,mean=mean,stdev=stdev,width=max_width)
+    sum_count = np.zeros(len(names))
+    sum_total = np.zeros(len(names))
+    min_total = np.zeros(len(names))
+    max_total = np.zeros(len(names))
+    min_time  = np.zeros(len(names))
+    max_time  = np.zeros(len(names))
+    comm.Allreduce(count,sum_count,op=MPI.SUM)
+    comm.Allreduce(total,sum_total,op=MPI.SUM)
+    comm.Allreduce(total,min_total,op=MPI.MIN)
+    comm.Allreduce(total,max_total,op=MPI.MAX)
+    comm.Allreduce(t_min,min_time,op=MPI.MIN)
+    comm.Allreduce(t_max,max_time,op=MPI.MAX)
+
+    # the slowest rank is the lowest rank with the max total
+    slowest = np.where(total==max_total,my_rank,num_ranks).astype(np.int64)
+    slowest_rank = np.zeros(len(names),dtype=np.int64)
+    comm.Allreduce(slowest,slowest_rank,op=MPI.MIN)
+
+    result = dict()
+    for i,name in enumerate(names):
+      avg_total = sum_total[i]/num_ranks
+      result[name] = {'count'        : int(sum_count[i]),
+                      'total'        : sum_total[i],
+                      'min'          : min_time[i] if sum_count[i]>0 else 0.0,
+                      'max'          : max_time[i],
+                      'avg_total'    : avg_total,
+                      'min_total'    : min_total[i],
+                      'max_total'    : max_total[i],
+                      'imbalance'    : max_total[i]/avg_total if avg_total>0.0 else 1.0,
+                      'slowest_rank' : int(slowest_rank[i])}
 
     return result
-  # end getResultString
+  # end reduceTimers
+
+  def getReducedResultString(self,comm):
+    """
+    Get a table of the timers reduced across the communicator (this is collective).
+    """
+    reduced = self.reduceTimers(comm)
+
+    max_width = len("name")
+    for name in reduced.keys():
+      max_width = max(max_width,len(name))
+
+    str_format = "  {name:<{width}} || {count:^16d} | {avg_total:^16.4e} | {min_total:^16.4e} | {max_total:^16.4e} | {imbalance:^16.4f} | {slowest_rank:^16d} |\n" 
+
+    result = ""
+    result += "  {name:^{width}} || {count:^16} | {avg:^16} | {min:^16} | {max:^16} | {imb:^16} | {slow:^16} |\n".format(name="timer",
+                                                                                          count="count",
+                                                                                          avg="avg total",
+                                                                                          min="min total",
+                                                                                          max="max total",
+                                                                                          imb="imbalance",
+                                                                                          slow="slowest rank",
+                                                                                          width=max_width)
+    result += "======================================================\n"
+
+    for name,stats in reduced.items():
+      result += str_format.format(name=name,width=max_width,**stats)
+
+    return result
+  # end getReducedResultString
+
+  def getTreeString(self):
+    """
+    Get the call tree of nested timers as an indented string.
+    """
+    str_format = "  {name:<{width}} || {count:^16d} | {total:^16.4e} |\n" 
+
+    paths = sorted(self.tree.keys())
+    max_width = len("name")
+    for path in paths:
+      max_width = max(max_width,2*(len(path)-1)+len(path[-1]))
+
+    result = ""
+    result += "  {name:^{width}} || {count:^16} | {total:^16} |\n".format(name="timer",count="count",total="total",width=max_width)
+    result += "======================================================\n"
+    for path in paths:
+      stats = self.tree[path]
+      name = "  "*(len(path)-1)+path[-1]
+      result += str_format.format(name=name,count=stats.count,total=stats.total,width=max_width)
+
+    return result
+  # end getTreeString
 
 # end ContextTimerManager
@@ -0,0 +1,137 @@
+#@HEADER
+# ************************************************************************
+# 
+#                        Torchbraid v. 0.1
+# 
+# Copyright 2020 National Technology & Engineering Solutions of Sandia, LLC 
+# (NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S. 
+# Government retains certain rights in this software.
+# 
+# Torchbraid is licensed under 3-clause BSD terms of use:
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+# 
+# 3. Neither the name National Technology & Engineering Solutions of Sandia, 
+# LLC nor the names of the contributors may be used to endorse or promote 
+# products derived from this software without specific prior written permission.
+# 
+# Questions? Contact Eric C. Cyr (eccyr@sandia.gov)
+# 
+# ************************************************************************
+#@HEADER
+
+import torch
+
+from mpi4py import MPI
+
+def split_communicator(comm,time_procs):
+  """
+  Split a communicator for hybrid data and layer parallelism. The ranks are
+  arranged in a grid with time_procs contiguous ranks in each time parallel 
+  communicator, ranks with the same position in time form a data parallel 
+  communicator.
+
+  returns: (time_comm,data_comm)
+  """
+  rank = comm.Get_rank()
+  size = comm.Get_size()
+  if size % time_procs!=0:
+    raise ValueError('Communicator size {} is not divisible by the {} time parallel ranks'.format(size,time_procs))
+
+  time_comm = comm.Split(color=rank // time_procs,key=rank)
+  data_comm = comm.Split(color=rank % time_procs,key=rank)
+
+  return time_comm,data_comm
+# end split_communicator
+
+class PendingAllreduce:
+  """
+  A bucketed, nonblocking allreduce in flight, call wait to get the averaged tensors.
+  """
+  def __init__(self,comm,tensors,bucket_bytes):
+    self.size    = comm.Get_size()
+    self.tensors = list(tensors)
+    self.buckets = []
+
+    # group consecutive tensors of the same dtype (None entries are skipped)
+    bucket = []
+    nbytes = 0
+    for i,t in enumerate(self.tensors):
+      if t is None:
+        continue
+      if len(bucket)>0 and (t.dtype!=self.tensors[bucket[0]].dtype or nbytes>=bucket_bytes):
+        self.startBucket(comm,bucket)
+        bucket = []
+        nbytes = 0
+      bucket += [i]
+      nbytes += t.numel()*t.element_size()
+
+    if len(bucket)>0:
+      self.startBucket(comm,bucket)
+  # end __init__
+
+  def startBucket(self,comm,indices):
+    # numpy (and so MPI) has no bfloat16, these are reduced in single precision
+    dtype = self.tensors[indices[0]].dtype
+    wire_dtype = torch.float32 if dtype==torch.bfloat16 else dtype
+
+    flat = torch.cat([self.tensors[i].detach().reshape(-1).to(wire_dtype) for i in indices])
+    request = comm.Iallreduce(MPI.IN_PLACE,flat.numpy(),op=MPI.SUM)
+    self.buckets += [(flat,indices,request)]
+
+  def wait(self):
+    result = list(self.tensors)
+    for flat,indices,request in self.buckets:
+      request.Wait()
+      flat.div_(self.size)
+
+      offset = 0
+      for i in indices:
+        t = self.tensors[i]
+        result[i] = flat[offset:offset+t.numel()].view(t.size()).to(t.dtype)
+        offset += t.numel()
+
+    self.buckets = []
+    return result
+  # end wait
+# end PendingAllreduce
+
+class GradientAllreduce:
+  """
+  Averages gradients over a data parallel communicator. The tensors are packed into
+  buckets of about bucket_bytes, each bucket is reduced with a nonblocking allreduce
+  so the reductions overlap with each other and with other work.
+  """
+  def __init__(self,comm,bucket_bytes=2**22):
+    self.comm = comm
+    self.bucket_bytes = bucket_bytes
+
+  def getMPIComm(self):
+    return self.comm
+
+  def start(self,tensors):
+    """
+    Start averaging a list of tensors (None entries are left as None), returns a
+    PendingAllreduce.
+    """
+    return PendingAllreduce(self.comm,tensors,self.bucket_bytes)
+
+  def averageGradients(self,parameters):
+    """
+    Average the gradients of parameters in place, this is useful for the parts of 
+    a network outside of the layer parallel modules.
+    """
+    params = [p for p in parameters if p.grad is not None]
+    averaged = self.start([p.grad for p in params]).wait()
+    for p,g in zip(params,averaged):
+      p.grad.copy_(g)
+# end GradientAllreduce
@@ -0,0 +1,133 @@
+#@HEADER
+# ************************************************************************
+# 
+#                        Torchbraid v. 0.1
+# 
+# Copyright 2020 National Technology & Engineering Solutions of Sandia, LLC 
+# (NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S. 
+# Government retains certain rights in this software.
+# 
+# Torchbraid is licensed under 3-clause BSD terms of use:
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+# 
+# 3. Neither the name National Technology & Engineering Solutions of Sandia, 
+# LLC nor the names of the contributors may be used to endorse or promote 
+# products derived from this software without specific prior written permission.
+# 
+# Questions? Contact Eric C. Cyr (eccyr@sandia.gov)
+# 
+# ************************************************************************
+#@HEADER
+
+import torch
+import numpy as np
+
+from mpi4py import MPI
+
+from .bufpackunpack import pack_buffer, unpack_buffer
+
+def exchange_dtype(tensors):
+  """
+  The dtype to exchange a list of tensors in: the dtype of the floating 
+  point tensors (the parameters), float64 if there are none or they differ.
+  """
+  dtypes = set([t.dtype for t in tensors if t.is_floating_point()])
+  if len(dtypes)==1:
+    return dtypes.pop()
+  return torch.float64
+# end exchange_dtype
+
+def numpy_dtype(dtype):
+  """
+  The numpy dtype of a buffer holding a torch dtype. Numpy has no
+  bfloat16, those are widened to float32.
+  """
+  if dtype==torch.bfloat16:
+    return np.float32
+  return torch.empty(0,dtype=dtype).numpy().dtype
+# end numpy_dtype
+
+class NeighborExchange:
+  """
+  A nonblocking exchange of a fixed layout of tensors with neighboring
+  ranks. The buffers and the (persistent) MPI requests are built once, 
+  each exchange packs the tensors, starts the requests and unpacks the
+  received buffer when it is completed.
+  """
+
+  def __init__(self,comm,send_shapes,dest,recv_shapes,source,tag,dtype=torch.float64):
+    """
+    comm: Communicator to use
+    send_shapes: Shapes of the tensors to send (ignored if dest is None)
+    dest: Rank to send to, None if nothing is sent
+    recv_shapes: Shapes of the tensors to receive (ignored if source is None)
+    source: Rank to receive from, None if nothing is received
+    tag: MPI tag for the messages
+    dtype: Torch dtype of the buffers (see exchange_dtype)
+    """
+    # the messages are sent as bytes, MPI has no half precision type
+    np_dtype = numpy_dtype(dtype)
+
+    self.requests = []
+
+    self.send_buf = None
+    if dest is not None:
+      self.send_buf = np.empty(sum([s.numel() for s in send_shapes]),dtype=np_dtype)
+      self.requests += [comm.Send_init([self.send_buf,MPI.BYTE],dest=dest,tag=tag)]
+
+    self.recv_buf = None
+    if source is not None:
+      self.recv_buf = np.empty(sum([s.numel() for s in recv_shapes]),dtype=np_dtype)
+      self.requests += [comm.Recv_init([self.recv_buf,MPI.BYTE],source=source,tag=tag)]
+
+    self.active = False
+  # end __init__
+
+  def start(self,send_tensors=None):
+    """
+    Pack the tensors to send, and start the exchange.
+    """
+    assert(not self.active)
+
+    if self.send_buf is not None:
+      pack_buffer(send_tensors,self.send_buf)
+
+    MPI.Prequest.Startall(self.requests)
+    self.active = True
+
+  def isActive(self):
+    return self.active
+
+  def wait(self,recv_tensors=None):
+    """
+    Complete the exchange, and unpack into the received tensors (if
+    they are specified).
+    """
+    if not self.active:
+      return
+
+    MPI.Prequest.Waitall(self.requests)
+    self.active = False
+
+    if self.recv_buf is not None and recv_tensors is not None:
+      unpack_buffer(recv_tensors,self.recv_buf)
+
+  def getRecvBuffer(self):
+    return self.recv_buf
+
+  def free(self):
+    self.wait()
+    for r in self.requests:
+      r.Free()
+    self.requests = []
+# end NeighborExchange
@@ -0,0 +1,178 @@
+#@HEADER
+# ************************************************************************
+# 
+#                        Torchbraid v. 0.1
+# 
+# Copyright 2020 National Technology & Engineering Solutions of Sandia, LLC 
+# (NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S. 
+# Government retains certain rights in this software.
+# 
+# Torchbraid is licensed under 3-clause BSD terms of use:
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+# 
+# 3. Neither the name National Technology & Engineering Solutions of Sandia, 
+# LLC nor the names of the contributors may be used to endorse or promote 
+# products derived from this software without specific prior written permission.
+# 
+# Questions? Contact Eric C. Cyr (eccyr@sandia.gov)
+# 
+# ************************************************************************
+#@HEADER
+
+import torch
+
+class PrimalCache:
+  """
+  Stores the forward graphs (output and input tensors) of the fine level time
+  steps, so the adjoint can be computed without recomputing the forward step.
+  The policy selects what is stored:
+
+    'none'  - nothing is stored, the steps are recomputed from the states 
+              braid keeps at every fine grid point (default)
+    'all'   - the graphs of all steps are stored
+    k (int) - the input states of every k-th step are stored as checkpoints,
+              and braid only keeps the C-point states. A step missing from
+              the cache is recomputed with the rest of its segment (from the
+              checkpoint before it), the graphs of the segment are kept until
+              the next segment is recomputed.
+
+  If a memory budget (in bytes) is specified, steps are only stored while
+  the estimated size of the cache is below the budget. The hits and misses
+  count the lookups since the last call to resetStatistics.
+  """
+
+  def __init__(self,policy='none',budget=None):
+    self.setPolicy(policy,budget)
+    self.clear()
+    self.resetStatistics()
+
+  def setPolicy(self,policy,budget=None):
+    if policy not in ['none','all'] and not (isinstance(policy,int) and policy>0):
+      raise ValueError('Primal cache policy must be \'none\', \'all\' or a positive integer, found \'{}\''.format(policy))
+
+    self.policy = policy
+    self.budget = budget
+
+  def getPolicy(self):
+    return self.policy
+
+  def enabled(self):
+    return self.policy!='none'
+
+  def usesCheckpoints(self):
+    return self.policy not in ['none','all']
+
+  def shouldStore(self,index):
+    """
+    Should the step with this (global) index be stored, as a graph or as
+    a checkpoint.
+    """
+    if self.policy=='none':
+      return False
+    if self.budget is not None and self.nbytes>=self.budget:
+      return False
+    if self.policy=='all':
+      return True
+    return index % self.policy == 0
+
+  def store(self,key,y,x,nbytes):
+    self.entries[key] = (y,x)
+    self.nbytes += nbytes
+
+  def storeCheckpoint(self,index,x):
+    self.checkpoints[index] = x
+    self.nbytes += x.numel()*x.element_size()
+
+  def getCheckpoint(self,index):
+    """
+    Get the last checkpoint at or before the step with this (global) index as
+    an (index,state) pair, returns None if there is none.
+    """
+    stored = [i for i in self.checkpoints if i<=index]
+    if len(stored)==0:
+      return None
+    return max(stored),self.checkpoints[max(stored)]
+
+  def storeSegment(self,entries):
+    """
+    Store the recomputed graphs of a segment (a dictionary from keys to (y,x) 
+    pairs), replacing the graphs of the previous segment.
+    """
+    for key in self.segment:
+      del self.entries[key]
+    self.entries.update(entries)
+    self.segment = list(entries.keys())
+
+  def get(self,key):
+    """
+    Get the stored (y,x) pair for this key, returns None if it is not stored.
+    """
+    entry = self.entries.get(key)
+    if entry is None:
+      self.misses += 1
+    else:
+      self.hits += 1
+    return entry
+
+  def clear(self):
+    self.entries = dict()
+    self.checkpoints = dict()
+    self.segment = []
+    self.nbytes = 0
+
+  def resetStatistics(self):
+    self.hits = 0
+    self.misses = 0
+
+  def getStatistics(self):
+    return { 'entries'     : len(self.entries),
+             'checkpoints' : len(self.checkpoints),
+             'bytes'       : self.nbytes,
+             'hits'        : self.hits,
+             'misses'      : self.misses }
+# end PrimalCache
+
+class SavedTensorCounter:
+  """
+  Context manager estimating the memory used by a graph, this counts the bytes 
+  of the tensors saved by autograd for the backward pass. If saved tensor hooks
+  are not available in this version of pytorch, nothing is counted.
+  """
+
+  def __init__(self):
+    self.nbytes = 0
+    self.seen = set()
+    self.hooks = None
+    if hasattr(torch.autograd,'graph') and hasattr(torch.autograd.graph,'saved_tensors_hooks'):
+      self.hooks = torch.autograd.graph.saved_tensors_hooks(self.pack,self.unpack)
+
+  def pack(self,t):
+    key = (t.data_ptr(),t.numel())
+    if key not in self.seen:
+      self.seen.add(key)
+      self.nbytes += t.numel()*t.element_size()
+    return t
+
+  def unpack(self,t):
+    return t
+
+  def __enter__(self):
+    if self.hooks is not None:
+      self.hooks.__enter__()
+    return self
+
+  def __exit__(self,except_type,except_value,except_traceback):
+    if self.hooks is not None:
+      self.hooks.__exit__(except_type,except_value,except_traceback)
+    return except_type==None
+# end SavedTensorCounter
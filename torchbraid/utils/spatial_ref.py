@@ -0,0 +1,82 @@
+#@HEADER
+# ************************************************************************
+# 
+#                        Torchbraid v. 0.1
+# 
+# Copyright 2020 National Technology & Engineering Solutions of Sandia, LLC 
+# (NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S. 
+# Government retains certain rights in this software.
+# 
+# Torchbraid is licensed under 3-clause BSD terms of use:
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+# 
+# 3. Neither the name National Technology & Engineering Solutions of Sandia, 
+# LLC nor the names of the contributors may be used to endorse or promote 
+# products derived from this software without specific prior written permission.
+# 
+# Questions? Contact Eric C. Cyr (eccyr@sandia.gov)
+# 
+# ************************************************************************
+#@HEADER
+
+import torch
+import torch.nn.functional as F
+
+class SpatialRefPair:
+  """
+  Spatial coarsening and refinement operators for NCHW feature maps, these 
+  are passed as the spatial_ref_pair argument of LayerParallel. Restriction
+  averages over factor x factor blocks, prolongation interpolates with the
+  'bilinear' or 'nearest' mode. Tensors that are not 4D (e.g. auxiliary 
+  state) are copied unchanged.
+
+  The object unpacks like the (coarsen,refine) tuple it replaces.
+  """
+
+  def __init__(self,factor=2,mode='bilinear'):
+    if mode not in ['bilinear','nearest']:
+      raise ValueError('SpatialRefPair: mode must be "bilinear" or "nearest" ("{}" was used)'.format(mode))
+    if factor<1:
+      raise ValueError('SpatialRefPair: factor must be positive ({} was used)'.format(factor))
+
+    self.factor = factor
+    self.mode = mode
+
+    # coarse spatial shape -> fine spatial shape, so odd sizes are refined back exactly
+    self.fine_shapes = dict()
+
+  def __iter__(self):
+    return iter((self.coarsen,self.refine))
+
+  def isSpatial(self,x):
+    return x.dim()==4
+
+  def coarsen(self,x,level):
+    if not self.isSpatial(x) or self.factor==1:
+      return x.detach().clone()
+
+    # ceil_mode keeps a (partial) block at odd edges
+    xc = F.avg_pool2d(x.detach(),self.factor,ceil_mode=True,count_include_pad=False)
+    self.fine_shapes[xc.shape[2:]] = x.shape[2:]
+    return xc
+
+  def refine(self,x,level):
+    if not self.isSpatial(x) or self.factor==1:
+      return x.detach().clone()
+
+    coarse_shape = x.shape[2:]
+    fine_shape = self.fine_shapes.get(coarse_shape,torch.Size([self.factor*s for s in coarse_shape]))
+    if self.mode=='bilinear':
+      return F.interpolate(x.detach(),size=fine_shape,mode='bilinear',align_corners=False)
+    return F.interpolate(x.detach(),size=fine_shape,mode='nearest')
+# end SpatialRefPair
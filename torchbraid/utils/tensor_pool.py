@@ -0,0 +1,129 @@
+#@HEADER
+# ************************************************************************
+# 
+#                        Torchbraid v. 0.1
+# 
+# Copyright 2020 National Technology & Engineering Solutions of Sandia, LLC 
+# (NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S. 
+# Government retains certain rights in this software.
+# 
+# Torchbraid is licensed under 3-clause BSD terms of use:
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+# 
+# 3. Neither the name National Technology & Engineering Solutions of Sandia, 
+# LLC nor the names of the contributors may be used to endorse or promote 
+# products derived from this software without specific prior written permission.
+# 
+# Questions? Contact Eric C. Cyr (eccyr@sandia.gov)
+# 
+# ************************************************************************
+#@HEADER
+
+import torch
+
+class TensorPool:
+  """
+  A free list of tensors keyed by shape and dtype. Tensors released to the
+  pool are handed back out by acquire, this avoids churning large allocations
+  through the allocator. The total number of bytes held by the pool can be
+  limited by a high water mark, tensors released beyond this are dropped.
+  """
+
+  def __init__(self,high_water=None):
+    """
+    high_water: Maximum number of bytes held in the free lists, None is unlimited
+    """
+    self.high_water = high_water
+    self.free_lists = dict()
+    self.held_bytes = 0
+
+    self.resetStatistics()
+
+  def resetStatistics(self):
+    self.hits       = 0
+    self.misses     = 0
+    self.releases   = 0
+    self.drops      = 0
+    self.peak_bytes = self.held_bytes
+
+  def setHighWaterMark(self,high_water):
+    self.high_water = high_water
+
+    # drop anything beyond the new mark
+    if high_water is not None:
+      for key,free in self.free_lists.items():
+        while len(free)>0 and self.held_bytes>high_water:
+          self.held_bytes -= tensorBytes(free.pop())
+          self.drops += 1
+
+  def getHighWaterMark(self):
+    return self.high_water
+
+  def acquire(self,shape,dtype=torch.float32):
+    """
+    Get a tensor of the requested shape and dtype. Note that the values
+    of the tensor are not initialized.
+    """
+    key = (torch.Size(shape),dtype)
+
+    free = self.free_lists.get(key)
+    if free:
+      t = free.pop()
+      self.held_bytes -= tensorBytes(t)
+      self.hits += 1
+      return t
+
+    self.misses += 1
+    return torch.empty(shape,dtype=dtype)
+
+  def release(self,tensor):
+    """
+    Return a tensor to the pool. The caller must make sure
+    no other references to the tensor (or its storage) are used.
+    """
+    nbytes = tensorBytes(tensor)
+    if self.high_water is not None and self.held_bytes+nbytes>self.high_water:
+      self.drops += 1
+      return
+
+    key = (tensor.size(),tensor.dtype)
+    self.free_lists.setdefault(key,[]).append(tensor)
+
+    self.held_bytes += nbytes
+    self.peak_bytes = max(self.peak_bytes,self.held_bytes)
+    self.releases += 1
+
+  def clear(self):
+    self.free_lists = dict()
+    self.held_bytes = 0
+
+  def getStatistics(self):
+    return { 'hits'       : self.hits,
+             'misses'     : self.misses,
+             'releases'   : self.releases,
+             'drops'      : self.drops,
+             'held_bytes' : self.held_bytes,
+             'peak_bytes' : self.peak_bytes }
+
+  def getResultString(self):
+    stats = self.getStatistics()
+    total = stats['hits']+stats['misses']
+    rate = stats['hits']/total if total>0 else 0.0
+    result  = "  tensor pool: hits = {}, misses = {} (hit rate {:.2f})\n".format(stats['hits'],stats['misses'],rate)
+    result += "               releases = {}, drops = {}\n".format(stats['releases'],stats['drops'])
+    result += "               held = {:.2f} MiB, peak = {:.2f} MiB\n".format(stats['held_bytes']/2**20,stats['peak_bytes']/2**20)
+    return result
+# end TensorPool
+
+def tensorBytes(tensor):
+  return tensor.numel()*tensor.element_size()
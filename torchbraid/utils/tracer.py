@@ -0,0 +1,159 @@
+#@HEADER
+# ************************************************************************
+# 
+#                        Torchbraid v. 0.1
+# 
+# Copyright 2020 National Technology & Engineering Solutions of Sandia, LLC 
+# (NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S. 
+# Government retains certain rights in this software.
+# 
+# Torchbraid is licensed under 3-clause BSD terms of use:
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+# 
+# 3. Neither the name National Technology & Engineering Solutions of Sandia, 
+# LLC nor the names of the contributors may be used to endorse or promote 
+# products derived from this software without specific prior written permission.
+# 
+# Questions? Contact Eric C. Cyr (eccyr@sandia.gov)
+# 
+# ************************************************************************
+#@HEADER
+
+import json
+import numpy as np
+
+from timeit import default_timer as timer
+
+class Tracer:
+  """
+  Records the start and stop times of events (for instance the braid callbacks)
+  into a preallocated ring buffer, once the buffer is full the oldest events are
+  overwritten. Events carry the braid context (level, tstart, tstop and iteration)
+  set when they are recorded, use setContext to set it within a step. The per rank
+  buffers can be merged into a Chrome/Perfetto trace.
+  """
+  def __init__(self,capacity=65536):
+    self.capacity = capacity
+
+    self.start     = np.zeros(capacity)
+    self.stop      = np.zeros(capacity)
+    self.names     = np.zeros(capacity,dtype=np.int32)
+    self.level     = np.zeros(capacity,dtype=np.int32)
+    self.tstart    = np.zeros(capacity)
+    self.tstop     = np.zeros(capacity)
+    self.iteration = np.zeros(capacity,dtype=np.int32)
+
+    self.name_ids   = dict()
+    self.name_list  = []
+    self.clear()
+
+  def clear(self):
+    self.head    = 0
+    self.count   = 0
+    self.dropped = 0
+    self.clearContext()
+
+  def now(self):
+    return timer()
+
+  def setContext(self,level,tstart,tstop,iteration):
+    self.context = (level,tstart,tstop,iteration)
+
+  def clearContext(self):
+    self.context = (-1,np.nan,np.nan,-1)
+
+  def record(self,name,start,stop):
+    if name not in self.name_ids:
+      self.name_ids[name] = len(self.name_list)
+      self.name_list.append(name)
+
+    i = self.head
+    self.start[i] = start
+    self.stop[i]  = stop
+    self.names[i] = self.name_ids[name]
+    self.level[i],self.tstart[i],self.tstop[i],self.iteration[i] = self.context
+
+    self.head = (i+1) % self.capacity
+    if self.count<self.capacity:
+      self.count += 1
+    else:
+      self.dropped += 1
+  # end record
+
+  def getEvents(self,origin=0.0):
+    """
+    Get the recorded events, oldest first, as a list of dictionaries. Times are 
+    in seconds relative to origin.
+    """
+    first = (self.head-self.count) % self.capacity
+    events = []
+    for j in range(self.count):
+      i = (first+j) % self.capacity
+      events += [{'name'      : self.name_list[self.names[i]],
+                  'start'     : self.start[i]-origin,
+                  'stop'      : self.stop[i]-origin,
+                  'level'     : int(self.level[i]),
+                  'tstart'    : float(self.tstart[i]),
+                  'tstop'     : float(self.tstop[i]),
+                  'iteration' : int(self.iteration[i])}]
+    return events
+  # end getEvents
+
+  def getChromeTrace(self,comm):
+    """
+    Merge the events of every rank into a Chrome/Perfetto trace dictionary (this
+    is collective). Clocks are aligned at a barrier, each rank is a process in 
+    the trace. Returns the trace on rank 0 and None elsewhere.
+    """
+    comm.Barrier()
+    origin = timer()
+
+    all_events = comm.gather(self.getEvents(origin),root=0)
+    all_dropped = comm.gather(self.dropped,root=0)
+    if comm.Get_rank()!=0:
+      return None
+
+    t0 = min([e['start'] for events in all_events for e in events],default=0.0)
+
+    trace_events = []
+    for rank,events in enumerate(all_events):
+      trace_events += [{'name' : 'process_name', 'ph' : 'M', 'pid' : rank, 'tid' : 0,
+                        'args' : {'name' : 'rank {}'.format(rank)}}]
+      for e in events:
+        args = {'level' : e['level'], 'iteration' : e['iteration']}
+        if e['level']>=0:
+          args['tstart'] = e['tstart']
+          args['tstop']  = e['tstop']
+        trace_events += [{'name' : e['name'],
+                          'ph'   : 'X',
+                          'ts'   : 1e6*(e['start']-t0),
+                          'dur'  : 1e6*(e['stop']-e['start']),
+                          'pid'  : rank,
+                          'tid'  : 0,
+                          'args' : args}]
+
+    return {'traceEvents'     : trace_events,
+            'displayTimeUnit' : 'ms',
+            'otherData'       : {'dropped' : all_dropped}}
+  # end getChromeTrace
+
+  def writeChromeTrace(self,comm,filename):
+    """
+    Write the merged trace to a JSON file on rank 0 (this is collective). The file
+    can be loaded in chrome://tracing or https://ui.perfetto.dev
+    """
+    trace = self.getChromeTrace(comm)
+    if trace is not None:
+      with open(filename,'w') as f:
+        json.dump(trace,f)
+# end Tracer